@@ -0,0 +1,81 @@
+import argparse
+import socket
+import threading
+import time
+
+import uvicorn
+
+from flaskr.asgi import create_asgi_app
+from .common import ConfigBench, make_app, seed, serve, drive, percentile
+
+'''
+Throughput and latency of the WSGI app (threaded server) against the ASGI app (uvicorn, asyncpg)
+on the same database and with connection pools of the same size, PostgreSQL only
+
+    BENCH_DATABASE_URI=postgresql://... python -m bench.asgi --clients 10 100 --pool-size 10
+'''
+
+ENDPOINTS = [
+    ('listing', 'GET', '/api/questions?page=3', None),
+    ('search', 'GET', '/api/questions?searchTerm=question%201', None),
+    ('quiz', 'POST', '/api/quizzes', {'previous_questions': [], 'quiz_category': {'type': 'click', 'id': 0}}),
+]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def serve_asgi(app):
+    '''
+    Serve app with uvicorn from a background thread, return the server and its port
+    '''
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning',
+                                           lifespan='on'))
+    thread = threading.Thread(target=server.run)
+    thread.daemon = True
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, thread, port
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--pool-size', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--size', type=int, default=10000)
+    args = parser.parse_args()
+
+    if not ConfigBench.SQLALCHEMY_DATABASE_URI.startswith('postgres'):
+        parser.error('the ASGI app needs PostgreSQL, set BENCH_DATABASE_URI')
+    seed(make_app(), args.size)
+    options = {'pool_size': args.pool_size, 'max_overflow': 0, 'pool_timeout': 30}
+    # the serialized listings are not cached by the ASGI app, compare the database paths
+    wsgi = make_app(SQLALCHEMY_ENGINE_OPTIONS=options, RESPONSE_CACHE_SIZE=0)
+    wsgi_server = serve(wsgi)
+    asgi = create_asgi_app(test_config=type('ConfigBenchAsgi', (ConfigBench,), {
+        'SQLALCHEMY_ENGINE_OPTIONS': options})())
+    asgi_server, asgi_thread, asgi_port = serve_asgi(asgi)
+
+    print('{:<8} {:>7} {:>5} {:>8} {:>8} {:>8} {:>7}'.format(
+        'endpoint', 'clients', 'app', 'req/s', 'p50 ms', 'p99 ms', 'errors'))
+    for name, method, url, body in ENDPOINTS:
+        for clients in args.clients:
+            for label, port in (('wsgi', wsgi_server.server_port), ('asgi', asgi_port)):
+                durations, errors = drive(port, clients, args.duration, url, method, body)
+                print('{:<8} {:>7} {:>5} {:>8.0f} {:>8.1f} {:>8.1f} {:>7}'.format(
+                    name, clients, label, len(durations) / args.duration,
+                    percentile(durations, 50) * 1000, percentile(durations, 99) * 1000, errors))
+
+    wsgi_server.shutdown()
+    asgi_server.should_exit = True
+    asgi_thread.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+import argparse
+import json
+import time
+
+from .common import make_app, seed
+
+'''
+Throughput in rows per second of the bulk import against one POST /api/questions per row
+
+    python -m bench.bulk --rows 50000 --single-rows 2000
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--single-rows', type=int, default=2000,
+                        help='rows posted one at a time, fewer as it is much slower')
+    args = parser.parse_args()
+
+    app = make_app()
+    seed(app, 0)
+    client = app.test_client()
+
+    def row(i):
+        return {'question': 'question {}'.format(i), 'answer': 'answer', 'category': i % 6 + 1, 'difficulty': 1}
+
+    start = time.perf_counter()
+    for i in range(args.single_rows):
+        client.post('/api/questions', json=row(i))
+    single = args.single_rows / (time.perf_counter() - start)
+
+    body = '\n'.join(json.dumps(row(i)) for i in range(args.rows))
+    start = time.perf_counter()
+    res = json.loads(client.post('/api/questions/bulk', data=body, content_type='application/x-ndjson').data)
+    bulk = res['inserted'] / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    exported = sum(1 for _ in client.get('/api/questions/export').response)
+    export = (args.rows + args.single_rows) / (time.perf_counter() - start)
+
+    print('one at a time: {:>10.0f} rows/s'.format(single))
+    print('bulk import:   {:>10.0f} rows/s'.format(bulk))
+    print('export:        {:>10.0f} rows/s ({} chunks)'.format(export, exported))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+import argparse
+
+from .common import ConfigBench, make_app, seed, serve, drive, percentile
+
+'''
+Thundering herd on one listing: clients loop on the same page with the response cache disabled,
+with and without the coalescing of the identical requests (COALESCE_READS)
+
+    BENCH_DATABASE_URI=postgresql://... python -m bench.coalesce --clients 10 100
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--url', default='/api/questions?page=1')
+    args = parser.parse_args()
+
+    seed(make_app(), args.size)
+    print('{:>9} {:>7} {:>8} {:>8} {:>8} {:>7} {:>12}'.format(
+        'coalesce', 'clients', 'req/s', 'p50 ms', 'p99 ms', 'errors', 'queries/req'))
+    for coalesce in (False, True):
+        for clients in args.clients:
+            settings = {'COALESCE_READS': coalesce, 'RESPONSE_CACHE_SIZE': 0}
+            if ConfigBench.SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+                settings['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'check_same_thread': False}}
+            app = make_app(**settings)
+            server = serve(app)
+            durations, errors = drive(server.server_port, clients, args.duration, args.url)
+            server.shutdown()
+            print('{:>9} {:>7} {:>8.0f} {:>8.1f} {:>8.1f} {:>7} {:>12.2f}'.format(
+                'on' if coalesce else 'off', clients, len(durations) / args.duration,
+                percentile(durations, 50) * 1000, percentile(durations, 99) * 1000, errors,
+                sum(app.metrics.statements.values()) / max(len(durations), 1)))
+
+
+if __name__ == '__main__':
+    main()
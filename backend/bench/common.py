@@ -0,0 +1,160 @@
+import http.client
+import json
+import logging
+import os
+import time
+import random
+import tempfile
+import threading
+
+from werkzeug.serving import make_server
+
+from flaskr import create_app
+from flaskr.bulk import copy
+from models import Question, Category
+
+'''
+Shared helpers of the benchmarks.
+
+The database is taken from BENCH_DATABASE_URI, by default a throw away SQLite file,
+so that the benchmarks can run without any outside service.
+'''
+
+
+class ConfigBench(object):
+    SQLALCHEMY_DATABASE_URI = os.environ.get('BENCH_DATABASE_URI') or \
+        'sqlite:///' + os.path.join(tempfile.gettempdir(), 'trivia_bench.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+
+def make_app(**settings):
+    '''
+    App on the benchmark database, settings override the configuration
+    '''
+    config = type('ConfigBenchOverride', (ConfigBench,), settings)
+    return create_app(test_config=config())
+
+
+def seed(app, size, categories=6, batch=10000):
+    '''
+    Empty the tables and insert size questions spread over the categories,
+    in batches with COPY on PostgreSQL and executemany elsewhere instead of one ORM object per row
+    '''
+    session = app.db.session
+    session.query(Question).delete()
+    session.query(Category).delete()
+    session.execute(Category.__table__.insert(), [{'id': i, 'type': 'category{}'.format(i)}
+                                                   for i in range(1, categories + 1)])
+    connection = session.connection()
+    rnd = random.Random(size)
+    for start in range(0, size, batch):
+        rows = [{
+            'question': 'question {:08d} {}'.format(i, rnd.random()),
+            'answer': 'answer {}'.format(i),
+            'category': i % categories + 1,
+            'difficulty': i % 5 + 1
+        } for i in range(start, min(start + batch, size))]
+        if connection.dialect.name == 'postgresql':
+            copy(connection, rows)
+        else:
+            connection.execute(Question.__table__.insert(), rows)
+    session.commit()
+    if connection.dialect.name == 'postgresql':
+        # statistics of the new rows for the planner
+        session.execute('ANALYZE questions')
+        session.commit()
+
+
+def timeit(fn, repeat=20):
+    '''
+    Return the median duration in milliseconds of repeat calls of fn
+    '''
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - start) * 1000)
+    durations.sort()
+    return durations[len(durations) // 2]
+
+
+def serve(app):
+    '''
+    Serve app over HTTP on a free local port from a background thread, one thread per request
+    '''
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def drive(port, clients, duration, url, method='GET', body=None):
+    '''
+    clients threads send the request in a loop for duration seconds,
+    return the durations of the requests and the number of failures
+    '''
+    result = drive_requests('127.0.0.1', port, clients, duration, lambda client, rnd: (method, url, body))
+    return result.durations, result.errors
+
+
+class LoadResult(object):
+    def __init__(self):
+        self.durations = []
+        self.errors = 0
+        self.statuses = {}
+
+
+def drive_requests(host, port, clients, duration, next_request):
+    '''
+    clients threads send the requests given by next_request(client number, random generator),
+    a (method, url, JSON body or None), in a loop for duration seconds.
+    A connection failure or a 5xx is an error
+    '''
+    result = LoadResult()
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(number):
+        rnd = random.Random(number)
+        connection = http.client.HTTPConnection(host, port, timeout=60)
+        local, failed, statuses = [], 0, {}
+        while time.perf_counter() < deadline:
+            method, url, body = next_request(number, rnd)
+            headers = {'Content-Type': 'application/json'} if body is not None else {}
+            payload = json.dumps(body) if body is not None else None
+            start = time.perf_counter()
+            try:
+                connection.request(method, url, payload, headers)
+                response = connection.getresponse()
+                response.read()
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+                if response.status >= 500:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+                connection = http.client.HTTPConnection(host, port, timeout=60)
+            local.append(time.perf_counter() - start)
+        connection.close()
+        with lock:
+            result.durations.extend(local)
+            result.errors += failed
+            for status, count in statuses.items():
+                result.statuses[status] = result.statuses.get(status, 0) + count
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return result
+
+
+def percentile(durations, p):
+    durations = sorted(durations)
+    if not durations:
+        return None
+    return durations[min(len(durations) - 1, int(len(durations) * p / 100))]
@@ -0,0 +1,58 @@
+import argparse
+import random
+import time
+
+from flaskr.quiz import QuestionPool, ALL_CATEGORIES, difficulty_weight
+from .common import timeit
+
+'''
+Cost of the draws of the quiz pool at --size questions, in memory: uniform and aimed at a difficulty,
+by number of questions already asked, and of the incremental updates of the index
+
+    python -m bench.difficulty --size 1000000 --asked 0 100 1000
+'''
+
+CATEGORIES = 6
+DIFFICULTIES = 5
+
+
+class Changes(object):
+    def __init__(self, added=(), removed=()):
+        self.added = list(added)
+        self.removed = list(removed)
+        self.bulk = False
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=1000000)
+    parser.add_argument('--asked', type=int, nargs='+', default=[0, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=10000)
+    args = parser.parse_args()
+
+    pool = QuestionPool(None)
+    start = time.perf_counter()
+    pool.load((id, id % CATEGORIES + 1, id % DIFFICULTIES + 1) for id in range(1, args.size + 1))
+    print('index of {} questions built in {:.0f} ms'.format(args.size, (time.perf_counter() - start) * 1000))
+
+    print('{:>9} {:>6} {:>12} {:>12}'.format('category', 'asked', 'uniform us', 'weighted us'))
+    weight = difficulty_weight(4)
+    for category in (ALL_CATEGORIES, 1):
+        ids = pool.sample(category, max(args.asked))
+        for asked in args.asked:
+            excluded = set(ids[:asked])
+            uniform = timeit(lambda: pool.draw(category, excluded), args.repeat) * 1000
+            weighted = timeit(lambda: pool.draw(category, excluded, weight), args.repeat) * 1000
+            print('{:>9} {:>6} {:>12.2f} {:>12.2f}'.format(category, asked, uniform, weighted))
+
+    questions = [{'id': args.size + i, 'category': random.randint(1, CATEGORIES),
+                  'difficulty': random.randint(1, DIFFICULTIES)} for i in range(1, args.repeat + 1)]
+    added = timeit(lambda: pool.apply(Changes(added=[questions.pop()])), args.repeat) * 1000
+    print('creation {:.2f} us'.format(added))
+    removed = [{'id': id, 'category': id % CATEGORIES + 1, 'difficulty': id % DIFFICULTIES + 1}
+               for id in range(1, args.repeat + 1)]
+    print('deletion {:.2f} us'.format(timeit(lambda: pool.apply(Changes(removed=[removed.pop()])), args.repeat) * 1000))
+
+
+if __name__ == '__main__':
+    main()
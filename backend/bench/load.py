@@ -0,0 +1,249 @@
+import argparse
+import datetime
+import http.client
+import json
+import platform
+import subprocess
+import threading
+from urllib.parse import urlsplit
+
+from flaskr.sessions import MAX_DECK_SIZE
+from models import Question
+from .common import ConfigBench, make_app, seed, serve, drive_requests, percentile
+
+'''
+Load test of every endpoint of the API
+
+The database is seeded in bulk with --size questions, then each scenario is driven over HTTP
+by --clients concurrent clients during --duration seconds. The latencies and the throughput
+are written to a JSON file, to be compared with the run of another commit:
+
+    python -m bench.load --size 100000 --clients 1 10 50 --output head.json
+    python -m bench.load --compare base.json head.json
+
+By default the app runs in process on a threaded server with its configuration overridden by
+--setting NAME=value. With --url, an app already running (e.g. under gunicorn) on the same
+database is driven instead.
+'''
+
+PAGE_SIZE = 10
+CATEGORIES = 6
+
+
+class Scenario(object):
+    def __init__(self, name, next_request, writes=False):
+        self.name = name
+        self.next_request = next_request
+        self.writes = writes
+
+
+class Context(object):
+    '''
+    What the scenarios draw their requests from
+    '''
+
+    def __init__(self, size, ids, sessions):
+        self.size = size
+        self.pages = max(1, (size + PAGE_SIZE - 1) // PAGE_SIZE)
+        self.ids = ids
+        self.sessions = sessions
+        self._lock = threading.Lock()
+
+    def pop_id(self):
+        with self._lock:
+            return self.ids.pop() if self.ids else 0
+
+
+def scenarios(context):
+    quiz_category = {'type': 'any', 'id': 0}
+
+    def category(rnd):
+        return rnd.randint(1, CATEGORIES)
+
+    return [
+        Scenario('categories', lambda client, rnd: ('GET', '/api/categories', None)),
+        Scenario('list_shallow', lambda client, rnd: (
+            'GET', '/api/questions?page={}'.format(rnd.randint(1, min(3, context.pages))), None)),
+        Scenario('list_deep', lambda client, rnd: (
+            'GET', '/api/questions?page={}'.format(context.pages - rnd.randrange(min(10, context.pages))), None)),
+        Scenario('category', lambda client, rnd: (
+            'GET', '/api/categories/{}/questions?page={}'.format(
+                category(rnd), rnd.randint(1, max(1, min(100, context.pages // CATEGORIES)))), None)),
+        # the seeded questions are numbered, a number matches one of them
+        Scenario('search', lambda client, rnd: (
+            'GET', '/api/questions?searchTerm={:08d}'.format(rnd.randrange(max(context.size, 1))), None)),
+        Scenario('quiz', lambda client, rnd: (
+            'POST', '/api/quizzes', {'previous_questions': [], 'quiz_category': quiz_category})),
+        Scenario('quiz_session_start', lambda client, rnd: (
+            'POST', '/api/quizzes/sessions', {'quiz_category': {'id': category(rnd)}, 'size': 10})),
+        Scenario('quiz_session_next', lambda client, rnd: (
+            'GET', '/api/quizzes/sessions/{}/next'.format(rnd.choice(context.sessions)), None)),
+        Scenario('create', lambda client, rnd: (
+            'POST', '/api/questions', {'question': 'load question {}'.format(rnd.random()), 'answer': 'answer',
+                                       'category': category(rnd), 'difficulty': rnd.randint(1, 5)}), writes=True),
+        Scenario('delete', lambda client, rnd: (
+            'DELETE', '/api/questions/{}'.format(context.pop_id()), None), writes=True),
+    ]
+
+
+def create_sessions(host, port, count):
+    '''
+    Quiz sessions of the largest deck for quiz_session_next, created before the timed run
+    '''
+    connection = http.client.HTTPConnection(host, port, timeout=60)
+    sessions = []
+    try:
+        for i in range(count):
+            body = json.dumps({'quiz_category': {'id': 0}, 'size': MAX_DECK_SIZE})
+            connection.request('POST', '/api/quizzes/sessions', body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            sessions.append(json.loads(response.read())['session_id'])
+    finally:
+        connection.close()
+    return sessions
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_setting(value):
+    name, _, raw = value.partition('=')
+    try:
+        return name, json.loads(raw)
+    except ValueError:
+        return name, raw
+
+
+def summarize(scenario, clients, duration, result):
+    durations = result.durations
+    return {
+        'scenario': scenario,
+        'clients': clients,
+        'requests': len(durations),
+        'errors': result.errors,
+        'statuses': {str(status): count for status, count in sorted(result.statuses.items())},
+        'throughput': len(durations) / duration,
+        'p50_ms': percentile(durations, 50) * 1000 if durations else None,
+        'p95_ms': percentile(durations, 95) * 1000 if durations else None,
+        'p99_ms': percentile(durations, 99) * 1000 if durations else None,
+    }
+
+
+def run(args):
+    settings = dict(parse_setting(value) for value in args.setting)
+    seeding = make_app()
+    if not args.reuse or seeding.db.session.query(Question).count() != args.size:
+        seed(seeding, args.size)
+    # the deletions take the last questions, the listings keep the same pages
+    ids = [id for id, in seeding.db.session.query(Question.id).order_by(Question.id.desc())
+           .limit(args.size // 2)][::-1]
+    seeding.db.session.remove()
+
+    server = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        server = serve(make_app(**settings))
+        host, port = '127.0.0.1', server.server_port
+    context = Context(args.size, ids, create_sessions(host, port, max(args.clients) * 4))
+
+    selected = [scenario for scenario in scenarios(context) if not args.scenarios or scenario.name in args.scenarios]
+    results = []
+    print('{:<20} {:>7} {:>8} {:>8} {:>8} {:>8} {:>7}'.format(
+        'scenario', 'clients', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+    # the writes last, so that the reads see the seeded data
+    for scenario in sorted(selected, key=lambda scenario: scenario.writes):
+        for clients in args.clients:
+            result = drive_requests(host, port, clients, args.duration, scenario.next_request)
+            summary = summarize(scenario.name, clients, args.duration, result)
+            results.append(summary)
+            print('{:<20} {:>7} {:>8.0f} {:>8} {:>8} {:>8} {:>7}'.format(
+                scenario.name, clients, summary['throughput'],
+                *['{:.1f}'.format(summary[key]) if summary[key] is not None else '-'
+                  for key in ('p50_ms', 'p95_ms', 'p99_ms')], summary['errors']))
+    if server is not None:
+        server.shutdown()
+
+    report = {
+        'commit': git_commit(),
+        'date': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'database': seeding.db.engine.dialect.name,
+        'url': args.url,
+        'settings': settings,
+        'size': args.size,
+        'duration': args.duration,
+        'results': results,
+    }
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2)
+    print('written to {}'.format(args.output))
+
+
+def compare(base_path, head_path, threshold):
+    '''
+    Print the change of each scenario between two reports, flag the regressions above threshold percent
+    '''
+    with open(base_path) as base_file, open(head_path) as head_file:
+        base, head = json.load(base_file), json.load(head_file)
+    before = {(r['scenario'], r['clients']): r for r in base['results']}
+    print('{} ({}) -> {} ({})'.format(base_path, base.get('commit'), head_path, head.get('commit')))
+    print('{:<20} {:>7} {:>10} {:>10} {:>10} {:>10}  '.format(
+        'scenario', 'clients', 'req/s', 'change', 'p99 ms', 'change'))
+    regressions = 0
+    for result in head['results']:
+        previous = before.get((result['scenario'], result['clients']))
+        if previous is None:
+            continue
+        throughput = change(previous['throughput'], result['throughput'])
+        p99 = change(previous['p99_ms'], result['p99_ms'])
+        slower = (throughput is not None and throughput < -threshold) or (p99 is not None and p99 > threshold)
+        regressions += slower
+        print('{:<20} {:>7} {:>10.0f} {:>10} {:>10} {:>10}  {}'.format(
+            result['scenario'], result['clients'], result['throughput'], format_change(throughput),
+            '{:.1f}'.format(result['p99_ms']) if result['p99_ms'] is not None else '-', format_change(p99),
+            'REGRESSION' if slower else ''))
+    return regressions
+
+
+def change(before, after):
+    if not before or after is None:
+        return None
+    return (after - before) * 100.0 / before
+
+
+def format_change(value):
+    return '{:+.1f}%'.format(value) if value is not None else '-'
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=10000, help='questions seeded')
+    parser.add_argument('--reuse', action='store_true', help='keep the questions when there are already --size')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--duration', type=float, default=10, help='seconds per scenario and concurrency')
+    parser.add_argument('--scenarios', nargs='+', help='names of the scenarios to run, all by default')
+    parser.add_argument('--setting', action='append', default=[], metavar='NAME=VALUE',
+                        help='configuration of the app in process, e.g. RESPONSE_CACHE_SIZE=0')
+    parser.add_argument('--url', help='app already running on the benchmark database, e.g. http://127.0.0.1:8000')
+    parser.add_argument('--output', default='bench-{}.json'.format(git_commit() or 'results'))
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'HEAD'), help='compare two reports and exit')
+    parser.add_argument('--threshold', type=float, default=10, help='percent of change flagged by --compare')
+    args = parser.parse_args()
+
+    if args.compare:
+        raise SystemExit(1 if compare(args.compare[0], args.compare[1], args.threshold) else 0)
+    if ConfigBench.SQLALCHEMY_DATABASE_URI.startswith('sqlite') and not args.url:
+        # the threads of the server share the connections of the SQLite file
+        args.setting.append('SQLALCHEMY_ENGINE_OPTIONS={"connect_args": {"check_same_thread": false}}')
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import tracemalloc
+
+from flaskr.serialize import QuestionRow, question_rows
+from models import Question
+from .common import make_app, seed, timeit
+
+'''
+Memory and time to load n questions:
+    - orm: Question objects, tracked by the session identity map (the previous path)
+    - tuples: the columns of the questions (the listings)
+    - slots: QuestionRow value objects (the quizzes)
+    - projected: the columns id and question only (?fields=id,question)
+
+    python -m bench.memory --rows 10 1000 10000
+'''
+
+
+def peak(fn):
+    '''
+    Peak of the memory allocated while fn runs, in bytes
+    '''
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[10, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app = make_app()
+    seed(app, max(args.rows))
+    session = app.db.session
+
+    with app.app_context():
+        print('{:>6} {:>10} {:>12} {:>10} {:>10}'.format('rows', 'load', 'peak KB', 'bytes/row', 'ms'))
+        for n in args.rows:
+            query = Question.query.order_by(Question.id).limit(n)
+
+            def orm():
+                page = query.all()
+                session.expunge_all()
+                return page
+
+            loaders = [
+                ('orm', orm),
+                ('tuples', lambda: question_rows(query).all()),
+                ('slots', lambda: [QuestionRow(*row) for row in question_rows(query)]),
+                ('projected', lambda: question_rows(query, ('id', 'question')).all()),
+            ]
+            for name, load in loaders:
+                load()
+                size = peak(load)
+                print('{:>6} {:>10} {:>12.1f} {:>10.0f} {:>10.2f}'.format(
+                    n, name, size / 1024, size / n, timeit(load, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import argparse
+import json
+
+from .common import make_app, seed, timeit
+
+'''
+Compare the latency of deep pages with LIMIT/OFFSET (?page=n) and with the cursor (?after=)
+
+    python -m bench.pagination --size 100000 --pages 1 100 1000
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    # the cached responses would be timed instead of the queries
+    app = make_app(RESPONSE_CACHE_SIZE=0)
+    seed(app, args.size)
+    client = app.test_client()
+
+    # walk the cursors once to know the cursor pointing at the start of each page
+    cursors, cursor, page = {1: ''}, '', 1
+    while page < max(args.pages):
+        data = json.loads(client.get('/api/questions?after={}'.format(cursor)).data)
+        cursor, page = data['next_cursor'], page + 1
+        if cursor is None:
+            break
+        cursors[page] = cursor
+
+    print('{:>6} {:>12} {:>12}'.format('page', 'offset ms', 'cursor ms'))
+    for page in args.pages:
+        if page not in cursors:
+            print('{:>6} beyond the {} rows'.format(page, args.size))
+            continue
+        offset = timeit(lambda: client.get('/api/questions?page={}'.format(page)), args.repeat)
+        keyset = timeit(lambda: client.get('/api/questions?after={}'.format(cursors[page])), args.repeat)
+        print('{:>6} {:>12.2f} {:>12.2f}'.format(page, offset, keyset))
+
+
+if __name__ == '__main__':
+    main()
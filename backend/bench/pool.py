@@ -0,0 +1,45 @@
+import argparse
+import json
+
+from .common import ConfigBench, make_app, seed, serve, drive, percentile
+
+'''
+Load test of the connection pool: clients loop on the listings over HTTP
+and the pool waits are read from /api/stats/pool
+
+    BENCH_DATABASE_URI=postgresql://... python -m bench.pool --clients 50 200 --pool-size 5 20
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, nargs='+', default=[50, 200])
+    parser.add_argument('--pool-size', type=int, nargs='+', default=[5, 20])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--size', type=int, default=10000)
+    # a search is not served from the caches, every request needs a connection
+    parser.add_argument('--url', default='/api/questions?searchTerm=question%201')
+    args = parser.parse_args()
+
+    seed(make_app(), args.size)
+    print('{:>5} {:>7} {:>8} {:>8} {:>8} {:>7} {:>12} {:>12}'.format(
+        'pool', 'clients', 'req/s', 'p50 ms', 'p99 ms', 'errors', 'wait ms avg', 'wait ms max'))
+    for pool_size in args.pool_size:
+        for clients in args.clients:
+            options = {'pool_size': pool_size, 'max_overflow': 0, 'pool_timeout': 30}
+            if ConfigBench.SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+                options['connect_args'] = {'check_same_thread': False}
+            app = make_app(SQLALCHEMY_ENGINE_OPTIONS=options, RESPONSE_CACHE_SIZE=0)
+            server = serve(app)
+            durations, errors = drive(server.server_port, clients, args.duration, args.url)
+            server.shutdown()
+            stats = app.test_client().get('/api/stats/pool')
+            pool = json.loads(stats.data)['pool']
+            print('{:>5} {:>7} {:>8.0f} {:>8.1f} {:>8.1f} {:>7} {:>12.2f} {:>12.1f}'.format(
+                pool_size, clients, len(durations) / args.duration,
+                percentile(durations, 50) * 1000, percentile(durations, 99) * 1000, errors,
+                pool['wait_ms_total'] / max(pool['checkouts'], 1), pool['wait_ms_max']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import argparse
+import json
+import random
+
+from sqlalchemy.sql.expression import func
+
+from models import Question
+from .common import make_app, seed, timeit
+
+'''
+Latency of a quiz step with the in memory pool against ORDER BY random() with NOT IN,
+by table size and by number of questions already asked, and of --count questions drawn one request
+each against one request with count
+
+    python -m bench.quiz --sizes 10000 100000 1000000 --asked 0 100 1000 --count 10
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--asked', type=int, nargs='+', default=[0, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--count', type=int, default=10)
+    args = parser.parse_args()
+
+    print('{:>9} {:>6} {:>9} {:>14} {:>12} {:>12}'.format(
+        'rows', 'asked', 'pool ms', 'random() ms', 'singles ms', 'count ms'))
+    for size in args.sizes:
+        app = make_app()
+        seed(app, size)
+        client = app.test_client()
+        ids = [id for id, in app.db.session.query(Question.id).filter(Question.category == 1)]
+        # the first draw loads the pool, it is not part of the latency
+        client.post('/api/quizzes', json={'previous_questions': [], 'quiz_category': {'id': 1}})
+        for asked in args.asked:
+            previous = random.sample(ids, min(asked, len(ids)))
+            body = {'previous_questions': previous, 'quiz_category': {'id': 1}}
+            pool_ms = timeit(lambda: client.post('/api/quizzes', json=body), args.repeat)
+
+            def legacy():
+                with app.app_context():
+                    Question.query.filter(Question.id.notin_(previous)).filter(Question.category == 1) \
+                        .order_by(func.random()).limit(1).one_or_none().format()
+            legacy_ms = timeit(legacy, args.repeat)
+
+            def singles():
+                asked_now = list(previous)
+                for i in range(args.count):
+                    res = client.post('/api/quizzes', json=dict(body, previous_questions=asked_now))
+                    asked_now.append(json.loads(res.data)['question']['id'])
+            singles_ms = timeit(singles, args.repeat)
+            count_ms = timeit(lambda: client.post('/api/quizzes', json=dict(body, count=args.count)), args.repeat)
+            print('{:>9} {:>6} {:>9.2f} {:>14.2f} {:>12.2f} {:>12.2f}'.format(
+                size, asked, pool_ms, legacy_ms, singles_ms, count_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+import argparse
+
+from .common import make_app, seed, timeit
+
+'''
+Compare the latency of the searches with the historical ILIKE and with the full text engine
+(tsvector on PostgreSQL, in memory inverted index elsewhere)
+
+    python -m bench.search --sizes 10000 100000 1000000
+'''
+
+TERMS = ['question 0000', 'answer 42', '0000123', 'nomatch']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--terms', nargs='+', default=TERMS)
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    print('{:>9} {:>16} {:>10} {:>12}'.format('rows', 'term', 'like ms', 'fulltext ms'))
+    for size in args.sizes:
+        like = make_app(SEARCH_ENGINE='like', RESPONSE_CACHE_SIZE=0)
+        seed(like, size)
+        fulltext = make_app(SEARCH_ENGINE='fulltext', RESPONSE_CACHE_SIZE=0)
+        # the first search builds the in memory index, it is not part of the latency
+        fulltext.test_client().get('/api/questions?searchTerm=warmup')
+        for term in args.terms:
+            url = '/api/questions?searchAnswers=true&searchTerm={}'.format(term)
+            like_ms = timeit(lambda: like.test_client().get(url), args.repeat)
+            fulltext_ms = timeit(lambda: fulltext.test_client().get(url), args.repeat)
+            print('{:>9} {:>16} {:>10.2f} {:>12.2f}'.format(size, term, like_ms, fulltext_ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+import argparse
+
+from flask import jsonify
+
+from flaskr import serialize
+from flaskr.serialize import QuestionEncoder, question_rows
+from models import Question
+from .common import make_app, seed, timeit
+
+'''
+Cost of encoding a listing of n questions, in microseconds:
+    - orm: Question objects, format() and jsonify (the previous path)
+    - json, orjson: column tuples encoded by QuestionEncoder without its fragments
+    - fragments: column tuples whose fragments are already cached
+The load columns also time the query of the page.
+
+    python -m bench.serialize --rows 10 100 1000
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    app = make_app()
+    seed(app, max(args.rows))
+    categories = app.category_cache.get().categories
+    orjson = serialize.orjson
+
+    def encoders():
+        yield 'json', QuestionEncoder(0), None
+        if orjson is not None:
+            yield 'orjson', QuestionEncoder(0), orjson
+        yield 'fragments', QuestionEncoder(max(args.rows)), orjson
+
+    with app.test_request_context():
+        print('{:>6} {:>10} {:>10} {:>10} {:>10} {:>12} {:>12}'.format(
+            'rows', 'orm us', 'json us', 'orjson us', 'fragm. us', 'orm load us', 'rows load us'))
+        for n in args.rows:
+            objects = Question.query.order_by(Question.id).limit(n).all()
+            rows = question_rows(Question.query.order_by(Question.id)).limit(n).all()
+            payload = {'success': True, 'total_questions': n, 'categories': categories}
+            results = {'orm': timeit(lambda: jsonify(dict(payload, questions=[o.format() for o in objects])),
+                                     args.repeat)}
+            for name, encoder, module in encoders():
+                serialize.orjson = module
+                encoder.encode(payload, rows)
+                results[name] = timeit(lambda: encoder.encode(payload, rows), args.repeat)
+            serialize.orjson = orjson
+            encoder = QuestionEncoder(0)
+
+            def orm_load():
+                page = Question.query.order_by(Question.id).limit(n).all()
+                jsonify(dict(payload, questions=[o.format() for o in page]))
+                app.db.session.expunge_all()
+
+            def rows_load():
+                encoder.encode(payload, question_rows(Question.query.order_by(Question.id)).limit(n).all())
+
+            print('{:>6} {:>10.0f} {:>10.0f} {:>10} {:>10.0f} {:>12.0f} {:>12.0f}'.format(
+                n, results['orm'] * 1000, results['json'] * 1000,
+                '{:.0f}'.format(results['orjson'] * 1000) if 'orjson' in results else '-',
+                results['fragments'] * 1000, timeit(orm_load, args.repeat) * 1000,
+                timeit(rows_load, args.repeat) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+'''
+Cold start of a worker and latency of its first requests, each measured in a new interpreter:
+    - migrate: the app checks the migrations when it is created (flask run)
+    - skip: DB_MIGRATE_ON_START=false, the migrations are left to the deployment
+    - warm: skip, and warm_up before the first request (gunicorn.conf.py)
+
+    BENCH_DATABASE_URI=postgresql://... python -m bench.startup --size 100000
+'''
+
+FIRST_REQUESTS = (
+    ('GET', '/api/categories', None),
+    ('GET', '/api/questions', None),
+    ('GET', '/api/categories/1/questions', None),
+    ('POST', '/api/quizzes', {'previous_questions': [], 'quiz_category': {'id': 0}}),
+)
+MODES = ('migrate', 'skip', 'warm')
+
+
+def child(mode):
+    start = time.perf_counter()
+    from flaskr.launch import warm_up
+    from .common import make_app
+    timings = {'import': (time.perf_counter() - start) * 1000}
+    start = time.perf_counter()
+    app = make_app(DB_MIGRATE_ON_START=mode == 'migrate')
+    timings['create_app'] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    if mode == 'warm':
+        warm_up(app)
+    timings['warm_up'] = (time.perf_counter() - start) * 1000
+    client = app.test_client()
+    for method, url, body in FIRST_REQUESTS:
+        start = time.perf_counter()
+        client.open(url, method=method, json=body)
+        timings[url] = (time.perf_counter() - start) * 1000
+    print(json.dumps(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.child)
+
+    from .common import make_app, seed
+    seed(make_app(), args.size)
+    columns = ['import', 'create_app', 'warm_up'] + [url for method, url, body in FIRST_REQUESTS]
+    print('{:>8} '.format('ms') + ' '.join('{:>{}}'.format(column, max(len(column), 8)) for column in columns))
+    for mode in MODES:
+        runs = [json.loads(subprocess.check_output([sys.executable, '-m', 'bench.startup', '--child', mode])
+                           .decode('utf-8').splitlines()[-1]) for _ in range(args.repeat)]
+        # the median of the runs
+        print('{:>8} '.format(mode) + ' '.join('{:>{}.1f}'.format(
+            sorted(run[column] for run in runs)[len(runs) // 2], max(len(column), 8)) for column in columns))
+
+
+if __name__ == '__main__':
+    main()
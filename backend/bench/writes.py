@@ -0,0 +1,48 @@
+import argparse
+import time
+
+from .common import ConfigBench, make_app, seed, serve, drive, percentile
+
+'''
+Question creation under load, committed by each request (sync) or queued and committed
+by batches (batched, see flaskr.writes)
+
+    BENCH_DATABASE_URI=postgresql://... python -m bench.writes --clients 10 50
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, nargs='+', default=[10, 50])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--size', type=int, default=10000)
+    args = parser.parse_args()
+
+    body = {'question': 'submitted question', 'answer': 'answer', 'category': 1, 'difficulty': 3}
+    print('{:>8} {:>7} {:>8} {:>8} {:>8} {:>7} {:>9} {:>8}'.format(
+        'mode', 'clients', 'req/s', 'p50 ms', 'p99 ms', 'errors', 'drain ms', 'batches'))
+    for durability in ('sync', 'batched'):
+        for clients in args.clients:
+            seed(make_app(), args.size)
+            settings = {'QUESTION_WRITE_DURABILITY': durability}
+            if ConfigBench.SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+                settings['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'check_same_thread': False}}
+            app = make_app(**settings)
+            server = serve(app)
+            durations, errors = drive(server.server_port, clients, args.duration, '/api/questions',
+                                      method='POST', body=body)
+            server.shutdown()
+            drain, batches = 0.0, '-'
+            if app.question_writer is not None:
+                # the questions still queued when the load stops
+                start = time.perf_counter()
+                app.question_writer.flush()
+                drain = time.perf_counter() - start
+                batches = app.question_writer.stats()['batches']
+            print('{:>8} {:>7} {:>8.0f} {:>8.1f} {:>8.1f} {:>7} {:>9.1f} {:>8}'.format(
+                durability, clients, len(durations) / args.duration,
+                percentile(durations, 50) * 1000, percentile(durations, 99) * 1000, errors, drain * 1000, batches))
+
+
+if __name__ == '__main__':
+    main()
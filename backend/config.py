@@ -1,12 +1,95 @@
 import os
 
 
+def engine_options(uri):
+    '''
+    Options of the SQLAlchemy engine, read from the environment:
+        - DB_POOL_SIZE, connections kept open by each worker
+        - DB_MAX_OVERFLOW, connections opened above DB_POOL_SIZE under load
+        - DB_POOL_TIMEOUT, seconds waited for a connection before failing the request
+        - DB_POOL_RECYCLE, seconds after which a connection is replaced
+        - DB_POOL_PRE_PING, whether a connection is tested before being used
+        - DB_STATEMENT_TIMEOUT, milliseconds after which PostgreSQL cancels a statement, 0 for none
+        - DB_PGBOUNCER, when true the connections are pooled by a local PgBouncer: they are not kept by the
+        workers and DB_STATEMENT_TIMEOUT is not sent (PgBouncer rejects it, set it on the database role instead)
+    '''
+    if uri.startswith('sqlite'):
+        return {}
+    if (os.environ.get('DB_PGBOUNCER') or 'false').lower() == 'true':
+        from sqlalchemy.pool import NullPool
+        return {'poolclass': NullPool}
+    options = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE') or 5),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW') or 10),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT') or 30),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE') or 1800),
+        'pool_pre_ping': (os.environ.get('DB_POOL_PRE_PING') or 'true').lower() == 'true'
+    }
+    statement_timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT') or 0)
+    if statement_timeout:
+        options['connect_args'] = {'options': '-c statement_timeout={}'.format(statement_timeout)}
+    return options
+
+
 class Config(object):
     DATABASE_NAME = os.environ.get('DATABASE_NAME') or 'trivia'
     DATABASE_CREDENTIALS = os.environ.get('DATABASE_CREDENTIALS') or 'postgres:postgres'
     DATABASE_HOST_PORT = os.environ.get('DATABASE_HOST_PORT') or 'localhost:15432'
     SQLALCHEMY_DATABASE_URI = "postgres://{}@{}/{}".format(DATABASE_CREDENTIALS, DATABASE_HOST_PORT, DATABASE_NAME)
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # apply the migrations when the app is created, false when they are run by the deployment
+    DB_MIGRATE_ON_START = (os.environ.get('DB_MIGRATE_ON_START') or 'true').lower() == 'true'
+    # when false, the total_questions of a search is the estimate of the planner
+    SEARCH_TOTAL_EXACT = (os.environ.get('SEARCH_TOTAL_EXACT') or 'true').lower() != 'false'
+    # like: substring of the question, fulltext: ranked words of the question
+    SEARCH_ENGINE = os.environ.get('SEARCH_ENGINE') or 'like'
+    # search the answers as well when the request does not tell (searchAnswers)
+    SEARCH_INCLUDE_ANSWERS = (os.environ.get('SEARCH_INCLUDE_ANSWERS') or 'false').lower() == 'true'
+    # seconds the categories are kept in memory, 0 to keep them until they change
+    CATEGORY_CACHE_TTL = int(os.environ.get('CATEGORY_CACHE_TTL') or 300)
+    # comma separated URIs of the read replicas serving the GET requests and the quizzes
+    SQLALCHEMY_REPLICA_URIS = [uri for uri in (os.environ.get('DATABASE_REPLICA_URIS') or '').split(',') if uri]
+    # seconds a client reads from the primary after a write, and a failing replica is skipped
+    READ_YOUR_WRITES_SECONDS = int(os.environ.get('READ_YOUR_WRITES_SECONDS') or 5)
+    REPLICA_RETRY_SECONDS = int(os.environ.get('REPLICA_RETRY_SECONDS') or 30)
+    # seconds the clients and the CDN may keep the listings, 0 to revalidate them with their ETag every time
+    HTTP_CACHE_MAX_AGE = int(os.environ.get('HTTP_CACHE_MAX_AGE') or 0)
+    # listings kept serialized in memory, 0 to disable
+    RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE') or 1024)
+    RESPONSE_CACHE_MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES') or 64 * 1024 * 1024)
+    # questions kept encoded in JSON by each worker, 0 to encode them for every response
+    QUESTION_FRAGMENT_CACHE_SIZE = int(os.environ.get('QUESTION_FRAGMENT_CACHE_SIZE') or 10000)
+    # memory: quiz sessions kept by each worker, database: shared by the workers
+    QUIZ_SESSION_STORE = os.environ.get('QUIZ_SESSION_STORE') or 'memory'
+    QUIZ_SESSION_CAPACITY = int(os.environ.get('QUIZ_SESSION_CAPACITY') or 10000)
+    QUIZ_SESSION_TTL = int(os.environ.get('QUIZ_SESSION_TTL') or 3600)
+    # width, in difficulty levels, of the draws around the difficulty aimed at by an adaptive quiz
+    QUIZ_DIFFICULTY_SPREAD = float(os.environ.get('QUIZ_DIFFICULTY_SPREAD') or 1.0)
+    # sync: a question is committed before POST /questions answers, batched: it is queued and committed
+    # with the others received within QUESTION_WRITE_INTERVAL seconds, up to QUESTION_WRITE_BATCH_SIZE
+    QUESTION_WRITE_DURABILITY = os.environ.get('QUESTION_WRITE_DURABILITY') or 'sync'
+    QUESTION_WRITE_QUEUE_SIZE = int(os.environ.get('QUESTION_WRITE_QUEUE_SIZE') or 10000)
+    QUESTION_WRITE_BATCH_SIZE = int(os.environ.get('QUESTION_WRITE_BATCH_SIZE') or 500)
+    QUESTION_WRITE_INTERVAL = float(os.environ.get('QUESTION_WRITE_INTERVAL') or 0.05)
+    # with several workers, share the changes through the cache_generation table,
+    # checked at most every CACHE_GENERATION_INTERVAL seconds
+    CACHE_GENERATION_SYNC = (os.environ.get('CACHE_GENERATION_SYNC') or 'false').lower() == 'true'
+    CACHE_GENERATION_INTERVAL = float(os.environ.get('CACHE_GENERATION_INTERVAL') or 1.0)
+    # statements slower than SLOW_QUERY_MS milliseconds are logged with their plan, 0 to disable,
+    # and a request running the same statement N_PLUS_ONE_THRESHOLD times is logged as an N+1
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS') or 100)
+    N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD') or 10)
+    # identical read requests running at the same time share the response of the first one
+    COALESCE_READS = (os.environ.get('COALESCE_READS') or 'true').lower() == 'true'
+    # requests per second and burst allowed to a client on each route of the API, 0 for no limit
+    RATE_LIMIT_PER_SECOND = float(os.environ.get('RATE_LIMIT_PER_SECOND') or 0)
+    RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST') or 20)
+    # memory: buckets kept by each worker, at most RATE_LIMIT_CAPACITY, database: shared by the workers
+    RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE') or 'memory'
+    RATE_LIMIT_CAPACITY = int(os.environ.get('RATE_LIMIT_CAPACITY') or 100000)
+    # directory of the gzipped quiz packs of the categories, shared by the workers, instance/packs when empty
+    QUIZ_PACK_DIR = os.environ.get('QUIZ_PACK_DIR') or None
 
 
 class ConfigTest(object):
@@ -1,11 +1,32 @@
+import csv
+import gzip
 import os
-from flask import Flask, request, abort, jsonify
+import click
+from flask import Flask, Response, request, abort, jsonify, stream_with_context, g, send_file
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from sqlalchemy.sql.expression import func
 
-from models import setup_db, Question, Category
-from config import Config
+from models import setup_db, Question, register_change_listener
+from config import Config, engine_options
+from .cursor import ordering, seek, encode_cursor, decode_cursor, InvalidCursor
+from .counts import QuestionCounts, estimate_count
+from .categories import CategoryCache
+from .generation import GenerationWatcher
+from .search import make_search_engine
+from .quiz import QuestionPool, quiz_weight, quiz_count
+from .sessions import make_session_store, SessionNotFound, DECK_SIZE, MAX_DECK_SIZE
+from .bulk import Importer, RowError, read_lines, parse_ndjson, parse_csv, export_ndjson, validate
+from .batch import parse_ids, validate_update, delete_questions, update_questions
+from .http_cache import DataGeneration, conditional, cache_control
+from .response_cache import ResponseCache, memoized
+from .pool import PoolStats, pool_class, pool_status
+from .routing import init_routing, replica_read
+from .serialize import FIELDS, QuestionEncoder, question_rows, parse_fields, fetch_question, dumps, json_response
+from .metrics import Metrics, start_request, finish_request, resource_families
+from .limits import make_rate_limiter, retry_after_header
+from .coalesce import SingleFlight, coalesced
+from .writes import QuestionWriter, QueueFull
+from .packs import PackStore
 
 QUESTIONS_PER_PAGE = 10
 
@@ -21,7 +42,102 @@ def create_app(test_config=None):
         # load the test config if passed in
         app.config.from_object(test_config)
     
+    app.metrics = Metrics(app.config.get('SLOW_QUERY_MS', 100) / 1000.0, app.config.get('N_PLUS_ONE_THRESHOLD', 10))
+    app.extensions['trivia_metrics'] = app.metrics
+    app.before_request(start_request)
+
+    # time the waits for a connection of the pools sized in the configuration
+    app.pool_stats = PoolStats()
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if 'pool_size' in options and 'poolclass' not in options:
+        options['poolclass'] = pool_class(app.pool_stats)
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
     app.db = setup_db(app)
+    app.db_router = init_routing(app, engine_options)
+
+    app.rate_limiter = None
+    if app.config.get('RATE_LIMIT_PER_SECOND', 0):
+        app.rate_limiter = make_rate_limiter(app.config.get('RATE_LIMIT_STORE', 'memory'), app.db.get_engine(app),
+                                             app.config['RATE_LIMIT_PER_SECOND'], app.config.get('RATE_LIMIT_BURST', 20),
+                                             app.config.get('RATE_LIMIT_CAPACITY', 100000))
+
+        @app.before_request
+        def limit_rate():
+            if request.url_rule is None or request.method == 'OPTIONS' or not request.path.startswith('/api/'):
+                return
+            allowed, g.retry_after = app.rate_limiter.hit(
+                '{} {} {}'.format(request.remote_addr, request.method, request.url_rule.rule))
+            if not allowed:
+                abort(429)
+
+    app.question_counts = QuestionCounts(app.db.session)
+    app.question_counts.rebuild()
+    register_change_listener(app, app.question_counts.apply)
+    app.category_cache = CategoryCache(app.db.session, app.config.get('CATEGORY_CACHE_TTL', 300))
+    register_change_listener(app, app.category_cache.apply)
+
+    app.search_engine = make_search_engine(app.config.get('SEARCH_ENGINE', 'like'), app.db.session)
+    if hasattr(app.search_engine, 'apply'):
+        register_change_listener(app, app.search_engine.apply)
+
+    app.question_pool = QuestionPool(app.db.session)
+    register_change_listener(app, app.question_pool.apply)
+
+    app.quiz_sessions = make_session_store(app.config.get('QUIZ_SESSION_STORE', 'memory'), app.db.session,
+                                           app.config.get('QUIZ_SESSION_CAPACITY', 10000),
+                                           app.config.get('QUIZ_SESSION_TTL', 3600))
+
+    app.generation_watcher = None
+    if app.config.get('CACHE_GENERATION_SYNC'):
+        app.generation_watcher = GenerationWatcher(app, app.db.session,
+                                                   app.config.get('CACHE_GENERATION_INTERVAL', 1.0))
+        app.generation_watcher.start()
+        register_change_listener(app, app.generation_watcher.note_local)
+
+        @app.before_request
+        def check_generation():
+            app.generation_watcher.check()
+
+    app.data_generation = DataGeneration(app.generation_watcher)
+    register_change_listener(app, app.data_generation.apply)
+    cached = conditional(app.data_generation)
+
+    app.single_flight = SingleFlight() if app.config.get('COALESCE_READS', True) else None
+    shared = coalesced(app.single_flight, app.data_generation.stamp)
+
+    app.response_cache = None
+    if app.config.get('RESPONSE_CACHE_SIZE', 1024):
+        app.response_cache = ResponseCache(app.config.get('RESPONSE_CACHE_SIZE', 1024),
+                                           app.config.get('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+        register_change_listener(app, app.response_cache.apply)
+
+    app.question_encoder = QuestionEncoder(app.config.get('QUESTION_FRAGMENT_CACHE_SIZE', 10000))
+
+    app.question_writer = None
+    if app.config.get('QUESTION_WRITE_DURABILITY', 'sync') == 'batched':
+        app.question_writer = QuestionWriter(app, app.config.get('QUESTION_WRITE_QUEUE_SIZE', 10000),
+                                             app.config.get('QUESTION_WRITE_BATCH_SIZE', 500),
+                                             app.config.get('QUESTION_WRITE_INTERVAL', 0.05))
+    elif app.config.get('QUESTION_WRITE_DURABILITY', 'sync') != 'sync':
+        raise ValueError('Unknown QUESTION_WRITE_DURABILITY {}'.format(app.config['QUESTION_WRITE_DURABILITY']))
+
+    app.pack_store = PackStore(app.db.session,
+                               app.config.get('QUIZ_PACK_DIR') or os.path.join(app.instance_path, 'packs'))
+    register_change_listener(app, app.pack_store.apply)
+
+    @app.cli.command('build-packs')
+    @click.argument('category_ids', nargs=-1, type=int)
+    def build_packs(category_ids):
+        '''
+        Build the quiz packs of the categories, all of them when none is given
+        '''
+        categories = app.category_cache.get().categories
+        for category_id in category_ids or sorted(categories):
+            if category_id not in categories:
+                raise click.BadParameter('unknown category {}'.format(category_id))
+            pack = app.pack_store.build(category_id, categories[category_id])
+            click.echo('{} {} {} questions'.format(pack.path, pack.version, pack.total))
     
     '''
     @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -39,16 +155,32 @@ def create_app(test_config=None):
         response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,true')
         response.headers.add('Access-Control-Allow-Methods', 'GET,PATCH,POST,PUT,DELETE,OPTIONS')
         response.headers.add('Access-Control-Allow-Credentials', 'true')
-        return response
+        timings = ['pool;dur={:.3f}'.format(g.pool_wait * 1000)] if 'pool_wait' in g else []
+        timings += finish_request(app.metrics, response)
+        if timings:
+            response.headers.add('Server-Timing', ', '.join(timings))
+        return cache_control(response, app.config.get('HTTP_CACHE_MAX_AGE', 0))
+
+    def projection():
+        '''
+        Fields returned (fields=) and columns selected, with the sort key needed by the cursor
+        '''
+        try:
+            fields = parse_fields(request.args.get('fields'))
+        except ValueError:
+            abort(400)
+        return fields, fields + tuple(field for field in ('question', 'id') if field not in fields)
 
-    def paginate(request, query):
+    def paginate(request, query, total=None, columns=FIELDS):
         page = request.args.get('page', 1, type=int)
         # if 1st index of the page is greater than the last index of the result
         # then abort
-        if query.count() - 1 < (page - 1) * QUESTIONS_PER_PAGE:
+        if total is not None and total - 1 < (page - 1) * QUESTIONS_PER_PAGE:
+            abort(404)
+        selection = question_rows(query, columns).limit(QUESTIONS_PER_PAGE).offset((page - 1) * QUESTIONS_PER_PAGE).all()
+        # without an exact total, the bound is only known once the page is fetched
+        if not selection:
             abort(404)
-        selection = query.limit(QUESTIONS_PER_PAGE).offset((page - 1) * QUESTIONS_PER_PAGE).all()
-        selection = [o.format() for o in selection]
         return selection
     
     '''
@@ -57,17 +189,19 @@ def create_app(test_config=None):
     for all available categories.
     '''
     @app.route("/api/categories")
+    @cached
+    @shared
     def retrieve_categories():
-        selection = Category.query.order_by(Category.type).all()
+        categories = app.category_cache.get().categories
         
-        if len(selection) == 0:
+        if len(categories) == 0:
             abort(404)
 
-        return jsonify({
+        return json_response(dumps({
             'success': True,
-            'categories': {cat.id: cat.type for cat in selection},
-            'total_categories': len(selection)
-        })
+            'categories': categories,
+            'total_categories': len(categories)
+        }))
     
     '''
     @TODO:
@@ -83,22 +217,73 @@ def create_app(test_config=None):
     '''
     
     @app.route('/api/questions')
+    @cached
+    @memoized(app.response_cache)
+    @shared
     def retrieve_questions():
         selection = Question.query
         search_term = request.args.get('searchTerm')
-        if search_term:
-            selection = selection.filter(Question.question.ilike('%{}%'.format(search_term)))
-        return return_questions(selection)
+        if not search_term:
+            return return_questions(selection, app.question_counts.total())
+        answers = request.args.get('searchAnswers', str(app.config.get('SEARCH_INCLUDE_ANSWERS', False)))
+        found = app.search_engine.search(selection, search_term, answers.lower() in ('1', 'true', 'yes'))
+        if found.ids is not None:
+            # ranked in memory, only the questions of the page are loaded
+            return return_question_ids(found.ids)
+        selection = found.query
+        exact = request.args.get('exact', str(app.config.get('SEARCH_TOTAL_EXACT', True)))
+        if exact.lower() in ('0', 'false', 'no'):
+            return return_questions(selection, estimate_count(app.db.session, selection), exact=False,
+                                    rank=found.rank)
+        return return_questions(selection, selection.count(), rank=found.rank)
 
-    def return_questions(selection):
-        selection = selection.order_by(Question.question)
-        paginated = paginate(request, selection)
-        return jsonify({
+    def return_question_ids(ids):
+        result = {
             'success': True,
-            'questions': paginated,
-            'total_questions': selection.count(),
-            'categories': {cat.id: cat.type for cat in Category.query.order_by(Category.type).all()}
-        })
+            'total_questions': len(ids),
+            'categories': app.category_cache.get().categories
+        }
+        if 'after' in request.args:
+            # the cursor holds the id of the last question of the previous page, in the order of the ranking
+            start = 0
+            if request.args.get('after'):
+                try:
+                    start = ids.index(decode_cursor(request.args.get('after'))[1]) + 1
+                except (InvalidCursor, ValueError):
+                    abort(400)
+            page_ids = ids[start:start + QUESTIONS_PER_PAGE]
+            result['next_cursor'] = None
+            if start + QUESTIONS_PER_PAGE < len(ids):
+                result['next_cursor'] = encode_cursor('', page_ids[-1])
+        else:
+            page = request.args.get('page', 1, type=int)
+            page_ids = ids[(page - 1) * QUESTIONS_PER_PAGE:page * QUESTIONS_PER_PAGE]
+        if not page_ids:
+            abort(404)
+        fields, columns = projection()
+        selection = question_rows(Question.query.filter(Question.id.in_(page_ids)), columns)
+        rows = {row.id: row for row in selection}
+        return json_response(app.question_encoder.encode(result, [rows[id] for id in page_ids if id in rows], fields))
+
+    def return_questions(selection, total, exact=True, rank=None):
+        fields, columns = projection()
+        result = {
+            'success': True,
+            'total_questions': total,
+            'categories': app.category_cache.get().categories
+        }
+        # the presence of 'after', even empty for the first page, opts in the cursor mode
+        if 'after' in request.args:
+            try:
+                rows, result['next_cursor'] = seek(question_rows(selection, columns), request.args.get('after'),
+                                                   QUESTIONS_PER_PAGE, rank)
+            except InvalidCursor:
+                abort(400)
+            if not rows:
+                abort(404)
+        else:
+            rows = paginate(request, selection.order_by(*ordering(rank)), total if exact else None, columns)
+        return json_response(app.question_encoder.encode(result, rows, fields))
 
     '''
     @TODO:
@@ -122,6 +307,46 @@ def create_app(test_config=None):
         except:
             abort(422)
     
+    @app.route('/api/questions', methods=['DELETE'])
+    def delete_question_batch():
+        try:
+            ids = parse_ids(request.args.get('ids', ''))
+        except ValueError:
+            abort(400)
+        try:
+            deleted = delete_questions(app.db.session, ids)
+        except:
+            app.db.session.rollback()
+            abort(422)
+        if not deleted:
+            abort(404)
+        return jsonify({
+            'success': True,
+            'deleted': deleted
+        })
+
+    @app.route('/api/questions', methods=['PATCH'])
+    def update_question_batch():
+        body = request.get_json()
+        if not isinstance(body, list) or not body:
+            abort(400)
+        categories = app.category_cache.get().categories
+        try:
+            updates = [validate_update(row, categories) for row in body]
+        except RowError:
+            abort(422)
+        if len({update['id'] for update in updates}) != len(updates):
+            abort(422)
+        try:
+            updated = update_questions(app.db.session, updates)
+        except:
+            app.db.session.rollback()
+            abort(422)
+        return jsonify({
+            'success': True,
+            'updated': updated
+        })
+
     '''
     @TODO:
     Create an endpoint to POST a new question,
@@ -140,6 +365,9 @@ def create_app(test_config=None):
         new_category = body.get('category', None)
         new_answer = body.get('answer', None)
         new_difficulty = body.get('difficulty', 0)
+
+        if app.question_writer is not None:
+            return submit_question(body)
         
         try:
             question = Question(question=new_question, answer=new_answer,
@@ -153,6 +381,56 @@ def create_app(test_config=None):
         except:
             abort(422)
         
+    def submit_question(body):
+        # validated now, the client is not told later about a question that can not be inserted
+        try:
+            values = validate(dict(body, difficulty=body.get('difficulty', 0)), app.category_cache.get().categories)
+        except RowError:
+            abort(422)
+        try:
+            tracking_id = app.question_writer.submit(values)
+        except QueueFull:
+            abort(503)
+        return jsonify({
+            'success': True,
+            'tracking_id': tracking_id,
+            'status': 'queued'
+        }), 202, {'Location': '/api/questions/submissions/{}'.format(tracking_id)}
+
+    @app.route('/api/questions/submissions/<tracking_id>')
+    def retrieve_submission(tracking_id):
+        status = app.question_writer.status(tracking_id) if app.question_writer is not None else None
+        if status is None:
+            abort(404)
+        return jsonify({
+            'success': True,
+            'status': status[0],
+            'question_id': status[1]
+        })
+
+    @app.route('/api/questions/bulk', methods=['POST'])
+    def import_questions():
+        # the body is read as a stream, line by line, and never fully loaded
+        lines = read_lines(request.stream)
+        if request.mimetype == 'text/csv' or request.args.get('format') == 'csv':
+            rows = parse_csv(lines)
+        else:
+            rows = parse_ndjson(lines)
+        try:
+            importer = Importer(app.db.session, app.category_cache.get().categories).run(rows)
+        except (UnicodeError, csv.Error):
+            abort(400)
+        return jsonify({
+            'success': True,
+            'inserted': importer.inserted,
+            'total_errors': importer.error_count,
+            'errors': importer.errors
+        }), 200
+
+    @app.route('/api/questions/export')
+    def export_questions():
+        return Response(stream_with_context(export_ndjson(app.db.session)), mimetype='application/x-ndjson')
+
     '''
     @TODO:
     Create a POST endpoint to get questions based on a search term.
@@ -177,9 +455,38 @@ def create_app(test_config=None):
     '''
 
     @app.route('/api/categories/<int:category_id>/questions')
+    @cached
+    @memoized(app.response_cache, tag=lambda category_id: category_id)
+    @shared
     def retrieve_category_question(category_id):
         selection = Question.query.filter(Question.category == category_id)
-        return return_questions(selection)
+        return return_questions(selection, app.question_counts.category(category_id))
+
+    @app.route('/api/categories/<int:category_id>/pack')
+    def retrieve_category_pack(category_id):
+        categories = app.category_cache.get().categories
+        if category_id not in categories:
+            abort(404)
+        pack = app.pack_store.get(category_id, categories[category_id])
+        if request.if_none_match.contains(pack.version):
+            response = Response(status=304)
+        else:
+            pack, packed = app.pack_store.open(category_id, categories[category_id])
+            if 'gzip' in request.accept_encodings:
+                # the file is sent as written, the client decompresses it
+                response = send_file(packed, mimetype='application/json', conditional=False)
+                response.content_length = os.fstat(packed.fileno()).st_size
+                response.headers['Content-Encoding'] = 'gzip'
+                response.headers.pop('Content-Disposition', None)
+            else:
+                with gzip.GzipFile(fileobj=packed, mode='rb') as decompressed, packed:
+                    response = json_response(decompressed.read())
+        # the version identifies the content, whatever the encoding
+        response.set_etag(pack.version)
+        response.headers['Vary'] = 'Accept-Encoding'
+        # the after_request default, rather than the one of send_file
+        response.headers.pop('Cache-Control', None)
+        return response
     '''
     @TODO:
     Create a POST endpoint to get questions to play the quiz.
@@ -193,8 +500,8 @@ def create_app(test_config=None):
     '''
 
     @app.route('/api/quizzes', methods=['POST'])
+    @replica_read
     def generate_quiz():
-        print('Here')
         body = request.get_json()
     
         previous_questions = body.get('previous_questions', [])
@@ -205,27 +512,102 @@ def create_app(test_config=None):
             abort(422)
 
         try:
-            questions = Question.query.filter(Question.id.notin_(previous_questions))
-            # 0 is for all category
-            if quiz_category["id"] != 0:
-                questions = questions.filter(Question.category == quiz_category["id"])
-            
-            # check https://stackoverflow.com/questions/60805/getting-random-row-through-sqlalchemy
-            question = questions.order_by(func.random()).limit(1).one_or_none()
+            # 0 is for all category, the id is drawn in memory and only that row is fetched
+            category = int(quiz_category["id"])
+            weight = quiz_weight(app.question_pool, category, body, app.config.get('QUIZ_DIFFICULTY_SPREAD', 1.0))
+            count = quiz_count(body)
+            if count is not None:
+                # the questions of a whole quiz in one round trip
+                questions = app.question_pool.next_questions(category, previous_questions, count, weight)
+                return json_response(dumps({
+                    'success': True,
+                    'questions': [question.format() for question in questions]
+                }))
+            question = app.question_pool.next_question(category, previous_questions, weight)
             if not question:
-                return jsonify({
+                return json_response(dumps({
                     'success': True,
                     'question': None
-                }), 200
+                }))
             
-            return jsonify({
+            return json_response(dumps({
                 'success': True,
                 'question': question.format()
-            }), 200
+            }))
             
         except:
             abort(422)
     
+    @app.route('/api/quizzes/sessions', methods=['POST'])
+    def create_quiz_session():
+        body = request.get_json()
+
+        quiz_category = body.get('quiz_category', None)
+        if not quiz_category:
+            abort(422)
+        try:
+            category = int(quiz_category["id"])
+            size = int(body.get('size', DECK_SIZE))
+        except (KeyError, TypeError, ValueError):
+            abort(422)
+        if not 0 < size <= MAX_DECK_SIZE:
+            abort(422)
+
+        # the deck is shuffled once, each step then pops the next question
+        deck = app.question_pool.sample(category, size)
+        session_id = app.quiz_sessions.create(category, deck)
+        return jsonify({
+            'success': True,
+            'session_id': session_id,
+            'total': len(deck)
+        }), 200
+
+    @app.route('/api/quizzes/sessions/<session_id>/next')
+    def next_session_question(session_id):
+        while True:
+            try:
+                question_id, remaining = app.quiz_sessions.pop(session_id)
+            except SessionNotFound:
+                abort(404)
+            if question_id is None:
+                return json_response(dumps({
+                    'success': True,
+                    'question': None,
+                    'remaining': 0
+                }))
+            question = fetch_question(app.db.session, question_id)
+            # skip the questions deleted since the session started
+            if question is not None:
+                return json_response(dumps({
+                    'success': True,
+                    'question': question.format(),
+                    'remaining': remaining
+                }))
+
+    @app.route('/api/stats/cache')
+    def retrieve_cache_stats():
+        return jsonify({
+            'success': True,
+            'response_cache': app.response_cache.stats() if app.response_cache else None,
+            'single_flight': app.single_flight.stats() if app.single_flight else None,
+            'question_writer': app.question_writer.stats() if app.question_writer else None,
+            'pack_builds': app.pack_store.builds
+        })
+
+    @app.route('/api/stats/pool')
+    def retrieve_pool_stats():
+        return jsonify({
+            'success': True,
+            'pool': pool_status(app.db.get_engine(app).pool, app.pool_stats)
+        })
+
+    @app.route('/metrics')
+    def retrieve_metrics():
+        extra = resource_families(pool_status(app.db.get_engine(app).pool, app.pool_stats),
+                                  app.response_cache.stats() if app.response_cache else None,
+                                  app.single_flight.stats() if app.single_flight else None)
+        return Response(app.metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
     '''
     @TODO:
     Create error handlers for all expected errors
@@ -254,5 +636,21 @@ def create_app(test_config=None):
             "error": 400,
             "message": "bad request"
         }), 400
+
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        return jsonify({
+            "success": False,
+            "error": 429,
+            "message": "too many requests"
+        }), 429, {'Retry-After': retry_after_header(g.get('retry_after', 1))}
+
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        return jsonify({
+            "success": False,
+            "error": 503,
+            "message": "service unavailable"
+        }), 503, {'Retry-After': '1'}
     
     return app
@@ -0,0 +1,412 @@
+import asyncio
+import logging
+import time
+
+import asyncpg
+from quart import Quart, request, abort, jsonify
+
+from models import ChangeSet
+from config import Config
+from .cursor import encode_cursor, decode_cursor, InvalidCursor
+from .quiz import QuestionPool, quiz_weight, quiz_count
+from .sessions import MemorySessionStore, SessionNotFound, DECK_SIZE, MAX_DECK_SIZE
+from .batch import parse_ids
+from .search import tokenize
+
+'''
+ASGI entry point, on PostgreSQL only
+
+The same routes as create_app for the listings, the search, the quizzes and the single question
+changes, with the same JSON responses and error shapes, served on one event loop with asyncpg:
+a request waiting on the database does not hold a thread, and the queries of a listing
+(page, count and categories) run concurrently on the connections of the pool.
+
+    uvicorn --factory flaskr.asgi:create_asgi_app
+
+The bulk import, the export, the batch update and the stats stay on the WSGI app.
+The quiz questions are drawn from the in memory QuestionPool, reloaded every
+CATEGORY_CACHE_TTL seconds along with the categories to see the changes of the other workers.
+With CATEGORY_CACHE_TTL=0, the categories are read by every request and the pool is reloaded
+every FRESH_RELOAD_INTERVAL seconds.
+'''
+
+logger = logging.getLogger(__name__)
+
+QUESTIONS_PER_PAGE = 10
+FRESH_RELOAD_INTERVAL = 1.0
+QUESTION_COLUMNS = 'id, question, answer, category, difficulty'
+
+
+def database_url(uri):
+    # asyncpg takes the libpq URL, without the SQLAlchemy driver
+    scheme, rest = uri.split('://', 1)
+    return 'postgresql://' + rest if scheme.split('+')[0] in ('postgres', 'postgresql') else uri
+
+
+def format_question(row):
+    return {
+        'id': row['id'],
+        'question': row['question'],
+        'answer': row['answer'],
+        'category': row['category'],
+        'difficulty': row['difficulty']
+    }
+
+
+class AsyncCategoryCache(object):
+    '''
+    {id: type} of the categories, reloaded when older than ttl
+    '''
+
+    def __init__(self, pool, ttl=300):
+        self.pool = pool
+        self.ttl = ttl
+        self._categories = None
+        self._loaded_at = 0
+
+    async def get(self):
+        # no other worker tells this one about the changes, a ttl of 0 reads them every time
+        if self._categories is None or not self.ttl or time.monotonic() - self._loaded_at > self.ttl:
+            rows = await self.pool.fetch('SELECT id, type FROM categories ORDER BY type')
+            self._categories = {row['id']: row['type'] for row in rows}
+            self._loaded_at = time.monotonic()
+        return self._categories
+
+    def invalidate(self):
+        self._categories = None
+
+
+def search_condition(engine, answers, index):
+    '''
+    WHERE clause and relevance (None when not ranked) of a search, index is the number of the parameter of term
+    '''
+    if engine == 'fulltext':
+        vector = "to_tsvector('simple'::regconfig, coalesce(question, ''){})".format(
+            " || ' ' || coalesce(answer, '')" if answers else '')
+        tsquery = "to_tsquery('simple'::regconfig, ${})".format(index)
+        return '{} @@ {}'.format(vector, tsquery), 'ts_rank({}, {})'.format(vector, tsquery)
+    condition = 'question ILIKE ${}'.format(index)
+    if answers:
+        condition = '({} OR answer ILIKE ${})'.format(condition, index)
+    return condition, None
+
+
+def search_parameter(engine, term):
+    if engine == 'fulltext':
+        # tokenized like the WSGI search, the last word matches as a prefix
+        tokens = tokenize(term)
+        if not tokens:
+            return None
+        tokens[-1] += ':*'
+        return ' & '.join(tokens)
+    return '%{}%'.format(term)
+
+
+def create_asgi_app(test_config=None):
+    app = Quart(__name__)
+    app.config.from_object(test_config if test_config is not None else Config())
+
+    @app.before_serving
+    async def connect():
+        uri = app.config['SQLALCHEMY_DATABASE_URI']
+        # sized like the SQLAlchemy pool of the WSGI app
+        options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}
+        app.pg = await asyncpg.create_pool(database_url(uri), min_size=1,
+                                           max_size=options.get('pool_size', 5) + options.get('max_overflow', 10))
+        app.category_cache = AsyncCategoryCache(app.pg, app.config.get('CATEGORY_CACHE_TTL', 300))
+        app.question_pool = QuestionPool(None)
+        app.quiz_sessions = MemorySessionStore(app.config.get('QUIZ_SESSION_CAPACITY', 10000),
+                                               app.config.get('QUIZ_SESSION_TTL', 3600))
+        await reload_question_pool()
+        app.reloader = asyncio.ensure_future(reload_periodically(app.config.get('CATEGORY_CACHE_TTL', 300)))
+
+    @app.after_serving
+    async def disconnect():
+        app.reloader.cancel()
+        await app.pg.close()
+
+    async def reload_question_pool():
+        version = app.question_pool.version
+        app.question_pool.load(await app.pg.fetch('SELECT id, category, difficulty FROM questions'), version)
+
+    async def reload_periodically(interval):
+        while True:
+            await asyncio.sleep(interval or FRESH_RELOAD_INTERVAL)
+            try:
+                await reload_question_pool()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # e.g. the database restarting, the pool is kept until the next reload
+                logger.exception('Could not reload the question pool')
+
+    @app.after_request
+    async def after_request(response):
+        response.headers.add('Access-Control-Allow-Origin', '*')
+        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,true')
+        response.headers.add('Access-Control-Allow-Methods', 'GET,PATCH,POST,PUT,DELETE,OPTIONS')
+        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        return response
+
+    @app.route('/api/categories')
+    async def retrieve_categories():
+        categories = await app.category_cache.get()
+        if len(categories) == 0:
+            abort(404)
+        return jsonify({
+            'success': True,
+            'categories': categories,
+            'total_categories': len(categories)
+        })
+
+    @app.route('/api/questions')
+    async def retrieve_questions():
+        search_term = request.args.get('searchTerm')
+        if not search_term:
+            return await return_questions([], [])
+        engine = app.config.get('SEARCH_ENGINE', 'like')
+        parameter = search_parameter(engine, search_term)
+        if parameter is None:
+            return await return_questions(['false'], [])
+        answers = request.args.get('searchAnswers', str(app.config.get('SEARCH_INCLUDE_ANSWERS', False)))
+        condition, rank = search_condition(engine, answers.lower() in ('1', 'true', 'yes'), 1)
+        return await return_questions([condition], [parameter], rank)
+
+    @app.route('/api/categories/<int:category_id>/questions')
+    async def retrieve_category_question(category_id):
+        return await return_questions(['category = $1'], [category_id])
+
+    async def return_questions(conditions, params, rank=None):
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        if 'after' in request.args:
+            page = fetch_after(conditions, params, rank)
+        else:
+            page = fetch_page(where, params, rank)
+        # the page, the total and the categories are fetched at the same time on different connections
+        (rows, next_cursor), total, categories = await asyncio.gather(
+            page, app.pg.fetchval('SELECT count(*) FROM questions' + where, *params), app.category_cache.get())
+        if not rows:
+            abort(404)
+        result = {
+            'success': True,
+            'total_questions': total,
+            'categories': categories,
+            'questions': [format_question(row) for row in rows]
+        }
+        if 'after' in request.args:
+            result['next_cursor'] = next_cursor
+        return jsonify(result)
+
+    def order_by(rank):
+        # the same orders as the WSGI listings, see cursor.ordering
+        return "coalesce(question, ''), id" if rank is None else '{} DESC, id'.format(rank)
+
+    async def fetch_page(where, params, rank):
+        page = request.args.get('page', 1, type=int)
+        if page < 1:
+            return [], None
+        rows = await app.pg.fetch('SELECT {} FROM questions{} ORDER BY {} LIMIT {} OFFSET {}'.format(
+            QUESTION_COLUMNS, where, order_by(rank), QUESTIONS_PER_PAGE,
+            (page - 1) * QUESTIONS_PER_PAGE), *params)
+        return rows, None
+
+    async def fetch_after(conditions, params, rank):
+        cursor = request.args.get('after')
+        conditions, params = list(conditions), list(params)
+        if cursor:
+            try:
+                question, question_id = decode_cursor(cursor)
+            except InvalidCursor:
+                abort(400)
+            if rank is None:
+                conditions.append("(coalesce(question, ''), id) > (${}, ${})".format(len(params) + 1,
+                                                                                  len(params) + 2))
+                params += [question, question_id]
+            else:
+                # the rank of the last question is computed again, the cursor holds its id only
+                last = '(SELECT {} FROM questions WHERE id = ${})'.format(rank, len(params) + 1)
+                conditions.append('({0} < {1} OR ({0} = {1} AND id > ${2}))'.format(rank, last, len(params) + 1))
+                params.append(question_id)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        # one extra row tells whether there is a next page
+        rows = await app.pg.fetch('SELECT {} FROM questions{} ORDER BY {} LIMIT {}'.format(
+            QUESTION_COLUMNS, where, order_by(rank), QUESTIONS_PER_PAGE + 1), *params)
+        next_cursor = None
+        if len(rows) > QUESTIONS_PER_PAGE:
+            rows = rows[:QUESTIONS_PER_PAGE]
+            next_cursor = encode_cursor(rows[-1]['question'] or '' if rank is None else '', rows[-1]['id'])
+        return rows, next_cursor
+
+    @app.route('/api/questions/<int:question_id>', methods=['DELETE'])
+    async def delete_question(question_id):
+        try:
+            row = await app.pg.fetchrow('DELETE FROM questions WHERE id = $1 RETURNING id, category', question_id)
+        except asyncpg.PostgresError:
+            abort(422)
+        if row is None:
+            abort(404)
+        app.question_pool.discard(row['id'], row['category'])
+        return jsonify({
+            'success': True
+        })
+
+    @app.route('/api/questions', methods=['DELETE'])
+    async def delete_question_batch():
+        try:
+            ids = parse_ids(request.args.get('ids', ''))
+        except ValueError:
+            abort(400)
+        try:
+            rows = await app.pg.fetch('DELETE FROM questions WHERE id = ANY($1::integer[]) RETURNING id, category',
+                                      ids)
+        except asyncpg.PostgresError:
+            abort(422)
+        if not rows:
+            abort(404)
+        for row in rows:
+            app.question_pool.discard(row['id'], row['category'])
+        return jsonify({
+            'success': True,
+            'deleted': len(rows)
+        })
+
+    @app.route('/api/questions', methods=['POST'])
+    async def create_question():
+        body = await request.get_json()
+        try:
+            question = {
+                'question': body.get('question', None),
+                'answer': body.get('answer', None),
+                'category': body.get('category', None),
+                'difficulty': body.get('difficulty', 0)
+            }
+            question['id'] = await app.pg.fetchval(
+                'INSERT INTO questions (question, answer, category, difficulty) VALUES ($1, $2, $3, $4) RETURNING id',
+                question['question'], question['answer'],
+                None if question['category'] is None else int(question['category']), int(question['difficulty']))
+        except (AttributeError, TypeError, ValueError, asyncpg.PostgresError, asyncpg.DataError):
+            abort(422)
+        changes = ChangeSet()
+        changes.added.append(question)
+        app.question_pool.apply(changes)
+        return jsonify({
+            'success': True
+        }), 200
+
+    async def fetch_question(question_id):
+        return await app.pg.fetchrow('SELECT {} FROM questions WHERE id = $1'.format(QUESTION_COLUMNS), question_id)
+
+    @app.route('/api/quizzes', methods=['POST'])
+    async def generate_quiz():
+        body = await request.get_json()
+        previous_questions = body.get('previous_questions', [])
+        quiz_category = body.get('quiz_category', None)
+        if not quiz_category:
+            abort(422)
+        try:
+            category = int(quiz_category['id'])
+            excluded = set(previous_questions)
+            weight = quiz_weight(app.question_pool, category, body, app.config.get('QUIZ_DIFFICULTY_SPREAD', 1.0))
+            count = quiz_count(body)
+        except (KeyError, TypeError, ValueError):
+            abort(422)
+        if count is not None:
+            questions = []
+            while len(questions) < count:
+                ids = app.question_pool.draw_many(category, excluded, count - len(questions), weight)
+                if not ids:
+                    break
+                rows = {row['id']: row for row in await app.pg.fetch(
+                    'SELECT {} FROM questions WHERE id = ANY($1::int[])'.format(QUESTION_COLUMNS), ids)}
+                for question_id in ids:
+                    if question_id in rows:
+                        questions.append(format_question(rows[question_id]))
+                    else:
+                        app.question_pool.discard(question_id, category)
+            return jsonify({
+                'success': True,
+                'questions': questions
+            }), 200
+        while True:
+            question_id = app.question_pool.draw(category, excluded, weight)
+            if question_id is None:
+                return jsonify({
+                    'success': True,
+                    'question': None
+                }), 200
+            row = await fetch_question(question_id)
+            if row is not None:
+                return jsonify({
+                    'success': True,
+                    'question': format_question(row)
+                }), 200
+            app.question_pool.discard(question_id, category)
+            excluded.add(question_id)
+
+    @app.route('/api/quizzes/sessions', methods=['POST'])
+    async def create_quiz_session():
+        body = await request.get_json()
+        quiz_category = body.get('quiz_category', None)
+        if not quiz_category:
+            abort(422)
+        try:
+            category = int(quiz_category['id'])
+            size = int(body.get('size', DECK_SIZE))
+        except (KeyError, TypeError, ValueError):
+            abort(422)
+        if not 0 < size <= MAX_DECK_SIZE:
+            abort(422)
+        deck = app.question_pool.sample(category, size)
+        session_id = app.quiz_sessions.create(category, deck)
+        return jsonify({
+            'success': True,
+            'session_id': session_id,
+            'total': len(deck)
+        }), 200
+
+    @app.route('/api/quizzes/sessions/<session_id>/next')
+    async def next_session_question(session_id):
+        while True:
+            try:
+                question_id, remaining = app.quiz_sessions.pop(session_id)
+            except SessionNotFound:
+                abort(404)
+            if question_id is None:
+                return jsonify({
+                    'success': True,
+                    'question': None,
+                    'remaining': 0
+                }), 200
+            row = await fetch_question(question_id)
+            if row is not None:
+                return jsonify({
+                    'success': True,
+                    'question': format_question(row),
+                    'remaining': remaining
+                }), 200
+
+    @app.errorhandler(404)
+    async def not_found(error):
+        return jsonify({
+            "success": False,
+            "error": 404,
+            "message": "resource not found"
+        }), 404
+
+    @app.errorhandler(422)
+    async def unprocessable(error):
+        return jsonify({
+            "success": False,
+            "error": 422,
+            "message": "unprocessable"
+        }), 422
+
+    @app.errorhandler(400)
+    async def bad_request(error):
+        return jsonify({
+            "success": False,
+            "error": 400,
+            "message": "bad request"
+        }), 400
+
+    return app
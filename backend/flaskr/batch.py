@@ -0,0 +1,125 @@
+from sqlalchemy import bindparam, select, text
+
+from models import Question, record_changes
+from .bulk import RowError
+
+'''
+Set based changes of many questions
+
+Each batch is one statement in one transaction, without loading the questions:
+    - DELETE ... WHERE id IN (...)
+    - UPDATE ... FROM (VALUES ...) on PostgreSQL, elsewhere an executemany per set of updated columns
+The questions changed are read first, locked until the commit, so that the change is dispatched
+with their snapshots and the caches only evict them. Nothing is dispatched when no question matched.
+'''
+
+FIELDS = ('question', 'answer', 'category', 'difficulty')
+SQL_TYPES = {'question': 'varchar', 'answer': 'varchar', 'category': 'integer', 'difficulty': 'integer'}
+
+
+def parse_ids(value):
+    ids = [int(id) for id in value.split(',') if id.strip()]
+    if not ids:
+        raise ValueError('no id')
+    return ids
+
+
+def validate_update(row, categories):
+    '''
+    Partial update {id, and any of FIELDS} with the values checked like the import does
+    '''
+    if not isinstance(row, dict):
+        raise RowError('expected an object')
+    values = {}
+    try:
+        values['id'] = int(row['id'])
+    except (KeyError, TypeError, ValueError):
+        raise RowError('id must be an integer')
+    for field in row:
+        if field != 'id' and field not in FIELDS:
+            raise RowError('unknown field {}'.format(field))
+    for field in ('question', 'answer'):
+        if field in row:
+            if not isinstance(row[field], str) or not row[field].strip():
+                raise RowError('{} must not be empty'.format(field))
+            values[field] = row[field]
+    for field in ('category', 'difficulty'):
+        if field in row:
+            try:
+                values[field] = int(row[field])
+            except (TypeError, ValueError):
+                raise RowError('{} must be an integer'.format(field))
+    if 'category' in values and values['category'] not in categories:
+        raise RowError('unknown category {}'.format(values['category']))
+    if len(values) == 1:
+        raise RowError('nothing to update')
+    return values
+
+
+def _snapshots(session, ids):
+    # the current values of the questions about to change, none changes them before the commit
+    table = Question.__table__
+    rows = session.execute(select([table.c.id] + [table.c[field] for field in FIELDS])
+                           .where(table.c.id.in_(ids)).with_for_update())
+    return {row.id: dict(row) for row in rows}
+
+
+def delete_questions(session, ids):
+    table = Question.__table__
+    before = _snapshots(session, ids)
+    if not before:
+        session.commit()
+        return 0
+    result = session.execute(table.delete().where(table.c.id.in_(list(before))))
+    record_changes(session, removed=list(before.values()))
+    session.commit()
+    return result.rowcount
+
+
+def update_questions(session, updates):
+    before = _snapshots(session, [update['id'] for update in updates])
+    updates = [update for update in updates if update['id'] in before]
+    if not updates:
+        session.commit()
+        return 0
+    connection = session.connection()
+    if connection.dialect.name == 'postgresql':
+        count = _update_from_values(session, updates)
+    else:
+        count = _update_many(session, updates)
+    record_changes(session, removed=[before[update['id']] for update in updates],
+                   added=[dict(before[update['id']], **update) for update in updates])
+    session.commit()
+    return count
+
+
+def _update_from_values(session, updates):
+    # a NULL keeps the current value of the column, the updates never set NULL
+    rows, params = [], {}
+    for i, update in enumerate(updates):
+        params['id_{}'.format(i)] = update['id']
+        row = ['CAST(:id_{} AS integer)'.format(i)]
+        for field in FIELDS:
+            params['{}_{}'.format(field, i)] = update.get(field)
+            row.append('CAST(:{}_{} AS {})'.format(field, i, SQL_TYPES[field]))
+        rows.append('({})'.format(', '.join(row)))
+    statement = text(
+        'UPDATE questions SET {} FROM (VALUES {}) AS v (id, {}) WHERE questions.id = v.id'.format(
+            ', '.join('{0} = COALESCE(v.{0}, questions.{0})'.format(field) for field in FIELDS),
+            ', '.join(rows), ', '.join(FIELDS)))
+    return session.execute(statement, params).rowcount
+
+
+def _update_many(session, updates):
+    table = Question.__table__
+    groups = {}
+    for update in updates:
+        groups.setdefault(tuple(sorted(field for field in update if field != 'id')), []).append(update)
+    count = 0
+    for fields, group in groups.items():
+        statement = table.update().where(table.c.id == bindparam('_id')) \
+            .values({field: bindparam(field) for field in fields})
+        params = [dict({field: update[field] for field in fields}, _id=update['id']) for update in group]
+        result = session.execute(statement, params)
+        count += result.rowcount
+    return count
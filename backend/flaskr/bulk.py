@@ -0,0 +1,154 @@
+import csv
+import io
+import json
+
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import Question, mark_bulk_change
+
+'''
+Bulk import and export of the questions
+
+The import reads NDJSON (one JSON object per line) or CSV (with a header line) as a stream,
+validates each row and inserts the valid ones by batches, with COPY on PostgreSQL and an
+executemany elsewhere, each batch in its own transaction. The caches see the imported
+questions once the import ends, or fails after some batches.
+The export streams every question as NDJSON from a server side cursor.
+'''
+
+FIELDS = ('question', 'answer', 'category', 'difficulty')
+BATCH_SIZE = 1000
+# errors reported in the response, the others are only counted
+MAX_REPORTED_ERRORS = 100
+
+
+class RowError(ValueError):
+    pass
+
+
+def validate(row, categories):
+    if not isinstance(row, dict):
+        raise RowError('expected an object')
+    values = {}
+    for field in ('question', 'answer'):
+        value = row.get(field)
+        if not isinstance(value, str) or not value.strip():
+            raise RowError('{} is required'.format(field))
+        values[field] = value
+    for field in ('category', 'difficulty'):
+        try:
+            values[field] = int(row.get(field))
+        except (TypeError, ValueError):
+            raise RowError('{} must be an integer'.format(field))
+    if values['category'] not in categories:
+        raise RowError('unknown category {}'.format(values['category']))
+    return values
+
+
+def read_lines(stream):
+    for line in iter(stream.readline, b''):
+        yield line.decode('utf-8')
+
+
+def parse_ndjson(lines):
+    '''
+    Yield (line number, row or RowError) for each non blank line
+    '''
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, RowError('invalid JSON')
+
+
+def parse_csv(lines):
+    reader = csv.DictReader(lines)
+    for row in reader:
+        # line of the end of the record, the header being line 1
+        yield reader.line_num, row
+
+
+class Importer(object):
+    def __init__(self, session, categories, batch_size=BATCH_SIZE):
+        self.session = session
+        self.categories = categories
+        self.batch_size = batch_size
+        self.inserted = 0
+        self.errors = []
+        self.error_count = 0
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def run(self, rows):
+        batch = []
+        try:
+            for line, row in rows:
+                try:
+                    if isinstance(row, RowError):
+                        raise row
+                    batch.append((line, validate(row, self.categories)))
+                except RowError as e:
+                    self.error(line, str(e))
+                if len(batch) >= self.batch_size:
+                    self.flush(batch)
+                    batch = []
+            self.flush(batch)
+        finally:
+            # the caches are invalidated once for the whole import, not rebuilt after every batch,
+            # also when the stream fails after some batches were committed
+            if self.inserted:
+                mark_bulk_change(self.session)
+                self.session.commit()
+        return self
+
+    def flush(self, batch):
+        if not batch:
+            return
+        values = [row for line, row in batch]
+        connection = self.session.connection()
+        try:
+            if connection.dialect.name == 'postgresql':
+                copy(connection, values)
+            else:
+                connection.execute(Question.__table__.insert(), values)
+            self.session.commit()
+            self.inserted += len(batch)
+        # COPY goes straight to the driver, its errors are not wrapped by SQLAlchemy
+        except (SQLAlchemyError, connection.dialect.dbapi.Error) as e:
+            self.session.rollback()
+            for line, row in batch:
+                self.error(line, 'not inserted: {}'.format(e.__class__.__name__))
+
+
+def copy(connection, values):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in values:
+        writer.writerow([row[field] for field in FIELDS])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert('COPY questions ({}) FROM STDIN WITH (FORMAT csv)'.format(', '.join(FIELDS)), buffer)
+    finally:
+        cursor.close()
+
+
+def export_ndjson(session, batch_size=BATCH_SIZE):
+    columns = [Question.id] + [getattr(Question, field) for field in FIELDS]
+    names = ['id'] + list(FIELDS)
+    result = session.connection().execution_options(stream_results=True) \
+        .execute(select(columns).order_by(Question.id))
+    try:
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            yield ''.join(json.dumps(dict(zip(names, row))) + '\n' for row in rows)
+    finally:
+        result.close()
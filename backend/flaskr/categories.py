@@ -0,0 +1,60 @@
+import hashlib
+import json
+import threading
+import time
+
+from models import Category
+from .routing import primary
+
+'''
+Process local cache of the categories
+
+The categories almost never change but are part of every listing. The {id: type} map is
+loaded once and kept until it is invalidated, by a committed change of the categories,
+by invalidate() or when it is older than the ttl. Every load producing a different
+map increments the version, the etag is a digest of the map.
+'''
+
+
+class CategoriesEntry(object):
+    def __init__(self, categories, version, etag, loaded_at):
+        self.categories = categories
+        self.version = version
+        self.etag = etag
+        self.loaded_at = loaded_at
+
+
+class CategoryCache(object):
+    def __init__(self, session, ttl=300):
+        self.session = session
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entry = None
+        self._version = 0
+        self._etag = None
+
+    def get(self):
+        entry = self._entry
+        if entry is None or (self.ttl and time.monotonic() - entry.loaded_at > self.ttl):
+            entry = self._load()
+        return entry
+
+    def _load(self):
+        with primary():
+            selection = self.session.query(Category.id, Category.type).order_by(Category.type).all()
+        categories = {id: type for id, type in selection}
+        etag = hashlib.sha1(json.dumps(sorted(categories.items())).encode('utf-8')).hexdigest()
+        with self._lock:
+            if self._etag != etag:
+                self._version, self._etag = self._version + 1, etag
+            entry = CategoriesEntry(categories, self._version, etag, time.monotonic())
+            self._entry = entry
+        return entry
+
+    def invalidate(self):
+        with self._lock:
+            self._entry = None
+
+    def apply(self, changes):
+        if changes.categories or changes.bulk:
+            self.invalidate()
@@ -0,0 +1,91 @@
+import threading
+from functools import wraps
+
+from flask import Response, request, make_response, g
+
+'''
+Coalescing of the identical read requests
+
+When the same listing is requested by many clients at once, e.g. page 1 when a quiz goes live,
+the first request runs the view and the ones arriving while it runs wait for its response instead
+of running the same queries. Requests are identical when they have the same endpoint and parameters,
+read from the same database (primary or replicas) and arrive before any change of the data.
+Nothing is kept once the response is computed, a later request runs the view again.
+'''
+
+
+class Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, fn):
+        '''
+        Result of fn, shared with the calls of the same key made while it runs
+        '''
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = Flight()
+                self.leaders += 1
+                leader = True
+            else:
+                self.followers += 1
+                leader = False
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = fn()
+            return flight.result
+        except Exception as e:
+            # e.g. the abort(404) of the view, raised by every request of the flight
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'leaders': self.leaders,
+                'followers': self.followers,
+                'in_flight': len(self._flights)
+            }
+
+
+def coalesced(flight, stamp):
+    '''
+    Share the response of the view between the identical requests running at the same time,
+    stamp is the version of the data, the requests following a change do not join the flights started before it
+    '''
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if flight is None:
+                return view(*args, **kwargs)
+            key = (request.endpoint, tuple(sorted(kwargs.items())), tuple(sorted(request.args.items(multi=True))),
+                   g.get('db_read_only'), stamp())
+
+            def run():
+                response = make_response(view(*args, **kwargs))
+                return response.get_data(), response.status_code, list(response.headers.items())
+
+            # every request gets a response of its own, the headers are completed by each of them
+            body, status, headers = flight.do(key, run)
+            return Response(body, status, headers)
+        return wrapper
+    return decorator
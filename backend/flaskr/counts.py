@@ -0,0 +1,80 @@
+import json
+import threading
+
+from sqlalchemy import func
+
+from models import Question
+from .routing import primary
+
+'''
+Precomputed number of questions, in total and per category
+
+The counts are built from the database at startup and then follow the committed
+changes (see models.ChangeSet) so that the listings never have to run a COUNT(*).
+After a bulk change, the counts are rebuilt on the next read.
+'''
+
+
+class QuestionCounts(object):
+    def __init__(self, session):
+        self.session = session
+        self._lock = threading.Lock()
+        self._total = 0
+        self._per_category = {}
+        self._stale = True
+        # bumped by every change, a rebuild racing with a change must not be trusted
+        self._version = 0
+
+    def rebuild(self):
+        with self._lock:
+            version = self._version
+        with primary():
+            rows = self.session.query(Question.category, func.count(Question.id)).group_by(Question.category).all()
+        with self._lock:
+            if version != self._version:
+                return
+            self._per_category = {category: count for category, count in rows}
+            self._total = sum(self._per_category.values())
+            self._stale = False
+
+    def _ensure_fresh(self):
+        if self._stale:
+            self.rebuild()
+
+    def total(self):
+        self._ensure_fresh()
+        return self._total
+
+    def category(self, category_id):
+        self._ensure_fresh()
+        return self._per_category.get(category_id, 0)
+
+    def apply(self, changes):
+        with self._lock:
+            self._version += 1
+            # the foreign key moves the questions of a deleted or renumbered category behind the ORM
+            if changes.bulk or changes.categories:
+                self._stale = True
+                return
+            for question in changes.added:
+                self._add(question['category'], 1)
+            for question in changes.removed:
+                self._add(question['category'], -1)
+
+    def _add(self, category, delta):
+        self._total += delta
+        self._per_category[category] = self._per_category.get(category, 0) + delta
+
+
+def estimate_count(session, query):
+    '''
+    Row estimate of the planner for query on PostgreSQL, an exact count elsewhere
+    '''
+    connection = session.connection()
+    if connection.dialect.name != 'postgresql':
+        return query.count()
+    compiled = query.statement.compile(dialect=connection.dialect)
+    plan = connection.execute('EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
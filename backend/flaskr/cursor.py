@@ -0,0 +1,73 @@
+import base64
+import binascii
+import json
+
+from sqlalchemy import and_, desc, func, or_, select, tuple_
+
+from models import Question
+
+'''
+Keyset (cursor) pagination helpers
+
+A cursor is the opaque, url safe encoding of the sort key (question, id) of the
+last row of a page. The next page is fetched with
+    WHERE (coalesce(question, ''), id) > (:question, :id) ORDER BY coalesce(question, ''), id LIMIT n
+which can be served straight from an index (migration 0005) instead of scanning and discarding
+every earlier row like LIMIT/OFFSET does. A NULL never compares greater than anything,
+the questions without text are sorted as an empty text so that the cursor reaches them.
+A search ranked in SQL is ordered by (rank DESC, id) instead, its cursor holds only the id of the
+last row, whose rank is computed again by the query of the next page.
+'''
+
+SORT_KEY = func.coalesce(Question.question, '')
+# order of the listings, with a cursor or with page, so that both modes give the same sequence
+ORDER_BY = (SORT_KEY, Question.id)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(question, question_id):
+    raw = json.dumps([question, question_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        question, question_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError, UnicodeError, binascii.Error):
+        raise InvalidCursor(cursor)
+    if not isinstance(question_id, int) or not (question is None or isinstance(question, str)):
+        raise InvalidCursor(cursor)
+    return question or '', question_id
+
+
+def ordering(rank=None):
+    '''
+    order_by clauses of a listing, by relevance when rank is given
+    '''
+    return ORDER_BY if rank is None else (desc(rank), Question.id)
+
+
+def seek(query, cursor, limit, rank=None):
+    '''
+    Return the rows of the page following cursor (the first page when cursor is empty)
+    and the cursor of the next page, or None when this is the last page
+    '''
+    query = query.order_by(*ordering(rank))
+    if cursor:
+        if rank is None:
+            query = query.filter(tuple_(*ORDER_BY) > decode_cursor(cursor))
+        else:
+            question_id = decode_cursor(cursor)[1]
+            last = select([rank]).where(Question.id == question_id).as_scalar()
+            query = query.filter(or_(rank < last, and_(rank == last, Question.id > question_id)))
+    # Fetch one extra row to know whether there is a next page without counting
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].question or '' if rank is None else '', rows[-1].id)
+    return rows, next_cursor
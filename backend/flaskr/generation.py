@@ -0,0 +1,70 @@
+import threading
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+from models import CacheGeneration, ChangeSet, dispatch_changes
+
+'''
+Cross worker invalidation
+
+Each worker keeps its own caches. When CACHE_GENERATION_SYNC is enabled, every transaction
+changing the questions or the categories increments the single row of cache_generation
+(see models._bump_generation). The watcher reads that row at most every interval seconds
+and, when it moved more than the increments of this worker, dispatches a bulk ChangeSet
+so that every in-memory structure rebuilds itself.
+'''
+
+GENERATION_ID = 1
+
+
+class GenerationWatcher(object):
+    def __init__(self, app, session, interval=1.0):
+        self.app = app
+        self.session = session
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._last = None
+        self._own = 0
+        self._checked_at = 0
+
+    def start(self):
+        if self._read() is None:
+            try:
+                self.session.execute(CacheGeneration.__table__.insert().values(id=GENERATION_ID, value=0))
+                self.session.commit()
+            except IntegrityError:
+                # created meanwhile by another worker
+                self.session.rollback()
+        self._last = self._read()
+        self.session.commit()
+        self._checked_at = time.monotonic()
+
+    def _read(self):
+        return self.session.query(CacheGeneration.value).filter(CacheGeneration.id == GENERATION_ID).scalar()
+
+    def note_local(self, changes):
+        if changes.generation_bumped:
+            with self._lock:
+                self._own += 1
+
+    def generation(self):
+        '''
+        Shared generation of the data served by this worker: the last one read plus the local increments
+        '''
+        with self._lock:
+            return self._last + self._own
+
+    def check(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.interval:
+            return
+        self._checked_at = now
+        value = self._read()
+        with self._lock:
+            expected = self._last + self._own
+            self._last, self._own = value, 0
+        if value != expected:
+            changes = ChangeSet()
+            changes.bulk = True
+            dispatch_changes(self.app, changes)
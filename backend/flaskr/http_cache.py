@@ -0,0 +1,69 @@
+import hashlib
+import threading
+import uuid
+from functools import wraps
+
+from flask import request, make_response
+
+'''
+HTTP conditional caching of the read endpoints
+
+DataGeneration is a stamp of the data served by this worker, it changes with every committed change
+of the questions or categories. The ETag of a response is derived from that stamp and the request
+(path and query parameters) only, so a request with a matching If-None-Match is answered with
+a 304 before the view runs, without any query.
+Without CACHE_GENERATION_SYNC, each worker has its own stamps. With it, the stamp is the shared
+generation counter, so that all the workers give the same ETag to the same data.
+'''
+
+
+class DataGeneration(object):
+    def __init__(self, watcher=None):
+        self.watcher = watcher
+        self._lock = threading.Lock()
+        self._boot = uuid.uuid4().hex[:8]
+        self._local = 0
+
+    def apply(self, changes):
+        with self._lock:
+            self._local += 1
+
+    def stamp(self):
+        if self.watcher is not None:
+            return 'g{}'.format(self.watcher.generation())
+        return '{}-{}'.format(self._boot, self._local)
+
+
+def compute_etag(stamp):
+    key = '{}|{}|{}'.format(stamp, request.path, sorted(request.args.items(multi=True)))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def conditional(generation):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = compute_etag(generation.stamp())
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+                response.set_etag(etag)
+                return response
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
+
+
+def cache_control(response, max_age):
+    '''
+    Let the clients and the CDN keep the responses carrying an ETag
+    max_age seconds, or revalidate them every time when max_age is 0
+    '''
+    if request.method == 'GET' and response.headers.get('ETag') and 'Cache-Control' not in response.headers:
+        if max_age:
+            response.headers['Cache-Control'] = 'public, max-age={}'.format(max_age)
+        else:
+            response.headers['Cache-Control'] = 'no-cache'
+    return response
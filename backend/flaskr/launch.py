@@ -0,0 +1,49 @@
+import time
+
+'''
+Production start of the app
+
+The app is created and warmed once in the gunicorn master (preload_app) so that the workers
+forked from it start with the categories, the quiz pool, the search index and the first pages
+of the listings already in memory, shared copy on write. The connections opened meanwhile
+must not be shared by the workers: after_fork drops them in each worker.
+See gunicorn.conf.py and wsgi.py.
+'''
+
+# served once by warm_up, to fill the response cache and the JSON fragments of the first pages
+WARM_UP_URLS = ('/api/categories', '/api/questions')
+
+
+def warm_up(app, urls=WARM_UP_URLS):
+    '''
+    Load the in memory state of the app before its first request,
+    return the milliseconds spent on each step
+    '''
+    timings = {}
+
+    def step(name, fn):
+        start = time.perf_counter()
+        fn()
+        timings[name] = (time.perf_counter() - start) * 1000
+
+    with app.app_context():
+        step('categories', app.category_cache.get)
+        step('quiz_pool', app.question_pool.rebuild)
+        if hasattr(app.search_engine, 'rebuild'):
+            step('search', app.search_engine.rebuild)
+        client = app.test_client()
+        for url in urls:
+            step(url, lambda: client.get(url))
+        app.db.session.remove()
+    return timings
+
+
+def after_fork(app):
+    '''
+    Drop the connections inherited from the master, each worker opens its own
+    '''
+    app.db.session.remove()
+    app.db.get_engine(app).dispose()
+    if app.db_router is not None:
+        for engine in app.db_router.engines:
+            engine.dispose()
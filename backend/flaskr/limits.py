@@ -0,0 +1,104 @@
+import itertools
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+'''
+Rate limiting of the API
+
+Each client (remote address) has a token bucket per route: it holds at most burst tokens,
+refilled at rate tokens per second, and every request takes one. A request finding the bucket
+empty is answered with a 429 and the seconds after which a token is available.
+    - MemoryRateLimiter, the buckets are kept by the worker (default), at most capacity of them
+    - DatabaseRateLimiter, the buckets are rows of rate_limit_buckets, shared by the workers
+'''
+
+# a full bucket is the same as no bucket, the database store deletes them every PRUNE_EVERY requests
+PRUNE_EVERY = 1000
+
+
+class MemoryRateLimiter(object):
+    def __init__(self, rate, burst, capacity=100000):
+        self.rate = rate
+        self.burst = burst
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        # key -> [tokens, updated_at], ordered from the least to the most recently used
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def hit(self, key):
+        '''
+        Take a token of the bucket of key, return whether the request is allowed
+        and the seconds to wait when it is not
+        '''
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+                # the least recently used bucket is the closest to be full again
+                while len(self._buckets) > self.capacity:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return True, 0
+            bucket[0] = tokens
+            return False, (1 - tokens) / self.rate
+
+
+# refilled tokens of the existing row, the columns are the ones before the update
+REFILL = ('CASE WHEN rate_limit_buckets.tokens + (:now - rate_limit_buckets.updated_at) * :rate < :burst '
+          'THEN rate_limit_buckets.tokens + (:now - rate_limit_buckets.updated_at) * :rate ELSE :burst END')
+
+HIT = text('''
+INSERT INTO rate_limit_buckets (key, tokens, updated_at, allowed) VALUES (:key, :burst - 1, :now, :allowed)
+ON CONFLICT (key) DO UPDATE SET
+    tokens = CASE WHEN {refill} >= 1 THEN {refill} - 1 ELSE {refill} END,
+    allowed = {refill} >= 1,
+    updated_at = :now
+RETURNING allowed, tokens
+'''.format(refill=REFILL))
+
+
+class DatabaseRateLimiter(object):
+    def __init__(self, engine, rate, burst):
+        self.engine = engine
+        self.rate = rate
+        self.burst = burst
+        self._counter = itertools.count(1)
+
+    def hit(self, key):
+        now = time.time()
+        # a transaction of its own, out of the session of the request
+        with self.engine.begin() as connection:
+            allowed, tokens = connection.execute(HIT, key=key, now=now, rate=self.rate, burst=self.burst,
+                                                 allowed=True).first()
+            if next(self._counter) % PRUNE_EVERY == 0:
+                connection.execute(text('DELETE FROM rate_limit_buckets WHERE updated_at < :full'),
+                                   full=now - self.burst / self.rate)
+        if allowed:
+            return True, 0
+        return False, (1 - tokens) / self.rate
+
+
+def make_rate_limiter(name, engine, rate, burst, capacity):
+    if name == 'memory':
+        return MemoryRateLimiter(rate, burst, capacity)
+    if name == 'database':
+        return DatabaseRateLimiter(engine, rate, burst)
+    raise ValueError('Unknown RATE_LIMIT_STORE {}'.format(name))
+
+
+def retry_after_header(seconds):
+    # Retry-After takes whole seconds
+    return str(max(1, int(math.ceil(seconds))))
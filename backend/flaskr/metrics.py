@@ -0,0 +1,262 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request, current_app, has_app_context, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+'''
+Request instrumentation
+
+Each request records its latency per route, the number and the duration of its SQL statements
+(from the events of every engine) and the time spent encoding JSON. The totals are exposed in the
+Prometheus text format by GET /metrics and the ones of the request in its Server-Timing header.
+A statement slower than SLOW_QUERY_MS is logged, along with the scans of its plan on PostgreSQL,
+and a statement run N_PLUS_ONE_THRESHOLD times or more by one request is logged as an N+1.
+'''
+
+logger = logging.getLogger(__name__)
+
+# seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MAX_LOGGED_STATEMENT = 500
+
+
+class Histogram(object):
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+def format_labels(labels):
+    return ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for name, value in labels)
+
+
+class Metrics(object):
+    def __init__(self, slow_query=0.1, n_plus_one=10):
+        self.slow_query = slow_query
+        self.n_plus_one = n_plus_one
+        self._lock = threading.Lock()
+        self.latency = {}
+        self.serialization = {}
+        self.requests = {}
+        self.statements = {}
+        self.sql_seconds = {}
+        self.slow_queries = 0
+        self.n_plus_one_requests = {}
+        # statements whose plan was already logged
+        self._explained = set()
+
+    def record_request(self, route, method, status, duration, statements, sql_seconds, serialization):
+        with self._lock:
+            self.latency.setdefault((route, method), Histogram()).observe(duration)
+            self.serialization.setdefault((route, method), Histogram()).observe(serialization)
+            key = (route, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.statements[route] = self.statements.get(route, 0) + statements
+            self.sql_seconds[route] = self.sql_seconds.get(route, 0.0) + sql_seconds
+
+    def record_n_plus_one(self, route):
+        with self._lock:
+            self.n_plus_one_requests[route] = self.n_plus_one_requests.get(route, 0) + 1
+
+    def record_slow_query(self, statement):
+        with self._lock:
+            self.slow_queries += 1
+            first = statement not in self._explained
+            self._explained.add(statement)
+        return first
+
+    def render(self, extra=()):
+        '''
+        Prometheus text exposition of the metrics, extra are more (name, type, help, [(labels, value)])
+        '''
+        lines = []
+
+        def family(name, kind, description, samples):
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for labels, value in samples:
+                lines.append('{}{} {}'.format(name, '{' + format_labels(labels) + '}' if labels else '', value))
+
+        def histograms(name, description, values):
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} histogram'.format(name))
+            for (route, method), histogram in sorted(values.items()):
+                labels = [('route', route), ('method', method)]
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                    cumulative += count
+                    lines.append('{}_bucket{{{}}} {}'.format(name, format_labels(labels + [('le', bound)]), cumulative))
+                lines.append('{}_sum{{{}}} {}'.format(name, format_labels(labels), histogram.sum))
+                lines.append('{}_count{{{}}} {}'.format(name, format_labels(labels), histogram.count))
+
+        with self._lock:
+            histograms('trivia_request_duration_seconds', 'Latency of the requests', self.latency)
+            histograms('trivia_serialization_seconds', 'Time spent encoding the JSON responses', self.serialization)
+            family('trivia_requests_total', 'counter', 'Requests served',
+                   [([('route', route), ('method', method), ('status', status)], count)
+                    for (route, method, status), count in sorted(self.requests.items())])
+            family('trivia_sql_statements_total', 'counter', 'SQL statements run by the requests',
+                   [([('route', route)], count) for route, count in sorted(self.statements.items())])
+            family('trivia_sql_seconds_total', 'counter', 'Time spent in the SQL statements of the requests',
+                   [([('route', route)], seconds) for route, seconds in sorted(self.sql_seconds.items())])
+            family('trivia_slow_queries_total', 'counter', 'Statements slower than SLOW_QUERY_MS',
+                   [([], self.slow_queries)])
+            family('trivia_n_plus_one_total', 'counter', 'Requests running a statement N_PLUS_ONE_THRESHOLD times',
+                   [([('route', route)], count) for route, count in sorted(self.n_plus_one_requests.items())])
+        for name, kind, description, samples in extra:
+            family(name, kind, description, samples)
+        return '\n'.join(lines) + '\n'
+
+
+def current_metrics():
+    return current_app.extensions.get('trivia_metrics') if has_app_context() else None
+
+
+@contextmanager
+def serialization():
+    '''
+    Add the time of the block to the serialization time of the request
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if has_request_context():
+            g.serialization_time = g.get('serialization_time', 0.0) + time.perf_counter() - start
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('trivia_statement_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'handle_error')
+def _fail_statement(context):
+    if context.connection is not None and context.connection.info.get('trivia_statement_start'):
+        context.connection.info['trivia_statement_start'].pop()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _end_statement(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('trivia_statement_start')
+    if not starts:
+        return
+    duration = time.perf_counter() - starts.pop()
+    metrics = current_metrics()
+    if metrics is None:
+        return
+    if has_request_context():
+        g.sql_count = g.get('sql_count', 0) + 1
+        g.sql_time = g.get('sql_time', 0.0) + duration
+        counts = g.setdefault('sql_statements', {})
+        counts[statement] = counts.get(statement, 0) + 1
+    if metrics.slow_query and duration >= metrics.slow_query:
+        log_slow_query(metrics, conn, cursor, statement, parameters, duration, executemany)
+
+
+def log_slow_query(metrics, conn, cursor, statement, parameters, duration, executemany):
+    route = request.url_rule.rule if has_request_context() and request.url_rule else None
+    logger.warning('Slow query (%.1f ms, route %s): %s', duration * 1000, route, statement[:MAX_LOGGED_STATEMENT])
+    explain = metrics.record_slow_query(statement) and not executemany and \
+        conn.dialect.name == 'postgresql' and statement.lstrip()[:6].upper() == 'SELECT'
+    if not explain:
+        return
+    # the plan of the first occurrence only, with a cursor of the driver to stay out of the events
+    plan_cursor = cursor.connection.cursor()
+    try:
+        plan_cursor.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+        plan = plan_cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        scans = list(sequential_scans(plan[0]['Plan']))
+        if scans:
+            logger.warning('Slow query scans %s without index', ', '.join(scans))
+    except conn.dialect.dbapi.Error as e:
+        logger.warning('Could not explain the slow query: %s', e)
+    finally:
+        plan_cursor.close()
+
+
+def sequential_scans(plan):
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan.get('Relation Name')
+    for child in plan.get('Plans', []):
+        yield from sequential_scans(child)
+
+
+def start_request():
+    g.request_start = time.perf_counter()
+
+
+def finish_request(metrics, response):
+    '''
+    Record the request and return the entries of its Server-Timing header
+    '''
+    if 'request_start' not in g:
+        return []
+    duration = time.perf_counter() - g.request_start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    statements, sql_time = g.get('sql_count', 0), g.get('sql_time', 0.0)
+    serialization_time = g.get('serialization_time', 0.0)
+    metrics.record_request(route, request.method, response.status_code, duration, statements, sql_time,
+                           serialization_time)
+    repeated = [(count, statement) for statement, count in g.get('sql_statements', {}).items()
+                if metrics.n_plus_one and count >= metrics.n_plus_one]
+    if repeated:
+        metrics.record_n_plus_one(route)
+        for count, statement in repeated:
+            logger.warning('N+1 on %s %s: %d times %s', request.method, route, count,
+                           statement[:MAX_LOGGED_STATEMENT])
+    return [
+        'db;dur={:.3f};desc="{} queries"'.format(sql_time * 1000, statements),
+        'serialize;dur={:.3f}'.format(serialization_time * 1000),
+        'total;dur={:.3f}'.format(duration * 1000),
+    ]
+
+
+def resource_families(pool, response_cache, single_flight=None):
+    '''
+    The status of the connection pool, of the response cache and of the coalescing as extra families of render()
+    '''
+    families = []
+    for key in ('size', 'checked_in', 'checked_out', 'overflow'):
+        if key in pool:
+            families.append(('trivia_pool_' + key, 'gauge', 'Connections ' + key.replace('_', ' ') + ' of the pool',
+                             [([], pool[key])]))
+    if 'checkouts' in pool:
+        families.append(('trivia_pool_checkouts_total', 'counter', 'Connections checked out of the pool',
+                         [([], pool['checkouts'])]))
+        families.append(('trivia_pool_wait_seconds_total', 'counter', 'Time waited for a connection of the pool',
+                         [([], pool['wait_ms_total'] / 1000.0)]))
+    if response_cache is not None:
+        for key in ('hits', 'misses', 'evictions'):
+            families.append(('trivia_response_cache_{}_total'.format(key), 'counter',
+                             'Response cache ' + key, [([], response_cache[key])]))
+        families.append(('trivia_response_cache_entries', 'gauge', 'Responses in the cache',
+                         [([], response_cache['entries'])]))
+        families.append(('trivia_response_cache_bytes', 'gauge', 'Size of the responses in the cache',
+                         [([], response_cache['bytes'])]))
+    if single_flight is not None:
+        families.append(('trivia_coalesced_requests_total', 'counter',
+                         'Read requests that ran their view (leader) or waited for an identical one (follower)',
+                         [([('role', 'leader')], single_flight['leaders']),
+                          ([('role', 'follower')], single_flight['followers'])]))
+    return families
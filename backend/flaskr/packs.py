@@ -0,0 +1,129 @@
+import gzip
+import hashlib
+import io
+import os
+import tempfile
+import threading
+
+from models import Question
+from .serialize import COLUMNS, format_row, dumps
+from .routing import primary
+
+'''
+Quiz packs
+
+A pack is the snapshot of all the questions of a category, for the clients playing its quizzes
+offline. It is written gzipped in QUIZ_PACK_DIR under a name derived from the hash of its content,
+<category>-<version>.json.gz, so that the same questions always give the same file, which the workers
+sharing the directory can serve without coordination, and GET /categories/<id>/pack sends it as is.
+A change of the questions of a category marks its pack dirty, it is rebuilt by the next request for it
+or by `flask build-packs`. The packs of the other categories are kept. The file of the previous pack
+is removed: a pack is served from the file opened once (see open()), read whole even when removed
+meanwhile, and a worker finding its file gone builds the pack again.
+'''
+
+
+class Pack(object):
+    def __init__(self, category, version, path, total):
+        self.category = category
+        self.version = version
+        self.path = path
+        self.total = total
+
+
+class PackStore(object):
+    def __init__(self, session, directory):
+        self.session = session
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._packs = {}
+        # category -> path of the last pack written, kept across the invalidations
+        self._files = {}
+        # bumped by every invalidation, a pack built across one is not kept
+        self._epoch = 0
+        self.builds = 0
+
+    def apply(self, changes):
+        with self._lock:
+            self._epoch += 1
+            if changes.bulk or changes.categories:
+                self._packs.clear()
+            else:
+                for category in changes.question_categories():
+                    self._packs.pop(category, None)
+
+    def get(self, category, category_type):
+        '''
+        Current pack of the category, built when it is dirty
+        '''
+        pack = self._packs.get(category)
+        if pack is not None:
+            return pack
+        # one build at a time, the requests waiting for it are then served its pack
+        with self._build_lock:
+            pack = self._packs.get(category)
+            if pack is not None:
+                return pack
+            return self.build(category, category_type)
+
+    def open(self, category, category_type):
+        '''
+        Current pack of the category and its file, opened for reading
+        '''
+        pack = self.get(category, category_type)
+        try:
+            return pack, open(pack.path, 'rb')
+        except FileNotFoundError:
+            # removed by the rebuild of another worker
+            with self._lock:
+                if self._packs.get(category) is pack:
+                    del self._packs[category]
+        pack = self.get(category, category_type)
+        return pack, open(pack.path, 'rb')
+
+    def build(self, category, category_type):
+        epoch = self._epoch
+        with primary():
+            rows = self.session.query(*COLUMNS).filter(Question.category == category).order_by(Question.id).all()
+        questions = [format_row(row) for row in rows]
+        content = dumps({'category': {'id': category, 'type': category_type}, 'questions': questions})
+        version = hashlib.sha256(content).hexdigest()[:16]
+        body = dumps({
+            'success': True,
+            'version': version,
+            'category': {'id': category, 'type': category_type},
+            'total_questions': len(questions),
+            'questions': questions
+        })
+        path = os.path.join(self.directory, '{}-{}.json.gz'.format(category, version))
+        if not os.path.exists(path):
+            self._write(path, body)
+        pack = Pack(category, version, path, len(questions))
+        with self._lock:
+            if epoch == self._epoch:
+                self._packs[category] = pack
+            previous = self._files.get(category)
+            self._files[category] = path
+            self.builds += 1
+        if previous is not None and previous != path:
+            self._remove(previous)
+        return pack
+
+    def _write(self, path, body):
+        os.makedirs(self.directory, exist_ok=True)
+        buffer = io.BytesIO()
+        # no name nor time in the header, the same questions give the same bytes
+        with gzip.GzipFile(filename='', mode='wb', fileobj=buffer, mtime=0) as compressed:
+            compressed.write(body)
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(descriptor, 'wb') as output:
+            output.write(buffer.getvalue())
+        # atomic, a reader never sees a partial pack
+        os.replace(temporary, path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,66 @@
+import threading
+import time
+
+from flask import g, has_request_context
+from sqlalchemy.pool import QueuePool
+
+'''
+Connection pool instrumentation
+
+TimedQueuePool is the default QueuePool timing how long each checkout waits for a connection,
+which is the time lost when the pool is too small for the load. The waits are added up per request
+(g.pool_wait) and for the process (PoolStats).
+'''
+
+
+class PoolStats(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, wait):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+
+class TimedQueuePool(QueuePool):
+    stats = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        finally:
+            wait = time.perf_counter() - start
+            if self.stats is not None:
+                self.stats.record(wait)
+            if has_request_context():
+                g.pool_wait = g.get('pool_wait', 0.0) + wait
+
+
+def pool_class(stats):
+    # a subclass per application, recreate() keeps the class and so the stats
+    return type('TimedQueuePool', (TimedQueuePool,), {'stats': stats})
+
+
+def pool_status(pool, stats):
+    status = {'pool': pool.__class__.__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow()
+        })
+    if stats is not None:
+        with stats._lock:
+            status.update({
+                'checkouts': stats.checkouts,
+                'wait_ms_total': round(stats.wait_total * 1000, 3),
+                'wait_ms_max': round(stats.wait_max * 1000, 3)
+            })
+    return status
@@ -0,0 +1,373 @@
+import bisect
+import math
+import random
+import threading
+from array import array
+from itertools import accumulate
+
+from models import Question
+from .serialize import fetch_question, fetch_questions
+from .routing import primary
+
+'''
+Selection of the quiz questions
+
+QuestionPool keeps in memory, per category and for all the categories, the ids of the questions
+bucketed by difficulty, each bucket in an array along with the position of each id. Adding appends,
+removing moves the last id in the hole, so that both are O(1) and the index follows the creations
+and deletions without being rebuilt.
+A draw picks a bucket on the cumulative weights of the buckets, the weight of a difficulty times
+the number of questions left in the bucket, by bisection, then a random index in the bucket.
+Uniform draws weigh every difficulty 1, the adaptive quizzes weigh them by their distance to a
+target difficulty (see difficulty_weight).
+The previous questions are skipped by rejection sampling: while they are a minority of the bucket,
+a few draws are enough. Once they are the majority, the remaining candidates are enumerated.
+'''
+
+ALL_CATEGORIES = 0
+# questions returned by one request of a quiz
+MAX_QUIZ_COUNT = 50
+# rejection draws attempted before enumerating the candidates
+MAX_REJECTIONS = 16
+
+
+class IdPool(object):
+    def __init__(self):
+        self.ids = array('q')
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, question_id):
+        return question_id in self.positions
+
+    def add(self, question_id):
+        if question_id in self.positions:
+            return
+        self.positions[question_id] = len(self.ids)
+        self.ids.append(question_id)
+
+    def remove(self, question_id):
+        position = self.positions.pop(question_id, None)
+        if position is None:
+            return
+        last = self.ids.pop()
+        if position < len(self.ids):
+            self.ids[position] = last
+            self.positions[last] = position
+
+    def draw(self, excluded, rnd=random):
+        '''
+        Uniform id of the pool not in the set excluded, None when there is none
+        '''
+        size = len(self.ids)
+        if size == 0:
+            return None
+        skipped = sum(1 for id in excluded if id in self.positions) if excluded else 0
+        if skipped >= size:
+            return None
+        if skipped * 2 <= size:
+            for _ in range(MAX_REJECTIONS):
+                question_id = self.ids[rnd.randrange(size)]
+                if question_id not in excluded:
+                    return question_id
+        candidates = [id for id in self.ids if id not in excluded]
+        return rnd.choice(candidates)
+
+
+class CategoryPool(object):
+    '''
+    The ids of the questions of a category, by difficulty
+    '''
+
+    def __init__(self):
+        self.buckets = {}
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, question_id):
+        return any(question_id in bucket for bucket in self.buckets.values())
+
+    def add(self, question_id, difficulty):
+        bucket = self.buckets.setdefault(difficulty, IdPool())
+        if question_id not in bucket:
+            bucket.add(question_id)
+            self.size += 1
+
+    def remove(self, question_id, difficulty):
+        bucket = self.buckets.get(difficulty)
+        if bucket is None or question_id not in bucket:
+            return False
+        bucket.remove(question_id)
+        self.size -= 1
+        if not bucket:
+            del self.buckets[difficulty]
+        return True
+
+    def discard(self, question_id):
+        '''
+        Remove an id whose difficulty is not known
+        '''
+        for difficulty in list(self.buckets):
+            if self.remove(question_id, difficulty):
+                return
+
+    def difficulties(self):
+        return sorted(difficulty for difficulty in self.buckets if difficulty is not None)
+
+    def draw(self, excluded, weight=None, rnd=random):
+        '''
+        Id not in the set excluded drawn with a probability proportional to the weight of its difficulty,
+        uniform when weight is None, None when there is none left
+        '''
+        buckets = list(self.buckets.items())
+        cumulative = list(accumulate((weight(difficulty) if weight is not None else 1.0) * len(bucket)
+                                     for difficulty, bucket in buckets))
+        if cumulative and cumulative[-1] > 0:
+            # an excluded id is drawn again, which keeps the probabilities of the others
+            for _ in range(MAX_REJECTIONS):
+                index = min(bisect.bisect_right(cumulative, rnd.random() * cumulative[-1]), len(buckets) - 1)
+                ids = buckets[index][1].ids
+                question_id = ids[rnd.randrange(len(ids))]
+                if question_id not in excluded:
+                    return question_id
+        return self._draw_left(buckets, excluded, weight, rnd)
+
+    def _draw_left(self, buckets, excluded, weight, rnd):
+        # the weights of the buckets by their number of ids not excluded
+        left = [(difficulty, bucket, len(bucket) - sum(1 for id in excluded if id in bucket.positions))
+                for difficulty, bucket in buckets]
+        left = [(difficulty, bucket, count) for difficulty, bucket, count in left if count > 0]
+        if not left:
+            return None
+        cumulative = list(accumulate((weight(difficulty) if weight is not None else 1.0) * count
+                                     for difficulty, bucket, count in left))
+        if cumulative[-1] <= 0:
+            # every difficulty left is too far from the target to weigh anything
+            cumulative = list(accumulate(count for difficulty, bucket, count in left))
+        index = min(bisect.bisect_right(cumulative, rnd.random() * cumulative[-1]), len(left) - 1)
+        return left[index][1].draw(excluded, rnd)
+
+    def sample(self, size, rnd=random):
+        '''
+        Up to size distinct uniform ids, in random order
+        '''
+        buckets = list(self.buckets.values())
+        offsets = list(accumulate(len(bucket) for bucket in buckets))
+        picked = []
+        # the positions in the concatenation of the buckets, located by bisection
+        for position in rnd.sample(range(self.size), min(size, self.size)):
+            index = bisect.bisect_right(offsets, position)
+            picked.append(buckets[index].ids[position - (offsets[index - 1] if index else 0)])
+        return picked
+
+
+def difficulty_weight(target, spread=1.0):
+    '''
+    Weight of a difficulty for a quiz aiming at target: a gaussian of width spread around it,
+    the questions without difficulty are only drawn when nothing else is left
+    '''
+    def weight(difficulty):
+        if difficulty is None:
+            return 0.0
+        return math.exp(-0.5 * ((difficulty - target) / spread) ** 2)
+    return weight
+
+
+def number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError('{!r} is not a number'.format(value))
+    return float(value)
+
+
+def target_difficulty(body, difficulties, asked):
+    '''
+    Difficulty aimed at by the quiz request body, None for a uniform draw:
+        - curve, the difficulties of the successive questions, the last one is kept once they are all asked
+        - difficulty, a fixed difficulty
+        - accuracy, the rolling rate of right answers of the player in [0, 1], mapped on the range of
+        difficulties of the category so that a better player gets harder questions
+    Raise ValueError when they are invalid
+    '''
+    curve = body.get('curve')
+    if curve is not None:
+        if not isinstance(curve, list) or not curve:
+            raise ValueError('curve must be a list of difficulties')
+        return number(curve[min(asked, len(curve) - 1)])
+    if body.get('difficulty') is not None:
+        return number(body['difficulty'])
+    if body.get('accuracy') is not None:
+        accuracy = number(body['accuracy'])
+        if not 0 <= accuracy <= 1:
+            raise ValueError('accuracy must be between 0 and 1')
+        if not difficulties:
+            return None
+        return difficulties[0] + accuracy * (difficulties[-1] - difficulties[0])
+    return None
+
+
+def quiz_weight(pool, category, body, spread=1.0):
+    '''
+    Weight of the difficulties for the quiz request body (see target_difficulty), None for a uniform draw
+    '''
+    asked = len(body.get('previous_questions') or [])
+    target = target_difficulty(body, pool.difficulties(category) if 'accuracy' in body else [], asked)
+    return difficulty_weight(target, spread) if target is not None else None
+
+
+def quiz_count(body):
+    '''
+    Number of questions requested by body, None for a single question, ValueError when invalid
+    '''
+    count = body.get('count')
+    if count is None:
+        return None
+    if isinstance(count, bool) or not isinstance(count, int) or not 1 <= count <= MAX_QUIZ_COUNT:
+        raise ValueError('count must be between 1 and {}'.format(MAX_QUIZ_COUNT))
+    return count
+
+
+class QuestionPool(object):
+    def __init__(self, session):
+        self.session = session
+        self._lock = threading.Lock()
+        self._pools = None
+        # bumped by every change, a rebuild racing with a change must not be kept
+        self._version = 0
+
+    @property
+    def version(self):
+        with self._lock:
+            return self._version
+
+    def rebuild(self):
+        version = self.version
+        with primary():
+            rows = self.session.query(Question.id, Question.category, Question.difficulty).all()
+        return self.load(rows, version)
+
+    def load(self, rows, version=None):
+        '''
+        Replace the pools by the (id, category, difficulty) of rows, read at version: when a change
+        was applied since, the pools are only returned to the caller
+        '''
+        pools = {ALL_CATEGORIES: CategoryPool()}
+        for id, category, difficulty in rows:
+            pools[ALL_CATEGORIES].add(id, difficulty)
+            pools.setdefault(category, CategoryPool()).add(id, difficulty)
+        with self._lock:
+            if version is None or version == self._version:
+                self._pools = pools
+        return pools
+
+    def _current(self):
+        pools = self._pools
+        return pools if pools is not None else self.rebuild()
+
+    def apply(self, changes):
+        with self._lock:
+            self._version += 1
+            if self._pools is None:
+                return
+            # the foreign key moves the questions of a deleted or renumbered category behind the ORM
+            if changes.bulk or changes.categories:
+                self._pools = None
+                return
+            for question in changes.removed:
+                self._remove(question['id'], question['category'], question['difficulty'])
+            for question in changes.added:
+                self._pools[ALL_CATEGORIES].add(question['id'], question['difficulty'])
+                self._pools.setdefault(question['category'], CategoryPool()).add(question['id'],
+                                                                                 question['difficulty'])
+
+    def _remove(self, question_id, category, difficulty):
+        self._pools[ALL_CATEGORIES].remove(question_id, difficulty)
+        if category in self._pools:
+            self._pools[category].remove(question_id, difficulty)
+
+    def draw(self, category, excluded, weight=None):
+        pools = self._current()
+        with self._lock:
+            pool = pools.get(category)
+            return pool.draw(excluded, weight) if pool is not None else None
+
+    def difficulties(self, category):
+        '''
+        Sorted difficulties of the questions of the category
+        '''
+        pools = self._current()
+        with self._lock:
+            pool = pools.get(category)
+            return pool.difficulties() if pool is not None else []
+
+    def sample(self, category, size):
+        '''
+        Up to size distinct random ids of the category, in random order
+        '''
+        pools = self._current()
+        with self._lock:
+            pool = pools.get(category)
+            if pool is None:
+                return []
+            return pool.sample(size)
+
+    def discard(self, question_id, category):
+        '''
+        Remove an id found missing in the database, e.g. deleted by another worker
+        '''
+        with self._lock:
+            if self._pools is not None:
+                self._pools[ALL_CATEGORIES].discard(question_id)
+                if category in self._pools:
+                    self._pools[category].discard(question_id)
+
+    def next_question(self, category, previous, weight=None):
+        '''
+        Random question of the category (ALL_CATEGORIES for any) whose id is not in previous,
+        drawn by the weight of its difficulty (uniform when None), fetched by primary key as a QuestionRow,
+        None when every question was already asked
+        '''
+        excluded = set(previous)
+        while True:
+            question_id = self.draw(category, excluded, weight)
+            if question_id is None:
+                return None
+            question = fetch_question(self.session, question_id)
+            if question is not None:
+                return question
+            self.discard(question_id, category)
+            excluded.add(question_id)
+
+    def draw_many(self, category, excluded, count, weight=None):
+        '''
+        Up to count distinct ids not in excluded, added to excluded as they are drawn
+        '''
+        ids = []
+        for _ in range(count):
+            question_id = self.draw(category, excluded, weight)
+            if question_id is None:
+                break
+            ids.append(question_id)
+            excluded.add(question_id)
+        return ids
+
+    def next_questions(self, category, previous, count, weight=None):
+        '''
+        Up to count distinct questions as next_question, fetched together in one query
+        '''
+        excluded = set(previous)
+        questions = []
+        while len(questions) < count:
+            ids = self.draw_many(category, excluded, count - len(questions), weight)
+            if not ids:
+                break
+            rows = fetch_questions(self.session, ids)
+            for question_id in ids:
+                if question_id in rows:
+                    questions.append(rows[question_id])
+                else:
+                    self.discard(question_id, category)
+        return questions
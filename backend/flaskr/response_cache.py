@@ -0,0 +1,134 @@
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, make_response
+
+from .routing import served_by_replica
+
+'''
+Result cache of the listings
+
+The serialized body of the successful listings is kept in a LRU bounded in number of entries
+and in bytes, keyed on the endpoint and all its parameters. Each entry has a tag: the category
+of a category listing, GLOBAL for the listings of all the questions and the searches.
+A change of the questions of category N evicts the entries of N and the GLOBAL ones only.
+A change of the categories, which are part of every listing, or a bulk change clears everything.
+'''
+
+GLOBAL = 'global'
+
+
+class CachedResponse(object):
+    def __init__(self, body, mimetype, tag):
+        self.body = body
+        self.mimetype = mimetype
+        self.tag = tag
+
+
+class ResponseCache(object):
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._bytes = 0
+        # bumped by every invalidation, a response computed across one is not stored
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def epoch(self):
+        return self._epoch
+
+    def put(self, key, entry, epoch):
+        size = len(entry.body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if epoch != self._epoch:
+                return
+            self._remove(key)
+            self._entries[key] = entry
+            self._tags.setdefault(entry.tag, set()).add(key)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= len(entry.body)
+        keys = self._tags.get(entry.tag)
+        keys.discard(key)
+        if not keys:
+            del self._tags[entry.tag]
+
+    def evict(self, tags):
+        with self._lock:
+            self._epoch += 1
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self.evictions += len(self._entries)
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def apply(self, changes):
+        if changes.bulk or changes.categories:
+            self.clear()
+        else:
+            self.evict(changes.question_categories() | {GLOBAL})
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes
+            }
+
+
+def memoized(cache, tag=lambda **kwargs: GLOBAL):
+    '''
+    Serve the view from cache, tag gives the tag of an entry from the arguments of the view
+    '''
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if cache is None:
+                return view(*args, **kwargs)
+            key = (request.endpoint, tuple(sorted(kwargs.items())), tuple(sorted(request.args.items(multi=True))))
+            entry = cache.get(key)
+            if entry is not None:
+                return make_response(entry.body, 200, {'Content-Type': entry.mimetype})
+            epoch = cache.epoch()
+            response = make_response(view(*args, **kwargs))
+            # a lagging replica would keep its view in the cache until the next change
+            if response.status_code == 200 and not served_by_replica():
+                cache.put(key, CachedResponse(response.get_data(), response.mimetype, tag(**kwargs)), epoch)
+            return response
+        return wrapper
+    return decorator
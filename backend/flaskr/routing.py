@@ -0,0 +1,150 @@
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql.dml import UpdateBase
+
+'''
+Read replica routing
+
+The statements of the read requests (GET, and the views marked with replica_read) run on one of
+the replicas of SQLALCHEMY_REPLICA_URIS, picked round robin. Writes, flushes and SELECT ... FOR UPDATE
+always run on the primary, as every statement of the other requests.
+A replica failing to connect or losing its connection is skipped for REPLICA_RETRY_SECONDS,
+the primary serving the reads when no replica is healthy, and the read request that hit the failure
+is run again on the primary.
+The process wide caches (counts, quiz pool, categories, search index, packs) are rebuilt from the
+primary (see primary()): built from a lagging replica, they would miss the changes until the next one,
+and the responses read on a replica are not kept by the response cache.
+After a write, the client receives a cookie sending its reads to the primary for
+READ_YOUR_WRITES_SECONDS, so that it sees its own changes despite the replication lag.
+'''
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_COOKIE = 'trivia_primary_until'
+READ_METHODS = ('GET', 'HEAD')
+
+
+@contextmanager
+def primary():
+    '''
+    Run the statements of the block on the primary, even in a read request
+    '''
+    if not has_request_context() or not g.get('db_read_only'):
+        yield
+        return
+    g.db_read_only = False
+    try:
+        yield
+    finally:
+        g.db_read_only = True
+
+
+def served_by_replica():
+    return has_request_context() and g.get('db_replica') is not None
+
+
+def replica_read(view):
+    '''
+    Mark a view that only reads although its method is not GET
+    '''
+    view.replica_read = True
+    return view
+
+
+class ReplicaRouter(object):
+    def __init__(self, engines, retry_after=30):
+        self.engines = engines
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._down_until = {}
+        self.reads = dict((repr(engine.url), 0) for engine in engines)
+        for engine in engines:
+            event.listen(engine, 'handle_error', self._on_error(engine))
+
+    def _on_error(self, engine):
+        def on_error(context):
+            # connection refused or lost, not an error of the statement itself
+            if context.connection is None or context.is_disconnect:
+                self.mark_down(engine)
+        return on_error
+
+    def mark_down(self, engine):
+        logger.warning('Replica %r is down', engine.url)
+        with self._lock:
+            self._down_until[engine] = time.monotonic() + self.retry_after
+
+    def is_down(self, engine):
+        with self._lock:
+            return self._down_until.get(engine, 0) > time.monotonic()
+
+    def replica(self):
+        '''
+        Next healthy replica, None when there is none
+        '''
+        now = time.monotonic()
+        start = next(self._counter)
+        with self._lock:
+            for i in range(len(self.engines)):
+                engine = self.engines[(start + i) % len(self.engines)]
+                if self._down_until.get(engine, 0) <= now:
+                    return engine
+        return None
+
+    def engine_for(self, clause):
+        if not has_request_context() or not g.get('db_read_only'):
+            return None
+        if isinstance(clause, UpdateBase) or getattr(clause, '_for_update_arg', None) is not None:
+            return None
+        if 'db_replica' not in g:
+            # the same replica for the whole request
+            g.db_replica = self.replica()
+            if g.db_replica is not None:
+                with self._lock:
+                    self.reads[repr(g.db_replica.url)] += 1
+        return g.db_replica
+
+
+def init_routing(app, engine_options):
+    uris = app.config.get('SQLALCHEMY_REPLICA_URIS') or []
+    if not uris:
+        return None
+    router = ReplicaRouter([create_engine(uri, **engine_options(uri)) for uri in uris],
+                           app.config.get('REPLICA_RETRY_SECONDS', 30))
+    app.extensions['db_router'] = router
+    window = app.config.get('READ_YOUR_WRITES_SECONDS', 5)
+
+    @app.before_request
+    def route_reads():
+        view = app.view_functions.get(request.endpoint)
+        read = request.method in READ_METHODS or getattr(view, 'replica_read', False)
+        if read and request.cookies.get(PRIMARY_COOKIE, type=float, default=0) > time.time():
+            read = False
+        g.db_read_only = read
+
+    @app.errorhandler(DBAPIError)
+    def read_on_primary(error):
+        # the replica of the request went down while it was read, the request is served by the primary
+        replica = g.pop('db_replica', None)
+        if replica is None or not router.is_down(replica):
+            raise error
+        logger.warning('Reading %s again on the primary', request.path)
+        app.db.session.rollback()
+        g.db_read_only = False
+        return app.make_response(app.view_functions[request.endpoint](**request.view_args))
+
+    @app.after_request
+    def stick_to_primary(response):
+        if not g.get('db_read_only') and request.method not in READ_METHODS + ('OPTIONS',) \
+                and response.status_code < 400 and window:
+            response.set_cookie(PRIMARY_COOKIE, str(time.time() + window), max_age=window, httponly=True)
+        return response
+
+    return router
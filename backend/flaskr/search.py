@@ -0,0 +1,203 @@
+import bisect
+import re
+import threading
+
+from sqlalchemy import or_, func, literal_column
+
+from models import Question
+from .routing import primary
+
+'''
+Search engines of the questions
+
+SEARCH_ENGINE selects how searchTerm is matched:
+    - like: case insensitive substring of the question (the historical behavior).
+    On PostgreSQL, the pg_trgm GIN indexes created by the migrations serve the ILIKE
+    - fulltext: words of the question, ranked by relevance. The last word matches as a prefix,
+    so that results follow the keystrokes. On PostgreSQL, it is a tsvector match served by
+    a GIN expression index. Elsewhere, it is the in memory inverted index InvertedIndexSearch
+
+With answers, the answer of the questions is searched as well.
+The search of an engine returns a SearchResult:
+    - query, the selection filtered by the term
+    - rank, when the engine ranks in SQL, the relevance of a question, the most relevant first
+    - ids, when the engine ranks in memory, the ids of the matching questions, most relevant first
+'''
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower()) if text else []
+
+
+class SearchResult(object):
+    def __init__(self, query=None, rank=None, ids=None):
+        self.query = query
+        self.rank = rank
+        self.ids = ids
+
+
+class LikeSearch(object):
+    ranked = False
+
+    def search(self, query, term, answers=False):
+        pattern = '%{}%'.format(term)
+        condition = Question.question.ilike(pattern)
+        if answers:
+            condition = or_(condition, Question.answer.ilike(pattern))
+        return SearchResult(query=query.filter(condition))
+
+
+def _vector(answers):
+    # must stay identical to the expressions of the indexes of migrations/versions/0003_search_indexes.py
+    text = func.coalesce(Question.question, literal_column("''"))
+    if answers:
+        text = text.op('||')(literal_column("' '")).op('||')(func.coalesce(Question.answer, literal_column("''")))
+    return func.to_tsvector(literal_column("'simple'::regconfig"), text)
+
+
+class PostgresFullTextSearch(object):
+    ranked = True
+
+    def search(self, query, term, answers=False):
+        tokens = tokenize(term)
+        if not tokens:
+            return SearchResult(query=query.filter(literal_column('false')))
+        tokens[-1] += ':*'
+        tsquery = func.to_tsquery(literal_column("'simple'::regconfig"), ' & '.join(tokens))
+        vector = _vector(answers)
+        return SearchResult(query=query.filter(vector.op('@@')(tsquery)), rank=func.ts_rank(vector, tsquery))
+
+
+class Postings(object):
+    '''
+    token -> sorted ids of the questions containing it, and the sorted vocabulary
+    to find the tokens starting with a prefix
+    '''
+
+    def __init__(self):
+        self.postings = {}
+        self.vocabulary = []
+
+    def add(self, question_id, tokens):
+        for token in set(tokens):
+            ids = self.postings.get(token)
+            if ids is None:
+                ids = self.postings[token] = []
+                bisect.insort(self.vocabulary, token)
+            index = bisect.bisect_left(ids, question_id)
+            if index == len(ids) or ids[index] != question_id:
+                ids.insert(index, question_id)
+
+    def remove(self, question_id, tokens):
+        for token in set(tokens):
+            ids = self.postings.get(token)
+            if ids is None:
+                continue
+            index = bisect.bisect_left(ids, question_id)
+            if index < len(ids) and ids[index] == question_id:
+                del ids[index]
+            if not ids:
+                del self.postings[token]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, token)]
+
+    def exact(self, token):
+        return self.postings.get(token, [])
+
+    def prefixed(self, prefix):
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        ids = set()
+        for token in self.vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            ids.update(self.postings[token])
+        return ids
+
+
+class InvertedIndexSearch(object):
+    '''
+    Pure Python fallback of the full text search, built from the database on the first search
+    and maintained from the committed changes. Questions matching in their question rank before
+    the ones matching only in their answer, exact words before prefixes, then by id
+    '''
+    ranked = True
+
+    def __init__(self, session):
+        self.session = session
+        self._lock = threading.Lock()
+        self._questions = None
+        self._answers = None
+        # bumped by every change, a rebuild racing with a change must not be kept
+        self._version = 0
+
+    def rebuild(self):
+        with self._lock:
+            version = self._version
+        questions, answers = Postings(), Postings()
+        with primary():
+            rows = self.session.query(Question.id, Question.question, Question.answer).all()
+        for id, question, answer in rows:
+            questions.add(id, tokenize(question))
+            answers.add(id, tokenize(answer))
+        with self._lock:
+            # a change committed during the build may be missing, the index is only used by this search
+            if version == self._version:
+                self._questions, self._answers = questions, answers
+        return questions, answers
+
+    def apply(self, changes):
+        with self._lock:
+            self._version += 1
+            if self._questions is None:
+                return
+            if changes.bulk:
+                self._questions = self._answers = None
+                return
+            for question in changes.removed:
+                self._questions.remove(question['id'], tokenize(question['question']))
+                self._answers.remove(question['id'], tokenize(question['answer']))
+            for question in changes.added:
+                self._questions.add(question['id'], tokenize(question['question']))
+                self._answers.add(question['id'], tokenize(question['answer']))
+
+    def ranked_ids(self, term, answers=False):
+        tokens = tokenize(term)
+        if not tokens:
+            return []
+        with self._lock:
+            questions, answers_postings = self._questions, self._answers
+        if questions is None:
+            questions, answers_postings = self.rebuild()
+        with self._lock:
+            fields = [questions, answers_postings] if answers else [questions]
+            scores = None
+            for position, token in enumerate(tokens):
+                last = position == len(tokens) - 1
+                token_scores = {}
+                # weight: 4 exact word of the question, 2 prefix in the question, 1 in the answer
+                for field, weight in zip(fields, (2, 1)):
+                    for id in field.exact(token):
+                        token_scores[id] = max(token_scores.get(id, 0), 2 * weight)
+                    if last:
+                        for id in field.prefixed(token):
+                            token_scores.setdefault(id, weight)
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {id: score + token_scores[id] for id, score in scores.items() if id in token_scores}
+        return sorted(scores, key=lambda id: (-scores[id], id))
+
+    def search(self, query, term, answers=False):
+        return SearchResult(ids=self.ranked_ids(term, answers))
+
+
+def make_search_engine(name, session):
+    if name == 'like':
+        return LikeSearch()
+    if name == 'fulltext':
+        if session.get_bind().dialect.name == 'postgresql':
+            return PostgresFullTextSearch()
+        return InvertedIndexSearch(session)
+    raise ValueError('Unknown SEARCH_ENGINE {}'.format(name))
+
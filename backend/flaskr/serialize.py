@@ -0,0 +1,138 @@
+import json
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+
+from models import Question
+from .metrics import serialization
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+'''
+Serialization of the questions
+
+The listings select the columns of the questions as tuples instead of loading ORM objects,
+and the responses are encoded with orjson when it is installed, the json module otherwise.
+QuestionEncoder keeps the encoded JSON object of the recently served questions, keyed on the
+values of the row: a changed question is a different row and is encoded again, the stale
+fragments leave the LRU with time.
+The listings may project the questions on some fields (fields=), the quizzes load a single
+question as a QuestionRow, a value object without the bookkeeping of the ORM.
+'''
+
+FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+COLUMNS = tuple(getattr(Question, field) for field in FIELDS)
+
+
+def _dumps(value):
+    if orjson is not None:
+        # the categories are keyed on their id
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def dumps(value):
+    with serialization():
+        return _dumps(value)
+
+
+def parse_fields(value):
+    '''
+    Fields of a comma separated list, in the order of FIELDS, all of them when value is empty
+    '''
+    if not value:
+        return FIELDS
+    requested = {field.strip() for field in value.split(',') if field.strip()}
+    unknown = requested.difference(FIELDS)
+    if unknown:
+        raise ValueError('unknown fields {}'.format(', '.join(sorted(unknown))))
+    return tuple(field for field in FIELDS if field in requested)
+
+
+def question_rows(query, fields=FIELDS):
+    '''
+    query selecting the columns of fields instead of the Question objects
+    '''
+    return query.with_entities(*[getattr(Question, field) for field in fields])
+
+
+def format_row(row, fields=FIELDS):
+    # the row may have more columns than fields, e.g. the sort key of a cursor
+    return dict(zip(fields, row))
+
+
+class QuestionRow(object):
+    __slots__ = FIELDS
+
+    def __init__(self, id, question, answer, category, difficulty):
+        self.id = id
+        self.question = question
+        self.answer = answer
+        self.category = category
+        self.difficulty = difficulty
+
+    def format(self):
+        return format_row((self.id, self.question, self.answer, self.category, self.difficulty))
+
+
+def fetch_question(session, question_id):
+    '''
+    QuestionRow of the question, None when there is none
+    '''
+    row = session.query(*COLUMNS).filter(Question.id == question_id).first()
+    return QuestionRow(*row) if row is not None else None
+
+
+def fetch_questions(session, question_ids):
+    '''
+    QuestionRow of the questions by id, in one query, the ids missing are not in the result
+    '''
+    if not question_ids:
+        return {}
+    return {row[0]: QuestionRow(*row) for row in session.query(*COLUMNS).filter(Question.id.in_(question_ids))}
+
+
+class QuestionEncoder(object):
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._fragments = OrderedDict()
+
+    def fragments(self, rows, fields=FIELDS):
+        keys = [(fields, tuple(row)) for row in rows]
+        fragments = []
+        with self._lock:
+            for key in keys:
+                fragment = self._fragments.get(key)
+                if fragment is not None:
+                    self._fragments.move_to_end(key)
+                fragments.append(fragment)
+        missing = {}
+        for i, key in enumerate(keys):
+            if fragments[i] is None:
+                fragments[i] = missing[key] = _dumps(format_row(key[1], fields))
+        if missing:
+            with self._lock:
+                self._fragments.update(missing)
+                while len(self._fragments) > self.max_entries:
+                    self._fragments.popitem(last=False)
+        return fragments
+
+    def encode(self, payload, rows, fields=FIELDS, name='questions'):
+        '''
+        JSON of the dict payload with the list of the rows, projected on fields, under name
+        '''
+        with serialization():
+            if not self.max_entries:
+                return _dumps(dict(payload, **{name: [format_row(row, fields) for row in rows]}))
+            head = _dumps(payload)
+            return b''.join((head[:-1], b',"' if payload else b'"', name.encode('ascii'), b'":[',
+                             b','.join(self.fragments(rows, fields)), b']}'))
+
+
+def json_response(body, status=200):
+    return current_app.response_class(body, status=status, mimetype='application/json')
@@ -0,0 +1,135 @@
+import threading
+import time
+import uuid
+from array import array
+from collections import OrderedDict
+
+from sqlalchemy import func
+
+from models import QuizSession, QuizSessionQuestion
+from .routing import primary
+
+'''
+Server side quiz sessions
+
+A session is a deck of question ids shuffled when the quiz starts, the next question is
+popped from it so that the client does not have to send back the questions already asked.
+The stores keep at most capacity sessions: a session unused for ttl seconds expires and,
+when the store is full, the least recently used one is evicted.
+    - MemorySessionStore, the decks are arrays in the worker (default)
+    - DatabaseSessionStore, the decks are rows of quiz_session_questions, shared by the workers
+'''
+
+
+DECK_SIZE = 100
+MAX_DECK_SIZE = 1000
+
+
+class SessionNotFound(KeyError):
+    pass
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+class MemorySessionStore(object):
+    def __init__(self, capacity=10000, ttl=3600):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # session id -> [deck, expires_at], ordered from the least to the most recently used
+        self._sessions = OrderedDict()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def create(self, category, deck):
+        session_id = new_session_id()
+        # reversed so that popping from the end of the array follows the order of deck
+        entry = [array('q', reversed(deck)), time.time() + self.ttl]
+        with self._lock:
+            self._sessions[session_id] = entry
+            while len(self._sessions) > self.capacity:
+                self._sessions.popitem(last=False)
+        return session_id
+
+    def pop(self, session_id):
+        '''
+        Next question id of the session and the number of questions left after it,
+        None when the deck is exhausted
+        '''
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[1] < now:
+                self._sessions.pop(session_id, None)
+                raise SessionNotFound(session_id)
+            entry[1] = now + self.ttl
+            self._sessions.move_to_end(session_id)
+            deck = entry[0]
+            question_id = deck.pop() if deck else None
+            return question_id, len(deck)
+
+
+class DatabaseSessionStore(object):
+    def __init__(self, session, capacity=10000, ttl=3600):
+        self.session = session
+        self.capacity = capacity
+        self.ttl = ttl
+
+    def create(self, category, deck):
+        session_id = new_session_id()
+        now = time.time()
+        self._evict(now)
+        self.session.execute(QuizSession.__table__.insert().values(
+            id=session_id, category=category, size=len(deck), position=0, expires_at=now + self.ttl))
+        if deck:
+            self.session.execute(QuizSessionQuestion.__table__.insert(), [
+                {'session_id': session_id, 'position': position, 'question_id': question_id}
+                for position, question_id in enumerate(deck)])
+        self.session.commit()
+        return session_id
+
+    def _evict(self, now):
+        sessions = QuizSession.__table__
+        expired = self.session.query(QuizSession.id).filter(QuizSession.expires_at < now)
+        count = self.session.query(func.count(QuizSession.id)).scalar()
+        if count >= self.capacity:
+            # the least recently used are the ones expiring first
+            overflow = self.session.query(QuizSession.id).order_by(QuizSession.expires_at) \
+                .limit(count - self.capacity + 1)
+            expired = expired.union(overflow)
+        ids = [id for id, in expired]
+        if ids:
+            self.session.execute(QuizSessionQuestion.__table__.delete()
+                                 .where(QuizSessionQuestion.session_id.in_(ids)))
+            self.session.execute(sessions.delete().where(sessions.c.id.in_(ids)))
+
+    def pop(self, session_id):
+        now = time.time()
+        # the deck is read in the transaction locking the session, on the primary
+        with primary():
+            quiz = self.session.query(QuizSession).filter(QuizSession.id == session_id) \
+                .with_for_update().one_or_none()
+            if quiz is None or quiz.expires_at < now:
+                self.session.rollback()
+                raise SessionNotFound(session_id)
+            question_id = None
+            if quiz.position < quiz.size:
+                question_id = self.session.query(QuizSessionQuestion.question_id).filter(
+                    QuizSessionQuestion.session_id == session_id,
+                    QuizSessionQuestion.position == quiz.position).scalar()
+                quiz.position += 1
+            quiz.expires_at = now + self.ttl
+            remaining = quiz.size - quiz.position
+            self.session.commit()
+        return question_id, remaining
+
+
+def make_session_store(name, session, capacity, ttl):
+    if name == 'memory':
+        return MemorySessionStore(capacity, ttl)
+    if name == 'database':
+        return DatabaseSessionStore(session, capacity, ttl)
+    raise ValueError('Unknown QUIZ_SESSION_STORE {}'.format(name))
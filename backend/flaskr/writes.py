@@ -0,0 +1,237 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import Question, QuestionSubmission
+from .routing import primary
+
+'''
+Write-behind creation of the questions
+
+With QUESTION_WRITE_DURABILITY=batched, a validated question is put in a bounded queue and the
+request is answered at once with a tracking id. A thread of the worker takes the questions from the
+queue and inserts them by batches of QUESTION_WRITE_BATCH_SIZE, or what arrived within
+QUESTION_WRITE_INTERVAL seconds, one transaction and so one commit to disk per batch.
+A batch failing as a whole is retried one question at a time, so that only the faulty ones fail.
+The queue is in memory: the questions not yet committed are lost if the process is killed,
+the default durability (sync) commits each question before answering.
+The status of a written question is stored along with it in question_submissions, so that every
+worker can answer for it, and kept STATUS_TTL seconds. The tracking id starts with the time of the
+submission: a worker not knowing it answers queued while the one holding it may still be writing it.
+'''
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+COMMITTED = 'committed'
+FAILED = 'failed'
+# seconds the statuses are kept in the database
+STATUS_TTL = 3600
+PURGE_INTERVAL = 60
+# seconds a submission unknown to this worker may still be queued by another one
+QUEUED_GRACE = 60
+
+
+def new_tracking_id(now):
+    # milliseconds of the submission, then random
+    return '{:012x}{}'.format(int(now * 1000), uuid.uuid4().hex[:20])
+
+
+def submitted_at(tracking_id):
+    try:
+        return int(tracking_id[:12], 16) / 1000.0 if len(tracking_id) == 32 else None
+    except ValueError:
+        return None
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Submission(object):
+    __slots__ = ('tracking_id', 'values')
+
+    def __init__(self, tracking_id, values):
+        self.tracking_id = tracking_id
+        self.values = values
+
+
+class QuestionWriter(object):
+    def __init__(self, app, max_size=10000, batch_size=500, interval=0.05, status_capacity=100000):
+        self.app = app
+        self.batch_size = batch_size
+        self.interval = interval
+        self.status_capacity = status_capacity
+        self._queue = queue.Queue(max_size)
+        self._lock = threading.Lock()
+        # tracking id -> [status, question id], the oldest are forgotten beyond status_capacity
+        self._statuses = OrderedDict()
+        self._thread = None
+        self._pid = None
+        self.committed = 0
+        self.failed = 0
+        self.batches = 0
+        self._purged_at = 0
+        atexit.register(self.flush)
+
+    def submit(self, values):
+        '''
+        Queue the values of a question, return its tracking id, raise QueueFull when the queue is full
+        '''
+        self._start()
+        tracking_id = new_tracking_id(time.time())
+        with self._lock:
+            self._set_status(tracking_id, QUEUED, None)
+        try:
+            self._queue.put_nowait(Submission(tracking_id, values))
+        except queue.Full:
+            with self._lock:
+                self._statuses.pop(tracking_id, None)
+            raise QueueFull()
+        return tracking_id
+
+    def status(self, tracking_id):
+        '''
+        (status, question id) of a submission, None when it is not known
+        '''
+        with self._lock:
+            entry = self._statuses.get(tracking_id)
+        if entry is not None:
+            return tuple(entry)
+        # written by another worker, or forgotten by this one
+        with primary():
+            row = self.app.db.session.query(QuestionSubmission.status, QuestionSubmission.question_id) \
+                .filter(QuestionSubmission.tracking_id == tracking_id).first()
+        if row is not None:
+            return row.status, row.question_id
+        submitted = submitted_at(tracking_id)
+        if submitted is not None and 0 <= time.time() - submitted < QUEUED_GRACE:
+            return QUEUED, None
+        return None
+
+    def _set_status(self, tracking_id, status, question_id):
+        self._statuses[tracking_id] = [status, question_id]
+        while len(self._statuses) > self.status_capacity:
+            self._statuses.popitem(last=False)
+
+    def _start(self):
+        # a thread per process, started by the first submission so that a worker forked from
+        # a preloaded master starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._run, name='question-writer', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def flush(self):
+        '''
+        Wait until every queued question is written
+        '''
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception:
+                logger.exception('Could not write %d questions', len(batch))
+                self._abandon(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        with self.app.app_context():
+            session = self.app.db.session
+            try:
+                if not self._insert(session, batch):
+                    # the faulty questions fail alone
+                    for submission in batch:
+                        if not self._insert(session, [submission]):
+                            self._fail(session, [submission])
+            finally:
+                session.remove()
+
+    def _abandon(self, batch):
+        # failed outside of the statements, the questions not written are not going to be
+        with self._lock:
+            pending = [submission for submission in batch
+                       if self._statuses.get(submission.tracking_id, [None])[0] == QUEUED]
+        self._done(pending, FAILED, [None] * len(pending))
+
+    def _fail(self, session, batch):
+        self._done(batch, FAILED, [None] * len(batch))
+        try:
+            self._record(session, batch, FAILED, [None] * len(batch))
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.warning('Status of %d failed questions not written: %s', len(batch), e)
+
+    def _record(self, session, batch, status, question_ids):
+        now = time.time()
+        table = QuestionSubmission.__table__
+        session.execute(table.insert(), [
+            {'tracking_id': submission.tracking_id, 'status': status, 'question_id': question_id, 'created_at': now}
+            for submission, question_id in zip(batch, question_ids)])
+        if now - self._purged_at > PURGE_INTERVAL:
+            self._purged_at = now
+            session.execute(table.delete().where(table.c.created_at < now - STATUS_TTL))
+
+    def _insert(self, session, batch):
+        questions = [Question(**submission.values) for submission in batch]
+        try:
+            session.add_all(questions)
+            session.flush()
+            # read before the commit expires them
+            question_ids = [question.id for question in questions]
+            # committed with the questions
+            self._record(session, batch, COMMITTED, question_ids)
+            # the changes are dispatched to the caches on commit, as for a synchronous creation
+            session.commit()
+        except SQLAlchemyError as e:
+            session.rollback()
+            logger.warning('Batch of %d questions not written: %s', len(batch), e)
+            return False
+        self._done(batch, COMMITTED, question_ids)
+        return True
+
+    def _done(self, batch, status, question_ids):
+        with self._lock:
+            for submission, question_id in zip(batch, question_ids):
+                self._set_status(submission.tracking_id, status, question_id)
+            if status == COMMITTED:
+                self.committed += len(batch)
+                self.batches += 1
+            else:
+                self.failed += len(batch)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'committed': self.committed,
+                'failed': self.failed,
+                'batches': self.batches
+            }
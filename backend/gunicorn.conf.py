@@ -0,0 +1,37 @@
+import multiprocessing
+import os
+
+'''
+Configuration of gunicorn, the production server
+
+    alembic upgrade head
+    gunicorn -c gunicorn.conf.py
+
+The app is created and warmed once in the master and forked into the workers (preload_app),
+the migrations are run beforehand by the deployment instead of by every start (DB_MIGRATE_ON_START)
+and the workers share their changes (CACHE_GENERATION_SYNC), their quiz sessions (QUIZ_SESSION_STORE)
+and their rate limit buckets (RATE_LIMIT_STORE).
+    - WEB_CONCURRENCY, workers, 2 per CPU core plus 1 by default
+    - GUNICORN_THREADS, threads of each worker, 4 by default
+    - PORT, 5000 by default
+'''
+
+os.environ.setdefault('DB_MIGRATE_ON_START', 'false')
+# the workers see the changes made by the others, and a worker forked after some changes reloads its state
+os.environ.setdefault('CACHE_GENERATION_SYNC', 'true')
+# a session created on a worker is continued on any other, and the rate limit is not multiplied by the workers
+os.environ.setdefault('QUIZ_SESSION_STORE', 'database')
+os.environ.setdefault('RATE_LIMIT_STORE', 'database')
+
+wsgi_app = 'wsgi:app'
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT') or 5000)
+workers = int(os.environ.get('WEB_CONCURRENCY') or multiprocessing.cpu_count() * 2 + 1)
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS') or 4)
+preload_app = True
+
+
+def post_fork(server, worker):
+    from wsgi import app
+    from flaskr.launch import after_fork
+    after_fork(app)
@@ -0,0 +1,51 @@
+import os
+import sys
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db  # noqa: E402
+from config import Config  # noqa: E402
+
+'''
+Environment of the migrations
+
+setup_db hands the connection of the app in config.attributes['connection'],
+the alembic command line connects to the database of the configuration instead.
+'''
+
+# any number, shared by the workers migrating the same PostgreSQL database
+MIGRATION_LOCK = 7357
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+
+def run_migrations(connection):
+    context.configure(connection=connection, target_metadata=db.metadata,
+                      # SQLite alters the tables by copying them
+                      render_as_batch=connection.dialect.name == 'sqlite')
+    with context.begin_transaction():
+        if connection.dialect.name == 'postgresql':
+            # the workers starting together wait for the first one to migrate
+            connection.execute('SELECT pg_advisory_xact_lock({})'.format(MIGRATION_LOCK))
+        context.run_migrations()
+
+
+def run_migrations_online():
+    connection = config.attributes.get('connection')
+    if connection is not None:
+        run_migrations(connection)
+        return
+    engine = create_engine(Config.SQLALCHEMY_DATABASE_URI)
+    with engine.connect() as connection:
+        run_migrations(connection)
+
+
+if context.is_offline_mode():
+    raise SystemExit('the migrations are run against a database, offline mode is not supported')
+run_migrations_online()
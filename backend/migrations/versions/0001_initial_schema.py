@@ -0,0 +1,54 @@
+'''
+Tables of the API before the migrations
+
+The databases created by db.create_all() or restored from trivia.psql already have them,
+only the missing tables are created.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+'''
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if 'categories' not in existing:
+        op.create_table('categories',
+                        sa.Column('id', sa.Integer, primary_key=True),
+                        sa.Column('type', sa.String))
+    if 'questions' not in existing:
+        op.create_table('questions',
+                        sa.Column('id', sa.Integer, primary_key=True),
+                        sa.Column('question', sa.String),
+                        sa.Column('answer', sa.String),
+                        sa.Column('category', sa.Integer),
+                        sa.Column('difficulty', sa.Integer))
+    if 'quiz_sessions' not in existing:
+        op.create_table('quiz_sessions',
+                        sa.Column('id', sa.String(32), primary_key=True),
+                        sa.Column('category', sa.Integer),
+                        sa.Column('size', sa.Integer, nullable=False),
+                        sa.Column('position', sa.Integer, nullable=False),
+                        sa.Column('expires_at', sa.Float, nullable=False))
+        op.create_index('ix_quiz_sessions_expires_at', 'quiz_sessions', ['expires_at'])
+    if 'quiz_session_questions' not in existing:
+        op.create_table('quiz_session_questions',
+                        sa.Column('session_id', sa.String(32), primary_key=True),
+                        sa.Column('position', sa.Integer, primary_key=True, autoincrement=False),
+                        sa.Column('question_id', sa.Integer, nullable=False))
+    if 'cache_generation' not in existing:
+        op.create_table('cache_generation',
+                        sa.Column('id', sa.Integer, primary_key=True),
+                        sa.Column('value', sa.Integer, nullable=False))
+
+
+def downgrade():
+    for table in ('cache_generation', 'quiz_session_questions', 'quiz_sessions', 'questions', 'categories'):
+        op.drop_table(table)
@@ -0,0 +1,49 @@
+'''
+Indexes of the listings and foreign key of the category of the questions
+
+    - (question, id), the sort key of the listings and of the cursor
+    - (category, question, id), the listings of a category, already sorted
+    - questions.category references categories.id. The questions of a deleted category
+    are kept without category, like the constraint of trivia.psql, which is reused when present.
+    On PostgreSQL, the existing rows are not checked (NOT VALID): the questions of a category
+    that no longer exists are kept as they are, the new and updated rows must reference a category
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+'''
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    indexes = {index['name'] for index in inspector.get_indexes('questions')}
+    has_foreign_key = any(key['referred_table'] == 'categories' and key['constrained_columns'] == ['category']
+                          for key in inspector.get_foreign_keys('questions'))
+    if not has_foreign_key and op.get_bind().dialect.name == 'postgresql':
+        op.execute('ALTER TABLE questions ADD CONSTRAINT fk_questions_category FOREIGN KEY (category) '
+                   'REFERENCES categories (id) ON UPDATE CASCADE ON DELETE SET NULL NOT VALID')
+    elif not has_foreign_key:
+        with op.batch_alter_table('questions') as batch:
+            batch.create_foreign_key('fk_questions_category', 'categories', ['category'], ['id'],
+                                     onupdate='CASCADE', ondelete='SET NULL')
+    if 'ix_questions_question_id' not in indexes:
+        op.create_index('ix_questions_question_id', 'questions', ['question', 'id'])
+    if 'ix_questions_category_question_id' not in indexes:
+        op.create_index('ix_questions_category_question_id', 'questions', ['category', 'question', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_questions_category_question_id', 'questions')
+    op.drop_index('ix_questions_question_id', 'questions')
+    # the constraint of trivia.psql, reused by the upgrade under its own name, is kept
+    inspector = sa.inspect(op.get_bind())
+    if any(key['name'] == 'fk_questions_category' for key in inspector.get_foreign_keys('questions')):
+        with op.batch_alter_table('questions') as batch:
+            batch.drop_constraint('fk_questions_category', type_='foreignkey')
@@ -0,0 +1,51 @@
+'''
+Indexes of the search, on PostgreSQL
+
+    - SEARCH_ENGINE=fulltext, GIN indexes of the tsvector of the question, and of the question
+    and the answer. The expressions must stay identical to flaskr.search._vector
+    - SEARCH_ENGINE=like, trigram GIN indexes serving ILIKE '%term%'. They need the extension
+    pg_trgm: when it can not be created, the search works without them
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+'''
+import logging
+
+from alembic import op
+from sqlalchemy.exc import SQLAlchemyError
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    op.execute("CREATE INDEX IF NOT EXISTS ix_questions_question_fts ON questions "
+               "USING gin (to_tsvector('simple'::regconfig, coalesce(question, '')))")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_questions_question_answer_fts ON questions "
+               "USING gin (to_tsvector('simple'::regconfig, coalesce(question, '') || ' ' || coalesce(answer, '')))")
+    savepoint = bind.begin_nested()
+    try:
+        bind.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for column in ('question', 'answer'):
+            bind.execute('CREATE INDEX IF NOT EXISTS ix_questions_{0}_trgm '
+                         'ON questions USING gin ({0} gin_trgm_ops)'.format(column))
+        savepoint.commit()
+    except SQLAlchemyError as e:
+        # e.g. not allowed to create the extension
+        savepoint.rollback()
+        logger.warning('Could not create the trigram indexes: %s', e.orig if hasattr(e, 'orig') else e)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for name in ('question_trgm', 'answer_trgm', 'question_answer_fts', 'question_fts'):
+        op.execute('DROP INDEX IF EXISTS ix_questions_{}'.format(name))
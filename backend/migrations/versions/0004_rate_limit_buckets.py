@@ -0,0 +1,28 @@
+'''
+Token buckets of the rate limiter, when RATE_LIMIT_STORE=database
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+'''
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('rate_limit_buckets',
+                    sa.Column('key', sa.String, primary_key=True),
+                    sa.Column('tokens', sa.Float, nullable=False),
+                    sa.Column('updated_at', sa.Float, nullable=False),
+                    sa.Column('allowed', sa.Boolean, nullable=False))
+    op.create_index('ix_rate_limit_buckets_updated_at', 'rate_limit_buckets', ['updated_at'])
+
+
+def downgrade():
+    op.drop_index('ix_rate_limit_buckets_updated_at', 'rate_limit_buckets')
+    op.drop_table('rate_limit_buckets')
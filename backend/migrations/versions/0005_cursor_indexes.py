@@ -0,0 +1,28 @@
+'''
+Indexes of the cursor pagination
+
+The cursor walks the questions on (coalesce(question, ''), id), so that the questions without
+text are reached (see flaskr.cursor), in total or within a category. The expressions must stay
+identical to flaskr.cursor.SORT_KEY
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+'''
+from alembic import op
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE INDEX IF NOT EXISTS ix_questions_sort_key ON questions (coalesce(question, ''), id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_questions_category_sort_key "
+               "ON questions (category, coalesce(question, ''), id)")
+
+
+def downgrade():
+    op.execute('DROP INDEX IF EXISTS ix_questions_category_sort_key')
+    op.execute('DROP INDEX IF EXISTS ix_questions_sort_key')
@@ -0,0 +1,29 @@
+'''
+Status of the questions written by the queue of QUESTION_WRITE_DURABILITY=batched,
+so that any worker answers GET /questions/submissions/<tracking_id>
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+'''
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('question_submissions',
+                    sa.Column('tracking_id', sa.String(32), primary_key=True),
+                    sa.Column('status', sa.String(16), nullable=False),
+                    sa.Column('question_id', sa.Integer),
+                    sa.Column('created_at', sa.Float, nullable=False))
+    op.create_index('ix_question_submissions_created_at', 'question_submissions', ['created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_question_submissions_created_at', 'question_submissions')
+    op.drop_table('question_submissions')
@@ -1,23 +1,59 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import Boolean, Column, String, Integer, Float, ForeignKey, Index, create_engine, event, inspect, orm
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 from flask import jsonify
 import json
 
-db = SQLAlchemy()
+
+class RoutingSession(SignallingSession):
+    '''
+    Session asking the router of the application, if any (see flaskr.routing), which engine
+    runs a statement. Flushes always go to the primary
+    '''
+
+    def get_bind(self, mapper=None, clause=None):
+        router = self.app.extensions.get('db_router')
+        if router is not None and not self._flushing:
+            engine = router.engine_for(clause)
+            if engine is not None:
+                return engine
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
 
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    and brings the database up to the last migration
 '''
 
 
 def setup_db(app):
     db.app = app
     db.init_app(app)
-    db.create_all()
+    # the production launcher leaves the migrations to a deployment step (alembic upgrade head)
+    if app.config.get('DB_MIGRATE_ON_START', True):
+        migrate_db(app)
     return db
 
+
+def migrate_db(app, revision='head'):
+    from alembic import command
+    from alembic.config import Config as AlembicConfig
+    config = AlembicConfig()
+    config.set_main_option('script_location', MIGRATIONS)
+    with db.get_engine(app).begin() as connection:
+        config.attributes['connection'] = connection
+        command.upgrade(config, revision)
+
 '''
 Question
 
@@ -26,11 +62,18 @@ Question
 
 class Question(db.Model):  
     __tablename__ = 'questions'
+    # the listings are sorted by question then id, in total or within a category,
+    # the search and cursor indexes are created by the migrations (see migrations/versions)
+    __table_args__ = (
+        Index('ix_questions_question_id', 'question', 'id'),
+        Index('ix_questions_category_question_id', 'category', 'question', 'id'),
+    )
     
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(Integer)
+    category = Column(Integer, ForeignKey('categories.id', name='fk_questions_category',
+                                          onupdate='CASCADE', ondelete='SET NULL'))
     difficulty = Column(Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -80,3 +123,204 @@ class Category(db.Model):
           'id': self.id,
           'type': self.type
         }
+
+
+'''
+QuizSession
+    quiz played on the server, used by the database store of the quiz sessions.
+    The shuffled questions are the rows of QuizSessionQuestion, position is the next one to ask
+'''
+
+
+class QuizSession(db.Model):
+    __tablename__ = 'quiz_sessions'
+
+    id = Column(String(32), primary_key=True)
+    category = Column(Integer)
+    size = Column(Integer, nullable=False)
+    position = Column(Integer, nullable=False, default=0)
+    # epoch seconds, pushed back every time the session is used
+    expires_at = Column(Float, nullable=False, index=True)
+
+
+class QuizSessionQuestion(db.Model):
+    __tablename__ = 'quiz_session_questions'
+
+    session_id = Column(String(32), primary_key=True)
+    position = Column(Integer, primary_key=True, autoincrement=False)
+    question_id = Column(Integer, nullable=False)
+
+
+'''
+RateLimitBucket
+    token bucket of a client on a route, used by the database store of the rate limiter.
+    tokens is the number of requests left at updated_at, allowed tells whether the last one was
+'''
+
+
+class RateLimitBucket(db.Model):
+    __tablename__ = 'rate_limit_buckets'
+
+    key = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    # epoch seconds of the last request
+    updated_at = Column(Float, nullable=False, index=True)
+    allowed = Column(Boolean, nullable=False)
+
+
+class QuestionSubmission(db.Model):
+    __tablename__ = 'question_submissions'
+
+    # status of the questions queued by QUESTION_WRITE_DURABILITY=batched, once written
+    tracking_id = Column(String(32), primary_key=True)
+    status = Column(String(16), nullable=False)
+    question_id = Column(Integer)
+    # epoch seconds of the write
+    created_at = Column(Float, nullable=False, index=True)
+
+
+'''
+CacheGeneration
+    single row counter incremented by every transaction changing questions or categories,
+    when CACHE_GENERATION_SYNC is enabled. The workers compare it to the last value they saw
+    to know that another process changed the data they keep in memory
+'''
+
+
+class CacheGeneration(db.Model):
+    __tablename__ = 'cache_generation'
+
+    id = Column(Integer, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+
+'''
+Change tracking
+
+The process keeps derived data (counts, caches...) that must follow the committed
+changes of the questions and categories. Every flush records what it changed in
+the session, and once the transaction is committed, the listeners registered on
+the application are called with a ChangeSet.
+Bulk statements (query.delete(), query.update(), core statements) do not tell which
+rows they touched, the ChangeSet is then flagged as bulk and listeners have to rebuild
+their data from the database.
+'''
+
+
+class ChangeSet(object):
+    def __init__(self):
+        # snapshots (see snapshot()) of the questions inserted and deleted,
+        # an update is recorded as the deletion of the old values and the insertion of the new ones
+        self.added = []
+        self.removed = []
+        self.categories = False
+        self.bulk = False
+        self.generation_bumped = False
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.categories or self.bulk)
+
+    def question_categories(self):
+        return {q['category'] for q in self.added + self.removed}
+
+
+def snapshot(question, history=False):
+    '''
+    Plain dict of the column values of a question,
+    when history is True, the values before the pending changes are returned
+    '''
+    values = {}
+    state = inspect(question)
+    for attr in ('id', 'question', 'answer', 'category', 'difficulty'):
+        value = getattr(question, attr)
+        if history:
+            deleted = state.attrs[attr].history.deleted
+            if deleted:
+                value = deleted[0]
+        values[attr] = value
+    return values
+
+
+def register_change_listener(app, listener):
+    app.extensions.setdefault('trivia_change_listeners', []).append(listener)
+
+
+def dispatch_changes(app, changes):
+    for listener in app.extensions.get('trivia_change_listeners', []):
+        listener(changes)
+
+
+def mark_bulk_change(session):
+    '''
+    To be called when the session runs statements that bypass the unit of work
+    '''
+    _pending_changes(session).bulk = True
+    _bump_generation(session)
+
+
+def record_changes(session, removed=(), added=()):
+    '''
+    To be called when the session runs statements that bypass the unit of work on known questions,
+    removed and added being their snapshots before and after the statements
+    '''
+    changes = _pending_changes(session)
+    changes.removed.extend(removed)
+    changes.added.extend(added)
+    _bump_generation(session)
+
+
+def _pending_changes(session):
+    return session.info.setdefault('trivia_changes', ChangeSet())
+
+
+def _bump_generation(session):
+    # once per transaction, in the same transaction as the changes
+    changes = _pending_changes(session)
+    if changes.generation_bumped or not changes:
+        return
+    if not db.get_app().config.get('CACHE_GENERATION_SYNC'):
+        return
+    changes.generation_bumped = True
+    session.connection().execute(CacheGeneration.__table__.update().values(value=CacheGeneration.value + 1))
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def _record_changes(session, flush_context):
+    changes = _pending_changes(session)
+    for obj in session.new:
+        if isinstance(obj, Question):
+            changes.added.append(snapshot(obj))
+        elif isinstance(obj, Category):
+            changes.categories = True
+    # the lists and the attributes history still hold the pre-flush state
+    for obj in session.dirty:
+        if isinstance(obj, Question) and session.is_modified(obj):
+            changes.removed.append(snapshot(obj, history=True))
+            changes.added.append(snapshot(obj))
+        elif isinstance(obj, Category) and session.is_modified(obj):
+            changes.categories = True
+    for obj in session.deleted:
+        if isinstance(obj, Question):
+            changes.removed.append(snapshot(obj))
+        elif isinstance(obj, Category):
+            changes.categories = True
+    _bump_generation(session)
+
+
+@event.listens_for(SignallingSession, 'after_bulk_delete')
+@event.listens_for(SignallingSession, 'after_bulk_update')
+def _record_bulk(context):
+    mark_bulk_change(context.session)
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _dispatch_changes(session):
+    changes = session.info.pop('trivia_changes', None)
+    if not changes:
+        return
+    dispatch_changes(db.get_app(), changes)
+
+
+@event.listens_for(SignallingSession, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('trivia_changes', None)
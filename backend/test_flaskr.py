@@ -1,11 +1,23 @@
+import gzip
 import os
+import tempfile
+import threading
+import time
 import unittest
 import json
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
 from config import ConfigTest
 
 from flaskr import create_app, QUESTIONS_PER_PAGE
-from models import setup_db, Question, Category
+from flaskr.quiz import IdPool, CategoryPool, difficulty_weight, ALL_CATEGORIES
+from flaskr.sessions import MemorySessionStore, SessionNotFound
+from flaskr.serialize import QuestionEncoder, question_rows
+from flaskr.coalesce import SingleFlight
+from flaskr.launch import warm_up, after_fork
+from flaskr.writes import new_tracking_id
+from models import setup_db, Question, Category, RateLimitBucket, ChangeSet, dispatch_changes
 from urllib.parse import quote
 
 
@@ -20,6 +32,8 @@ class TriviaTestCase(unittest.TestCase):
         self.db = self.app.db
         self.new_question = {'question': 'Does this test work?', 'answer': 'maybe',
                              'category': 5, 'difficulty': 4}
+        # the questions must reference an existing category
+        self.ensure_categories(range(21))
 
     def tearDown(self):
         """Executed after reach test"""
@@ -39,15 +53,36 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['message'], 'unprocessable')
         self.assertEqual(res.status_code, 422)
 
+    def ensure_categories(self, ids):
+        existing = {id for id, in self.db.session.query(Category.id)}
+        missing = [id for id in ids if id not in existing]
+        if not missing:
+            return
+        self.db.session.execute(Category.__table__.insert(),
+                                [{'id': id, 'type': 'category{}'.format(id)} for id in missing])
+        if self.db.engine.dialect.name == 'postgresql':
+            # the categories created without id must not take the ones inserted here
+            self.db.session.execute("SELECT setval(pg_get_serial_sequence('categories', 'id'), "
+                                    "(SELECT max(id) FROM categories))")
+        self.db.session.commit()
+
     def generate_test_data(self, size, category=None):
         # Empty the table question and add some rows
         Question.query.delete()
+        self.ensure_categories([category] if category else range(size))
         for i in range(size):
             s = str(i) if i >= 10 else '0' + str(i)
             question = Question('question' + s, 'answer' + s, category if category else i, i)
             self.db.session.add(question)
         self.db.session.commit()
 
+    def read_packs(self, directory):
+        packs = {}
+        for name in os.listdir(directory):
+            with open(os.path.join(directory, name), 'rb') as packed:
+                packs[name] = packed.read()
+        return packs
+
     """
     TODO
     Write at least one test for each test for successful operation and for expected errors.
@@ -83,6 +118,39 @@ class TriviaTestCase(unittest.TestCase):
         res = self.client().get('/api/categories')
         self.assert_404(res)
     
+    def test_retrieve_categories_not_modified(self):
+        Category.query.delete()
+        self.db.session.add(Category(type='temp'))
+        self.db.session.commit()
+        res = self.client().get('/api/categories')
+        etag = res.headers['ETag']
+        res = self.client().get('/api/categories', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 304)
+        # a new category changes the payload and its etag
+        self.db.session.add(Category(type='other'))
+        self.db.session.commit()
+        res = self.client().get('/api/categories', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers['ETag'], etag)
+        self.assertEqual(json.loads(res.data)['total_categories'], 2)
+
+    def test_categories_invalidated_across_workers(self):
+        class ConfigSync(ConfigTest):
+            CACHE_GENERATION_SYNC = True
+            CACHE_GENERATION_INTERVAL = 0
+
+        Category.query.delete()
+        self.db.session.add(Category(type='temp'))
+        self.db.session.commit()
+        worker = create_app(test_config=ConfigSync())
+        other = create_app(test_config=ConfigSync())
+        self.assertEqual(len(worker.category_cache.get().categories), 1)
+        with other.app_context():
+            other.db.session.add(Category(type='other'))
+            other.db.session.commit()
+        worker.generation_watcher.check()
+        self.assertEqual(len(worker.category_cache.get().categories), 2)
+
     def test_retrieve_questions(self):
         size = QUESTIONS_PER_PAGE * 2
         self.generate_test_data(size)
@@ -93,13 +161,13 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res['total_questions'], size)
         
     def test_retrieve_questions_includes_categories(self):
-        # Build categories on empty DB
+        size = QUESTIONS_PER_PAGE * 2
+        self.generate_test_data(size)
+        # Build categories on empty DB, the questions are kept without category
         Category.query.delete()
         cat = Category(type='temp')
         self.db.session.add(cat)
         self.db.session.commit()
-        size = QUESTIONS_PER_PAGE * 2
-        self.generate_test_data(size)
         res = self.client().get('/api/questions')
         res = json.loads(res.data)
         self.assertTrue('categories' in res)
@@ -132,10 +200,400 @@ class TriviaTestCase(unittest.TestCase):
         res = self.client().get('/api/questions?searchTerm={}'.format(quote('notexist')))
         self.assert_404(res)
 
+    def test_retrieve_questions_fields(self):
+        self.generate_test_data(QUESTIONS_PER_PAGE + 5)
+        res = self.client().get('/api/questions?fields=question,category')
+        data = json.loads(res.data)
+        self.assertEqual(set(data['questions'][0]), {'question', 'category'})
+        # the cursor needs the sort key even when it is not returned
+        res = self.client().get('/api/questions?after=&fields=difficulty')
+        data = json.loads(res.data)
+        self.assertEqual(set(data['questions'][0]), {'difficulty'})
+        res = self.client().get('/api/questions?after={}&fields=difficulty'.format(data['next_cursor']))
+        self.assertEqual(len(json.loads(res.data)['questions']), 5)
+        res = self.client().get('/api/questions?fields=question,secret')
+        self.assertEqual(res.status_code, 400)
+
     def test_retrieve_questions_error(self):
         res = self.client().get('/api/questions?page=100')
         self.assert_404(res)
     
+    def test_retrieve_questions_cursor(self):
+        size = QUESTIONS_PER_PAGE * 2 + 5
+        self.generate_test_data(size)
+        res = self.client().get('/api/questions?after=')
+        data = json.loads(res.data)
+        self.assertTrue(data['success'])
+        self.assertEqual(len(data['questions']), QUESTIONS_PER_PAGE)
+        self.assertEqual(data['questions'][0]['question'], 'question00')
+        self.assertEqual(data['total_questions'], size)
+        seen = [q['id'] for q in data['questions']]
+        while data['next_cursor']:
+            res = self.client().get('/api/questions?after={}'.format(data['next_cursor']))
+            data = json.loads(res.data)
+            self.assertTrue(data['success'])
+            seen += [q['id'] for q in data['questions']]
+        self.assertEqual(len(data['questions']), 5)
+        self.assertEqual(len(set(seen)), size)
+
+    def test_retrieve_category_questions_cursor(self):
+        self.generate_test_data(QUESTIONS_PER_PAGE + 2, 3)
+        res = self.client().get('/api/categories/3/questions?after=')
+        data = json.loads(res.data)
+        self.assertEqual(len(data['questions']), QUESTIONS_PER_PAGE)
+        res = self.client().get('/api/categories/3/questions?after={}'.format(data['next_cursor']))
+        data = json.loads(res.data)
+        self.assertEqual([q['question'] for q in data['questions']], ['question10', 'question11'])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_retrieve_questions_cursor_null_text(self):
+        Question.query.delete()
+        for i in range(QUESTIONS_PER_PAGE + 1):
+            self.db.session.add(Question(None, 'answer', 1, 1))
+        self.db.session.add(Question('question', 'answer', 1, 1))
+        self.db.session.commit()
+        for url in ('/api/questions?after=', '/api/categories/1/questions?after='):
+            data = json.loads(self.client().get(url).data)
+            seen = [q['id'] for q in data['questions']]
+            while data['next_cursor']:
+                res = self.client().get('{}{}'.format(url, data['next_cursor']))
+                self.assertEqual(res.status_code, 200)
+                data = json.loads(res.data)
+                seen += [q['id'] for q in data['questions']]
+            self.assertEqual(len(set(seen)), QUESTIONS_PER_PAGE + 2)
+            self.assertEqual(data['questions'][-1]['question'], 'question')
+            # the pages list the questions in the same order
+            paged = []
+            for page in (1, 2):
+                data = json.loads(self.client().get(url.replace('after=', 'page={}'.format(page))).data)
+                paged += [q['id'] for q in data['questions']]
+            self.assertEqual(paged, seen)
+
+    def test_retrieve_questions_cursor_error(self):
+        self.generate_test_data(5)
+        res = self.client().get('/api/questions?after=notacursor')
+        data = json.loads(res.data)
+        self.assertFalse(data['success'])
+        self.assertEqual(data['error'], 400)
+        self.assertEqual(res.status_code, 400)
+
+    def test_retrieve_questions_filtered_answers(self):
+        self.generate_test_data(20)
+        res = self.client().get('/api/questions?searchAnswers=true&searchTerm=answer13')
+        data = json.loads(res.data)
+        self.assertEqual(data['total_questions'], 1)
+        self.assertEqual(data['questions'][0]['question'], 'question13')
+
+    def test_retrieve_questions_not_modified(self):
+        self.generate_test_data(5)
+        res = self.client().get('/api/questions?page=1')
+        etag = res.headers['ETag']
+        self.assertEqual(res.headers['Cache-Control'], 'no-cache')
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(self.db.engine, 'before_cursor_execute', listener)
+        try:
+            res = self.client().get('/api/questions?page=1', headers={'If-None-Match': etag})
+        finally:
+            event.remove(self.db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(statements, [])
+        # another page or a change of the questions changes the etag
+        res = self.client().get('/api/questions?page=2', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 404)
+        self.client().post('/api/questions', json=self.new_question)
+        res = self.client().get('/api/questions?page=1', headers={'If-None-Match': etag})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)['total_questions'], 6)
+
+    def test_response_cache_targeted_eviction(self):
+        self.generate_test_data(4)
+        cache = self.app.response_cache
+        for url in ['/api/questions', '/api/categories/1/questions', '/api/categories/2/questions']:
+            self.client().get(url)
+            self.client().get(url)
+        stats = json.loads(self.client().get('/api/stats/cache').data)['response_cache']
+        self.assertEqual((stats['hits'], stats['misses'], stats['entries']), (3, 3, 3))
+        # a question of category 1 evicts that category and the listing of all the questions
+        self.client().post('/api/questions', json=dict(self.new_question, category=1))
+        self.assertEqual(cache.stats()['entries'], 1)
+        res = json.loads(self.client().get('/api/categories/1/questions').data)
+        self.assertEqual(res['total_questions'], 2)
+        self.client().get('/api/categories/2/questions')
+        self.assertEqual(cache.stats()['hits'], 4)
+
+    def test_pool_stats(self):
+        class ConfigPool(ConfigTest):
+            SQLALCHEMY_ENGINE_OPTIONS = {'pool_size': 2, 'max_overflow': 0}
+
+        app = create_app(test_config=ConfigPool())
+        client = app.test_client()
+        # the session of the test still holds the connection used by create_app until the first request ends
+        client.get('/api/questions?searchTerm=nothing')
+        res = client.get('/api/questions?searchTerm=nothing')
+        self.assertTrue(res.headers['Server-Timing'].startswith('pool;dur='))
+        data = json.loads(client.get('/api/stats/pool').data)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['pool']['size'], 2)
+        self.assertTrue(data['pool']['checkouts'] > 0)
+
+    def test_metrics(self):
+        class ConfigMetrics(ConfigTest):
+            # every statement is slow and an N+1
+            SLOW_QUERY_MS = 0.000001
+            N_PLUS_ONE_THRESHOLD = 1
+
+        app = create_app(test_config=ConfigMetrics())
+        client = app.test_client()
+        res = client.get('/api/questions?fields=id,question')
+        self.assertEqual(res.status_code, 200)
+        timings = res.headers['Server-Timing']
+        self.assertTrue('db;dur=' in timings)
+        self.assertTrue('serialize;dur=' in timings)
+        self.assertTrue('total;dur=' in timings)
+        client.delete('/api/questions/1000000')
+        res = client.get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        text = res.data.decode('utf-8')
+        self.assertTrue('trivia_request_duration_seconds_bucket{route="/api/questions",method="GET",le="+Inf"} 1'
+                        in text)
+        self.assertTrue('trivia_requests_total{route="/api/questions/<int:question_id>",method="DELETE",status="404"} 1'
+                        in text)
+        self.assertTrue('trivia_sql_statements_total{route="/api/questions"}' in text)
+        self.assertTrue('trivia_n_plus_one_total{route="/api/questions"} 1' in text)
+        self.assertFalse('trivia_slow_queries_total 0\n' in text)
+
+    def test_single_flight(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+
+        def slow():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'page'
+
+        leader = threading.Thread(target=lambda: results.append(flight.do('key', slow)))
+        leader.start()
+        started.wait(5)
+        followers = [threading.Thread(target=lambda: results.append(flight.do('key', slow))) for i in range(3)]
+        for follower in followers:
+            follower.start()
+        while flight.stats()['followers'] < 3:
+            time.sleep(0.001)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['page'] * 4)
+        # the flight ended, the next call runs again
+        self.assertEqual(flight.do('key', lambda: 'next'), 'next')
+        self.assertEqual(flight.stats(), {'leaders': 2, 'followers': 3, 'in_flight': 0})
+
+    def test_rate_limit(self):
+        self.db.session.query(RateLimitBucket).delete()
+        self.db.session.commit()
+        for store in ('memory', 'database'):
+            class ConfigLimit(ConfigTest):
+                RATE_LIMIT_PER_SECOND = 0.01
+                RATE_LIMIT_BURST = 2
+                RATE_LIMIT_STORE = store
+
+            client = create_app(test_config=ConfigLimit()).test_client()
+            self.assertEqual(client.get('/api/categories').status_code, 200)
+            self.assertEqual(client.get('/api/categories').status_code, 200)
+            res = client.get('/api/categories')
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 429)
+            self.assertFalse(data['success'])
+            self.assertEqual(data['error'], 429)
+            self.assertEqual(data['message'], 'too many requests')
+            self.assertTrue(int(res.headers['Retry-After']) > 90)
+            # another route has its own bucket
+            self.assertEqual(client.get('/api/questions').status_code, 200)
+
+    def test_warm_up(self):
+        class ConfigLaunch(ConfigTest):
+            DB_MIGRATE_ON_START = False
+
+        self.generate_test_data(10)
+        app = create_app(test_config=ConfigLaunch())
+        timings = warm_up(app)
+        self.assertTrue({'categories', 'quiz_pool', '/api/questions'} <= set(timings))
+        after_fork(app)
+        client = app.test_client()
+        # the first page was served once by the warm up
+        self.assertEqual(client.get('/api/questions').status_code, 200)
+        self.assertEqual(app.response_cache.stats()['hits'], 1)
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(app.db.get_engine(app), 'before_cursor_execute', record)
+        try:
+            quiz_input = {'previous_questions': [], 'quiz_category': {'id': 0}}
+            self.assertEqual(client.post('/api/quizzes', json=quiz_input).status_code, 200)
+        finally:
+            event.remove(app.db.get_engine(app), 'before_cursor_execute', record)
+        # the question only, the pool is loaded
+        self.assertEqual(len(statements), 1)
+
+    def test_read_replica_routing(self):
+        class ConfigReplica(ConfigTest):
+            # the test database stands in for its own replica
+            SQLALCHEMY_REPLICA_URIS = [ConfigTest.SQLALCHEMY_DATABASE_URI]
+            RESPONSE_CACHE_SIZE = 0
+
+        app = create_app(test_config=ConfigReplica())
+        self.generate_test_data(3)
+        # the session of the test thread belongs to the app of setUp, start one of the new app
+        self.db.session.remove()
+        client = app.test_client()
+        router = app.db_router
+        replica = router.engines[0]
+        client.get('/api/questions?searchTerm=question')
+        self.assertEqual(router.reads[repr(replica.url)], 1)
+        # after a write, the client reads from the primary
+        client.post('/api/questions', json=self.new_question)
+        client.get('/api/questions?searchTerm=question')
+        self.assertEqual(router.reads[repr(replica.url)], 1)
+        # a replica down is skipped
+        router.mark_down(replica)
+        self.assertIsNone(router.replica())
+
+    def test_read_replica_caches_on_primary(self):
+        class ConfigReplica(ConfigTest):
+            SQLALCHEMY_REPLICA_URIS = [ConfigTest.SQLALCHEMY_DATABASE_URI]
+            SEARCH_ENGINE = 'fulltext'
+
+        app = create_app(test_config=ConfigReplica())
+        self.generate_test_data(3)
+        self.db.session.remove()
+        client = app.test_client()
+        router = app.db_router
+        replica = router.engines[0]
+        statements = []
+        failing = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+            if failing:
+                router.mark_down(replica)
+                raise OperationalError(statement, parameters, Exception('replica lost'))
+
+        event.listen(replica, 'before_cursor_execute', record)
+        try:
+            changes = ChangeSet()
+            changes.bulk = True
+            with app.app_context():
+                dispatch_changes(app, changes)
+            data = json.loads(client.get('/api/questions').data)
+            self.assertEqual(data['total_questions'], 3)
+            # the listing is read on the replica, the counts and the categories on the primary
+            self.assertTrue(statements)
+            self.assertFalse([s for s in statements if 'count(' in s.lower() or 'FROM categories' in s])
+            self.assertEqual(app.response_cache.stats()['entries'], 0)
+            # a replica lost during a read, the request is served by the primary
+            failing.append(True)
+            res = client.get('/api/categories/1/questions')
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(json.loads(res.data)['total_questions'], 1)
+            self.assertTrue(router.is_down(replica))
+        finally:
+            event.remove(replica, 'before_cursor_execute', record)
+
+    def test_retrieve_questions_fulltext(self):
+        class ConfigFullText(ConfigTest):
+            SEARCH_ENGINE = 'fulltext'
+
+        app = create_app(test_config=ConfigFullText())
+        Question.query.delete()
+        for text, answer in [('What is the capital of France?', 'Paris'),
+                             ('Which capitals start with a P?', 'Paris and Prague'),
+                             ('Who painted the Mona Lisa?', 'Leonardo')]:
+            self.db.session.add(Question(text, answer, 1, 1))
+        self.db.session.commit()
+        client = app.test_client()
+
+        data = json.loads(client.get('/api/questions?searchTerm=capit').data)
+        self.assertEqual(data['total_questions'], 2)
+        data = json.loads(client.get('/api/questions?searchTerm={}'.format(quote('capital fr'))).data)
+        self.assertEqual([q['answer'] for q in data['questions']], ['Paris'])
+        data = json.loads(client.get('/api/questions?searchTerm=prague&searchAnswers=true').data)
+        self.assertEqual([q['answer'] for q in data['questions']], ['Paris and Prague'])
+        self.assert_404(client.get('/api/questions?searchTerm=prague'))
+        # the index follows the new questions
+        client.post('/api/questions', json={'question': 'Capital of Peru?', 'answer': 'Lima',
+                                            'category': 1, 'difficulty': 1})
+        data = json.loads(client.get('/api/questions?searchTerm=capit').data)
+        self.assertEqual(data['total_questions'], 3)
+        # the cursor walks the ranking, a page at a time, in the order of the pages
+        with app.app_context():
+            app.db.session.add_all([Question('capital {}'.format(i), 'a', 1, 1) for i in range(QUESTIONS_PER_PAGE)])
+            app.db.session.commit()
+        data = json.loads(client.get('/api/questions?searchTerm=capit&after=').data)
+        seen = [q['id'] for q in data['questions']]
+        data = json.loads(client.get('/api/questions?searchTerm=capit&after=' + data['next_cursor']).data)
+        seen += [q['id'] for q in data['questions']]
+        self.assertIsNone(data['next_cursor'])
+        self.assertEqual(len(set(seen)), QUESTIONS_PER_PAGE + 3)
+        paged = []
+        for page in (1, 2):
+            data = json.loads(client.get('/api/questions?searchTerm=capit&page={}'.format(page)).data)
+            paged += [q['id'] for q in data['questions']]
+        self.assertEqual(paged, seen)
+        self.assertEqual(client.get('/api/questions?searchTerm=capit&after=notacursor').status_code, 400)
+
+    def test_inverted_index_rebuild_race(self):
+        from flaskr.search import InvertedIndexSearch
+        self.generate_test_data(3)
+        index = InvertedIndexSearch(self.db.session)
+        query = self.db.session.query
+
+        def racing_query(*columns):
+            # a question deleted while the index is read
+            index.apply(ChangeSet())
+            return query(*columns)
+
+        self.db.session.query = racing_query
+        try:
+            index.ranked_ids('question00')
+        finally:
+            del self.db.session.query
+        self.assertIsNone(index._questions)
+        self.assertEqual(index.ranked_ids('question00'), index.ranked_ids('question00'))
+        self.assertIsNotNone(index._questions)
+
+    def test_delete_category_with_questions(self):
+        self.generate_test_data(3, 7)
+        counts, pool = self.app.question_counts, self.app.question_pool
+        self.assertEqual(counts.category(7), 3)
+        self.assertEqual(len(pool.sample(7, 10)), 3)
+        # on PostgreSQL, the foreign key sets the category of the questions to NULL
+        self.db.session.delete(Category.query.get(7))
+        self.db.session.commit()
+        remaining = Question.query.filter(Question.category == 7).count()
+        self.assertEqual(counts.category(7), remaining)
+        self.assertEqual(len(pool.sample(7, 10)), remaining)
+        self.assertEqual(counts.total(), 3)
+
+    def test_question_pool_rebuild_race(self):
+        self.generate_test_data(3)
+        pool = self.app.question_pool
+        changes = ChangeSet()
+        changes.bulk = True
+        pool.apply(changes)
+        version = pool.version
+        rows = self.db.session.query(Question.id, Question.category, Question.difficulty).all()
+        # a question deleted after the rows were read
+        question = Question.query.first()
+        question.delete()
+        pool.load(rows, version)
+        self.assertNotIn(question.id, pool.sample(ALL_CATEGORIES, 10))
+        self.assertEqual(len(pool.sample(ALL_CATEGORIES, 10)), 2)
+
     def test_delete_question(self):
         self.generate_test_data(2)
         res = self.client().get('/api/questions')
@@ -150,12 +608,88 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res['total_questions'], 1)
         self.assertTrue(question['id'] not in [q['id'] for q in res['questions']])
         
+    def test_question_counts_follow_changes(self):
+        self.generate_test_data(5, 2)
+        counts = self.app.question_counts
+        self.assertEqual(counts.total(), 5)
+        self.assertEqual(counts.category(2), 5)
+        res = self.client().post('/api/questions', json=self.new_question)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(counts.total(), 6)
+        self.assertEqual(counts.category(self.new_question['category']), 1)
+        question = Question.query.filter(Question.category == 2).first()
+        self.client().delete('/api/questions/{}'.format(question.id))
+        self.assertEqual(counts.total(), 5)
+        self.assertEqual(counts.category(2), 4)
+        # counts rebuilt from the database match the maintained ones
+        counts.rebuild()
+        self.assertEqual(counts.total(), 5)
+        self.assertEqual(counts.category(2), 4)
+
+    def test_retrieve_questions_filtered_estimate(self):
+        self.generate_test_data(20)
+        res = self.client().get('/api/questions?exact=false&searchTerm={}'.format(quote('stion%2')))
+        data = json.loads(res.data)
+        self.assertTrue(data['success'])
+        self.assertTrue(data['total_questions'] > 0)
+        questions = [q['question'] for q in data['questions']]
+        self.assertEqual(questions, ['question02', 'question12'])
+
     def test_delete_question_error(self):
         Question.query.delete()
         self.db.session.commit()
         res = self.client().delete('/api/questions/1')
         self.assert_404(res)
 
+    def test_delete_question_batch(self):
+        self.generate_test_data(5)
+        ids = [q.id for q in Question.query.order_by(Question.question).limit(3)]
+        res = self.client().delete('/api/questions?ids={}'.format(','.join(str(id) for id in ids)))
+        data = json.loads(res.data)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['deleted'], 3)
+        res = json.loads(self.client().get('/api/questions').data)
+        self.assertEqual(res['total_questions'], 2)
+        self.assert_404(self.client().delete('/api/questions?ids={}'.format(ids[0])))
+        self.assertEqual(self.client().delete('/api/questions?ids=a,b').status_code, 400)
+
+    def test_batch_changes_evict_the_questions(self):
+        self.generate_test_data(3)
+        ids = [q.id for q in Question.query.order_by(Question.question)]
+        changes = []
+        self.app.extensions['trivia_change_listeners'].append(changes.append)
+        self.client().delete('/api/questions?ids=999999')
+        self.client().patch('/api/questions', json=[{'id': 999999, 'difficulty': 5}])
+        self.assertEqual(changes, [])
+        self.client().patch('/api/questions', json=[{'id': ids[1], 'difficulty': 5}])
+        self.client().delete('/api/questions?ids={},999999'.format(ids[0]))
+        self.assertEqual([(c.bulk, [q['id'] for q in c.removed]) for c in changes], [(False, [ids[1]]), (False, [ids[0]])])
+        self.assertEqual(changes[0].added, [{'id': ids[1], 'question': 'question01', 'answer': 'answer01',
+                                             'category': 1, 'difficulty': 5}])
+        self.assertEqual(self.app.question_counts.total(), 2)
+
+    def test_update_question_batch(self):
+        Category.query.delete()
+        cat = Category(type='target')
+        self.db.session.add(cat)
+        self.db.session.commit()
+        cat_id = cat.id
+        self.generate_test_data(3)
+        ids = [q.id for q in Question.query.order_by(Question.question)]
+        res = self.client().patch('/api/questions', json=[
+            {'id': ids[0], 'answer': 'new answer'},
+            {'id': ids[1], 'category': cat_id, 'difficulty': 5},
+            {'id': ids[2], 'category': cat_id}])
+        data = json.loads(res.data)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['updated'], 3)
+        res = json.loads(self.client().get('/api/categories/{}/questions'.format(cat_id)).data)
+        self.assertEqual(res['total_questions'], 2)
+        self.assertEqual(res['questions'][0]['difficulty'], 5)
+        self.assertEqual(Question.query.get(ids[0]).answer, 'new answer')
+        self.assert_422(self.client().patch('/api/questions', json=[{'id': ids[0], 'category': 999}]))
+        self.assert_422(self.client().patch('/api/questions', json=[{'id': ids[0], 'answer': ''}]))
+
     def test_create_question(self):
         Question.query.delete()
         self.db.session.commit()
@@ -171,10 +705,146 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res['questions'][0]['category'], self.new_question['category'])
         self.assertEqual(res['questions'][0]['difficulty'], self.new_question['difficulty'])
         
+    def test_create_question_batched(self):
+        class ConfigBatched(ConfigTest):
+            QUESTION_WRITE_DURABILITY = 'batched'
+            QUESTION_WRITE_INTERVAL = 0.2
+
+        Question.query.delete()
+        self.db.session.commit()
+        app = create_app(test_config=ConfigBatched())
+        client = app.test_client()
+        tracking_ids = []
+        for i in range(3):
+            res = client.post('/api/questions', json=dict(self.new_question, question='queued {}'.format(i)))
+            self.assertEqual(res.status_code, 202)
+            data = json.loads(res.data)
+            self.assertEqual(data['status'], 'queued')
+            self.assertEqual(res.headers['Location'], '/api/questions/submissions/' + data['tracking_id'])
+            tracking_ids.append(data['tracking_id'])
+        self.assert_422(client.post('/api/questions', json=dict(self.new_question, answer='')))
+        app.question_writer.flush()
+        question_ids = []
+        for tracking_id in tracking_ids:
+            data = json.loads(client.get('/api/questions/submissions/' + tracking_id).data)
+            self.assertEqual(data['status'], 'committed')
+            question_ids.append(data['question_id'])
+        self.assertEqual(sorted(question_ids), [id for id, in self.db.session.query(Question.id).order_by(Question.id)])
+        # written in one transaction, and seen by the counts
+        self.assertEqual(app.question_writer.stats()['batches'], 1)
+        self.assertEqual(json.loads(client.get('/api/questions').data)['total_questions'], 3)
+        self.assert_404(client.get('/api/questions/submissions/unknown'))
+
+    def test_question_submissions_across_workers(self):
+        class ConfigBatched(ConfigTest):
+            QUESTION_WRITE_DURABILITY = 'batched'
+            QUESTION_WRITE_INTERVAL = 0
+
+        worker, other = create_app(test_config=ConfigBatched()), create_app(test_config=ConfigBatched())
+        self.db.session.remove()
+        tracking_id = json.loads(worker.test_client().post('/api/questions', json=self.new_question).data)['tracking_id']
+        worker.question_writer.flush()
+        # the status is read from the database by the other worker
+        data = json.loads(other.test_client().get('/api/questions/submissions/' + tracking_id).data)
+        self.assertEqual(data['status'], 'committed')
+        self.assertEqual(Question.query.get(data['question_id']).question, self.new_question['question'])
+        # submitted to another worker a moment ago, the question may still be queued there
+        recent = new_tracking_id(time.time() - 1)
+        self.assertEqual(json.loads(other.test_client().get('/api/questions/submissions/' + recent).data)['status'],
+                         'queued')
+        self.assert_404(other.test_client().get('/api/questions/submissions/' + new_tracking_id(time.time() - 3600)))
+
+    def test_question_writer_failure(self):
+        class ConfigBatched(ConfigTest):
+            QUESTION_WRITE_DURABILITY = 'batched'
+
+        app = create_app(test_config=ConfigBatched())
+
+        def broken(batch):
+            raise RuntimeError('not a database error')
+
+        app.question_writer._write = broken
+        tracking_id = json.loads(app.test_client().post('/api/questions', json=self.new_question).data)['tracking_id']
+        app.question_writer.flush()
+        self.assertEqual(app.question_writer.status(tracking_id), ('failed', None))
+
+    def test_create_question_queue_full(self):
+        class ConfigFull(ConfigTest):
+            QUESTION_WRITE_DURABILITY = 'batched'
+            QUESTION_WRITE_QUEUE_SIZE = 1
+
+        app = create_app(test_config=ConfigFull())
+        # no writer thread, the queue is never emptied
+        app.question_writer._start = lambda: None
+        client = app.test_client()
+        self.assertEqual(client.post('/api/questions', json=self.new_question).status_code, 202)
+        res = client.post('/api/questions', json=self.new_question)
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data['error'], 503)
+        self.assertEqual(data['message'], 'service unavailable')
+        self.assertEqual(res.headers['Retry-After'], '1')
+
     def test_create_question_error(self):
         res = self.client().post('/api/questions/45', json=self.new_question)
         self.assertEqual(res.status_code, 405)
 
+    def test_import_questions(self):
+        Question.query.delete()
+        cat = Category(type='imported')
+        self.db.session.add(cat)
+        self.db.session.commit()
+        cat_id = cat.id
+        lines = [json.dumps({'question': 'q{}'.format(i), 'answer': 'a', 'category': cat_id, 'difficulty': 1})
+                 for i in range(3)]
+        lines += ['not json', json.dumps({'question': 'q', 'category': cat_id, 'difficulty': 1})]
+        res = self.client().post('/api/questions/bulk', data='\n'.join(lines),
+                                 content_type='application/x-ndjson')
+        data = json.loads(res.data)
+        self.assertTrue(data['success'])
+        self.assertEqual(data['inserted'], 3)
+        self.assertEqual([e['line'] for e in data['errors']], [4, 5])
+        res = self.client().post('/api/questions/bulk', content_type='text/csv',
+                                 data='question,answer,category,difficulty\nq3,a,{},2\nq4,a,999,2\n'.format(cat_id))
+        data = json.loads(res.data)
+        self.assertEqual(data['inserted'], 1)
+        self.assertEqual(data['errors'], [{'line': 3, 'error': 'unknown category 999'}])
+        res = json.loads(self.client().get('/api/categories/{}/questions'.format(cat_id)).data)
+        self.assertEqual(res['total_questions'], 4)
+
+    def test_import_questions_invalidates_once(self):
+        from flaskr.bulk import Importer
+        changes = []
+        self.app.extensions['trivia_change_listeners'].append(changes.append)
+        rows = [(i + 1, {'question': 'q{}'.format(i), 'answer': 'a', 'category': 1, 'difficulty': 1})
+                for i in range(5)]
+        with self.app.app_context():
+            importer = Importer(self.db.session, self.app.category_cache.get().categories, batch_size=2).run(rows)
+        self.assertEqual(importer.inserted, 5)
+        self.assertEqual([c.bulk for c in changes], [True])
+
+    def test_import_questions_failing_stream(self):
+        Question.query.delete()
+        self.db.session.commit()
+        self.assert_404(self.client().get('/api/questions'))
+        lines = [json.dumps({'question': 'q{}'.format(i), 'answer': 'a', 'category': 1, 'difficulty': 1})
+                 for i in range(1200)]
+        body = '\n'.join(lines).encode('utf-8') + b'\n\xff\xfe\n'
+        res = self.client().post('/api/questions/bulk', data=body, content_type='application/x-ndjson')
+        self.assertEqual(res.status_code, 400)
+        # the first batch was committed, the caches see it
+        data = json.loads(self.client().get('/api/questions').data)
+        self.assertEqual(data['total_questions'], 1000)
+
+    def test_export_questions(self):
+        self.generate_test_data(15)
+        res = self.client().get('/api/questions/export')
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        questions = [json.loads(line) for line in res.data.decode('utf-8').splitlines()]
+        self.assertEqual(len(questions), 15)
+        self.assertEqual(questions[0]['question'], 'question00')
+        self.assertEqual(set(questions[0].keys()), {'id', 'question', 'answer', 'category', 'difficulty'})
+
     def test_retrieve_category_questions(self):
         self.generate_test_data(5)
         
@@ -191,7 +861,61 @@ class TriviaTestCase(unittest.TestCase):
         self.generate_test_data(5)
         res = self.client().get('/api/categories/12/questions')
         self.assert_404(res)
-        
+
+    def test_retrieve_category_pack(self):
+        class ConfigPacks(ConfigTest):
+            QUIZ_PACK_DIR = tempfile.mkdtemp()
+
+        self.generate_test_data(5)
+        self.db.session.add(Question('question10', 'answer10', 4, 1))
+        self.db.session.commit()
+        app = create_app(test_config=ConfigPacks())
+        client = app.test_client()
+        res = client.get('/api/categories/4/pack', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers['Content-Encoding'], 'gzip')
+        data = json.loads(gzip.decompress(res.data))
+        self.assertEqual(data['version'], res.headers['ETag'].strip('"'))
+        self.assertEqual(data['category'], {'id': 4, 'type': 'category4'})
+        self.assertEqual([q['question'] for q in data['questions']], ['question04', 'question10'])
+        res = client.get('/api/categories/4/pack', headers={'If-None-Match': res.headers['ETag']})
+        self.assertEqual(res.status_code, 304)
+        # without gzip, the same content
+        self.assertEqual(json.loads(client.get('/api/categories/4/pack').data), data)
+        other = json.loads(client.get('/api/categories/3/pack').data)['version']
+        # only the pack of the changed category is rebuilt, the file of its previous version is removed
+        client.post('/api/questions', json=dict(self.new_question, category=4))
+        changed = json.loads(client.get('/api/categories/4/pack').data)
+        self.assertEqual(changed['total_questions'], 3)
+        self.assertNotEqual(changed['version'], data['version'])
+        self.assertEqual(json.loads(client.get('/api/categories/3/pack').data)['version'], other)
+        self.assertEqual(sorted(os.listdir(ConfigPacks.QUIZ_PACK_DIR)),
+                         ['3-{}.json.gz'.format(other), '4-{}.json.gz'.format(changed['version'])])
+        self.assertEqual(app.pack_store.builds, 3)
+        self.assert_404(client.get('/api/categories/999/pack'))
+        # the file removed by the rebuild of another worker, the pack is built again
+        os.remove(os.path.join(ConfigPacks.QUIZ_PACK_DIR, '3-{}.json.gz'.format(other)))
+        res = client.get('/api/categories/3/pack', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(json.loads(gzip.decompress(res.data))['version'], other)
+        self.assertEqual(app.pack_store.builds, 4)
+
+    def test_build_packs(self):
+        class ConfigPacks(ConfigTest):
+            QUIZ_PACK_DIR = tempfile.mkdtemp()
+
+        self.generate_test_data(3)
+        app = create_app(test_config=ConfigPacks())
+        result = app.test_cli_runner().invoke(args=['build-packs', '1', '2'])
+        self.assertEqual(result.exit_code, 0)
+        packs = self.read_packs(ConfigPacks.QUIZ_PACK_DIR)
+        self.assertEqual(sorted(name.split('-')[0] for name in packs), ['1', '2'])
+        # the same questions give the same files
+        for name in packs:
+            os.remove(os.path.join(ConfigPacks.QUIZ_PACK_DIR, name))
+        create_app(test_config=ConfigPacks()).test_cli_runner().invoke(args=['build-packs', '1', '2'])
+        self.assertEqual(self.read_packs(ConfigPacks.QUIZ_PACK_DIR), packs)
+        self.assertNotEqual(app.test_cli_runner().invoke(args=['build-packs', '999']).exit_code, 0)
+
     def test_generate_quiz(self):
         cat = Category(type='same category')
         self.db.session.add(cat)
@@ -232,6 +956,159 @@ class TriviaTestCase(unittest.TestCase):
             self.assertIsNotNone(res["question"]["answer"])
             quiz_input["previous_questions"].append(res["question"]["id"])
 
+    def test_generate_quiz_follows_changes(self):
+        self.generate_test_data(3, 2)
+        quiz_input = {"previous_questions": [], "quiz_category": {"type": "two", "id": "2"}}
+        res = json.loads(self.client().post('/api/quizzes', json=quiz_input).data)
+        quiz_input["previous_questions"].append(res["question"]["id"])
+        # a deleted question is not asked, a new one is
+        remaining = Question.query.filter(Question.id.notin_(quiz_input["previous_questions"])).all()
+        self.client().delete('/api/questions/{}'.format(remaining[0].id))
+        self.client().post('/api/questions', json=dict(self.new_question, category=2))
+        asked = []
+        for i in range(2):
+            res = json.loads(self.client().post('/api/quizzes', json=quiz_input).data)
+            asked.append(res["question"]["question"])
+            quiz_input["previous_questions"].append(res["question"]["id"])
+        self.assertTrue(self.new_question['question'] in asked)
+        self.assertFalse(remaining[0].question in asked)
+        res = json.loads(self.client().post('/api/quizzes', json=quiz_input).data)
+        self.assertIsNone(res["question"])
+
+    def play_quiz_session(self, client, size):
+        quiz_input = {"quiz_category": {"type": "two", "id": 2}}
+        res = json.loads(client.post('/api/quizzes/sessions', json=quiz_input).data)
+        self.assertTrue(res['success'])
+        self.assertEqual(res['total'], size)
+        session_id = res['session_id']
+        asked = []
+        for i in range(size):
+            res = json.loads(client.get('/api/quizzes/sessions/{}/next'.format(session_id)).data)
+            self.assertIsNotNone(res['question'])
+            self.assertEqual(res['remaining'], size - i - 1)
+            asked.append(res['question']['id'])
+        self.assertEqual(len(set(asked)), size)
+        return session_id
+
+    def test_quiz_session(self):
+        self.generate_test_data(5, 2)
+        session_id = self.play_quiz_session(self.client(), 5)
+        res = json.loads(self.client().get('/api/quizzes/sessions/{}/next'.format(session_id)).data)
+        self.assertIsNone(res['question'])
+
+    def test_quiz_session_database_store(self):
+        class ConfigDatabaseSessions(ConfigTest):
+            QUIZ_SESSION_STORE = 'database'
+
+        app = create_app(test_config=ConfigDatabaseSessions())
+        self.generate_test_data(5, 2)
+        self.play_quiz_session(app.test_client(), 5)
+
+    def test_quiz_session_error(self):
+        self.assert_404(self.client().get('/api/quizzes/sessions/unknown/next'))
+        res = self.client().post('/api/quizzes/sessions', json={"quiz_category": None})
+        self.assert_422(res)
+
+    def test_memory_session_store_eviction(self):
+        store = MemorySessionStore(capacity=2, ttl=60)
+        first = store.create(1, [1, 2])
+        second = store.create(1, [3])
+        self.assertEqual(store.pop(first), (1, 1))
+        # the least recently used is evicted
+        store.create(1, [4])
+        self.assertRaises(SessionNotFound, store.pop, second)
+        self.assertEqual(store.pop(first), (2, 0))
+        self.assertEqual(store.pop(first), (None, 0))
+
+    def test_id_pool(self):
+        pool = IdPool()
+        for i in range(10):
+            pool.add(i)
+        pool.remove(3)
+        pool.remove(9)
+        pool.remove(42)
+        self.assertEqual(sorted(pool.ids), [0, 1, 2, 4, 5, 6, 7, 8])
+        excluded = {0, 1, 2, 4, 5, 6, 7}
+        self.assertEqual(pool.draw(excluded), 8)
+        self.assertIsNone(pool.draw(excluded | {8}))
+        self.assertTrue(pool.draw({0}) in pool)
+
+    def test_category_pool_weighted_draw(self):
+        pool = CategoryPool()
+        for i in range(100):
+            pool.add(i, i % 5 + 1)
+        pool.remove(0, 1)
+        pool.discard(1)
+        self.assertEqual(len(pool), 98)
+        self.assertEqual(pool.difficulties(), [1, 2, 3, 4, 5])
+        weight = difficulty_weight(4, 0.01)
+        self.assertTrue(all(pool.draw(set(), weight) % 5 == 3 for i in range(50)))
+        # the questions of difficulty 4 are all excluded, the nearest ones are drawn
+        excluded = set(range(3, 100, 5))
+        draws = [pool.draw(excluded, difficulty_weight(4, 1)) for i in range(200)]
+        self.assertFalse(set(draws) & excluded)
+        self.assertTrue(sum(1 for id in draws if id % 5 in (2, 4)) > 150)
+        # too far from every difficulty left, uniform
+        self.assertFalse(pool.draw(excluded, weight) in excluded)
+        sample = pool.sample(98)
+        self.assertEqual(sorted(sample), list(range(2, 100)))
+        self.assertEqual(len(set(pool.sample(10))), 10)
+
+    def test_generate_quiz_difficulty(self):
+        class ConfigNarrow(ConfigTest):
+            QUIZ_DIFFICULTY_SPREAD = 0.01
+
+        # question i has the difficulty i
+        self.generate_test_data(10)
+        client = create_app(test_config=ConfigNarrow()).test_client()
+
+        def difficulty(**body):
+            body.setdefault('previous_questions', [])
+            body.setdefault('quiz_category', {'id': 0})
+            res = client.post('/api/quizzes', json=body)
+            self.assertEqual(res.status_code, 200)
+            return json.loads(res.data)['question']['difficulty']
+
+        self.assertEqual(difficulty(difficulty=7), 7)
+        self.assertEqual(difficulty(accuracy=1), 9)
+        self.assertEqual(difficulty(accuracy=0), 0)
+        ids = [id for id, in self.db.session.query(Question.id).order_by(Question.difficulty)]
+        # the second question of the curve
+        self.assertEqual(difficulty(curve=[2, 5], previous_questions=[ids[2]]), 5)
+        self.assertEqual(difficulty(curve=[2, 5], previous_questions=ids[2:4]), 5)
+        quiz_input = {'previous_questions': [], 'quiz_category': {'id': 0}}
+        self.assert_422(client.post('/api/quizzes', json=dict(quiz_input, accuracy=2)))
+        self.assert_422(client.post('/api/quizzes', json=dict(quiz_input, curve='hard')))
+
+    def test_generate_quiz_count(self):
+        self.generate_test_data(10, category=1)
+        ids = [id for id, in self.db.session.query(Question.id)]
+        quiz_input = {'previous_questions': ids[:3], 'quiz_category': {'id': 1}, 'count': 5}
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        # the pool is loaded before, the questions are fetched in one query
+        self.app.question_pool.rebuild()
+        event.listen(self.db.engine, 'before_cursor_execute', record)
+        try:
+            res = self.client().post('/api/quizzes', json=quiz_input)
+        finally:
+            event.remove(self.db.engine, 'before_cursor_execute', record)
+        self.assertEqual(len(statements), 1)
+        questions = json.loads(res.data)['questions']
+        self.assertEqual(len(questions), 5)
+        drawn = {question['id'] for question in questions}
+        self.assertEqual(len(drawn), 5)
+        self.assertFalse(drawn & set(ids[:3]))
+        self.assertTrue(all(question['category'] == 1 for question in questions))
+        # only 2 left
+        res = self.client().post('/api/quizzes', json=dict(quiz_input, previous_questions=list(drawn) + ids[:3]))
+        self.assertEqual(len(json.loads(res.data)['questions']), 2)
+        self.assert_422(self.client().post('/api/quizzes', json=dict(quiz_input, count=0)))
+        self.assert_422(self.client().post('/api/quizzes', json=dict(quiz_input, count='5')))
+
     def test_generate_quiz_no_category(self):
         self.db.session.commit()
         self.generate_test_data(10)
@@ -240,6 +1117,186 @@ class TriviaTestCase(unittest.TestCase):
         res = self.client().post('/api/quizzes', json=quiz_input)
         self.assert_422(res)
 
+    def test_question_encoder(self):
+        self.generate_test_data(3)
+        rows = question_rows(Question.query.order_by(Question.id)).all()
+        payload = {'success': True, 'categories': {1: 'Science'}}
+        expected = dict(payload, questions=[q.format() for q in Question.query.order_by(Question.id)])
+        expected['categories'] = {'1': 'Science'}
+        encoder = QuestionEncoder(2)
+        self.assertEqual(json.loads(QuestionEncoder(0).encode(payload, rows)), expected)
+        self.assertEqual(json.loads(encoder.encode(payload, rows)), expected)
+        # served again from the 2 fragments kept
+        self.assertEqual(json.loads(encoder.encode(payload, rows[1:])), dict(expected, questions=expected['questions'][1:]))
+        self.assertEqual(json.loads(encoder.encode({}, [])), {'questions': []})
+
+    def test_queries_use_indexes(self):
+        if self.db.engine.dialect.name != 'postgresql':
+            self.skipTest('the plans are checked on PostgreSQL only')
+        class ConfigIndexes(ConfigTest):
+            SEARCH_ENGINE = 'fulltext'
+            RESPONSE_CACHE_SIZE = 0
+
+        # enough questions for the planner to prefer an index to a scan of the table
+        Question.query.delete()
+        self.db.session.execute(Question.__table__.insert(), [{
+            'question': 'question {:05d}'.format(i), 'answer': 'answer {}'.format(i),
+            'category': i % 6 + 1, 'difficulty': i % 5 + 1} for i in range(20000)])
+        self.db.session.commit()
+        self.db.session.execute('ANALYZE questions')
+        self.db.session.commit()
+        ids = [id for id, in self.db.session.query(Question.id).order_by(Question.id).limit(3)]
+        self.db.session.remove()
+        app = create_app(test_config=ConfigIndexes())
+        client = app.test_client()
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+
+        # the quiz pool reads every id once, not per request
+        app.question_pool.rebuild()
+        engine = app.db.get_engine(app)
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            for url in ['/api/questions?page=3', '/api/categories/3/questions?page=3',
+                        '/api/questions?searchTerm=00123', '/api/questions?searchTerm=00123&exact=false']:
+                self.assertEqual(client.get(url).status_code, 200)
+            for url in ['/api/questions?after=', '/api/categories/3/questions?after=']:
+                data = json.loads(client.get(url).data)
+                self.assertEqual(client.get(url + data['next_cursor']).status_code, 200)
+            quiz_input = {"previous_questions": [], "quiz_category": {"type": "three", "id": 3}}
+            question_id = json.loads(client.post('/api/quizzes', json=quiz_input).data)['question']['id']
+            session_id = json.loads(client.post('/api/quizzes/sessions', json=quiz_input).data)['session_id']
+            self.assertEqual(client.get('/api/quizzes/sessions/{}/next'.format(session_id)).status_code, 200)
+            self.assertEqual(client.delete('/api/questions/{}'.format(question_id)).status_code, 200)
+            self.assertEqual(client.delete('/api/questions?ids={}'.format(','.join(map(str, ids)))).status_code, 200)
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+
+        def scans(plan):
+            yield plan
+            for child in plan.get('Plans', []):
+                yield from scans(child)
+
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            checked = 0
+            for statement, parameters in statements:
+                # the estimate of the search is already a plan
+                if 'questions' not in statement or statement.lstrip().upper().startswith(('INSERT', 'EXPLAIN')):
+                    continue
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + statement, parameters)
+                plan = cursor.fetchone()[0][0]['Plan']
+                tables = [node['Relation Name'] for node in scans(plan) if node['Node Type'] == 'Seq Scan']
+                self.assertNotIn('questions', tables, statement)
+                checked += 1
+            self.assertTrue(checked >= 10)
+        finally:
+            connection.close()
+
+    def test_asgi_app(self):
+        if self.db.engine.dialect.name != 'postgresql':
+            self.skipTest('the ASGI app runs on PostgreSQL only')
+        import asyncio
+        from flaskr.asgi import create_asgi_app
+        self.generate_test_data(15)
+        self.db.session.remove()
+
+        async def play():
+            async with create_asgi_app(test_config=ConfigTest()).test_app() as app:
+                client = app.test_client()
+                res = await client.get('/api/questions?page=2')
+                data = json.loads(await res.get_data())
+                self.assertEqual(data['total_questions'], 15)
+                self.assertEqual(len(data['questions']), 5)
+                res = await client.get('/api/questions?page=3')
+                self.assertEqual(res.status_code, 404)
+                self.assertEqual(json.loads(await res.get_data())['message'], 'resource not found')
+                res = await client.get('/api/questions?after=')
+                data = json.loads(await res.get_data())
+                res = await client.get('/api/questions?after=' + data['next_cursor'])
+                self.assertEqual(len(json.loads(await res.get_data())['questions']), 5)
+                quiz_input = {"previous_questions": [], "quiz_category": {"type": "click", "id": 0}}
+                for i in range(15):
+                    res = await client.post('/api/quizzes', json=quiz_input)
+                    quiz_input["previous_questions"].append(json.loads(await res.get_data())["question"]["id"])
+                res = await client.post('/api/quizzes', json=quiz_input)
+                self.assertIsNone(json.loads(await res.get_data())["question"])
+                res = await client.post('/api/quizzes', json={"previous_questions": []})
+                self.assertEqual(res.status_code, 422)
+                res = await client.post('/api/quizzes', json=dict(quiz_input, previous_questions=[], count=20))
+                self.assertEqual(len(json.loads(await res.get_data())['questions']), 15)
+
+        asyncio.run(play())
+
+    def test_asgi_ranked_cursor(self):
+        if self.db.engine.dialect.name != 'postgresql':
+            self.skipTest('the ASGI app runs on PostgreSQL only')
+        import asyncio
+        from flaskr.asgi import create_asgi_app
+
+        class ConfigFullText(ConfigTest):
+            SEARCH_ENGINE = 'fulltext'
+
+        Question.query.delete()
+        # the questions repeating the word are the most relevant, whatever their text
+        for i in range(QUESTIONS_PER_PAGE + 5):
+            self.db.session.add(Question('{} capital'.format(i) + ' capital' * (i % 3), 'a', 1, 1))
+        self.db.session.commit()
+        self.db.session.remove()
+
+        async def walk():
+            async with create_asgi_app(test_config=ConfigFullText()).test_app() as app:
+                client = app.test_client()
+                paged = []
+                for page in (1, 2):
+                    res = await client.get('/api/questions?searchTerm=capital&page={}'.format(page))
+                    paged += [q['id'] for q in json.loads(await res.get_data())['questions']]
+                data = json.loads(await (await client.get('/api/questions?searchTerm=capital&after=')).get_data())
+                seen = [q['id'] for q in data['questions']]
+                res = await client.get('/api/questions?searchTerm=capital&after=' + data['next_cursor'])
+                data = json.loads(await res.get_data())
+                seen += [q['id'] for q in data['questions']]
+                self.assertIsNone(data['next_cursor'])
+                self.assertEqual(seen, paged)
+                self.assertEqual(len(set(seen)), QUESTIONS_PER_PAGE + 5)
+
+        asyncio.run(walk())
+
+
+    def test_asgi_reload_survives_errors(self):
+        if self.db.engine.dialect.name != 'postgresql':
+            self.skipTest('the ASGI app runs on PostgreSQL only')
+        import asyncio
+        from flaskr.asgi import create_asgi_app
+
+        class ConfigReload(ConfigTest):
+            CATEGORY_CACHE_TTL = 0.05
+
+        self.generate_test_data(3)
+        self.db.session.remove()
+
+        async def play():
+            asgi = create_asgi_app(test_config=ConfigReload())
+            async with asgi.test_app():
+                loads = []
+                original = asgi.question_pool.load
+
+                def load(rows, version=None):
+                    loads.append(len(rows))
+                    if len(loads) == 1:
+                        raise ConnectionError('database restarting')
+                    return original(rows, version)
+
+                # the first reload fails, the next ones still run
+                asgi.question_pool.load = load
+                await asyncio.sleep(0.3)
+                self.assertFalse(asgi.reloader.done())
+                self.assertTrue(len(loads) >= 2)
+
+        asyncio.run(play())
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -0,0 +1,11 @@
+from flaskr import create_app
+from flaskr.launch import warm_up
+
+'''
+WSGI entry point of the production server, see gunicorn.conf.py
+
+    gunicorn -c gunicorn.conf.py
+'''
+
+app = create_app()
+warm_up(app)
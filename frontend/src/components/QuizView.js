@@ -16,6 +16,7 @@ class QuizView extends Component {
         categories: {},
         numCorrect: 0,
         currentQuestion: {},
+        questions: [],
         guess: '',
         forceEnd: false
     }
@@ -37,38 +38,31 @@ class QuizView extends Component {
   }
 
   selectCategory = ({type, id=0}) => {
-    this.setState({quizCategory: {type, id}}, this.getNextQuestion)
+    this.setState({quizCategory: {type, id}}, this.loadQuestions)
   }
 
   handleChange = (event) => {
     this.setState({[event.target.name]: event.target.value})
   }
 
-  getNextQuestion = () => {
-    const previousQuestions = [...this.state.previousQuestions]
-    if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
-
+  // all the questions of the play in one request
+  loadQuestions = () => {
     $.ajax({
       url: `${api}/quizzes`, //TODO: update request URL
       type: "POST",
       dataType: 'json',
       contentType: 'application/json',
       data: JSON.stringify({
-        previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory
+        previous_questions: this.state.previousQuestions,
+        quiz_category: this.state.quizCategory,
+        count: questionsPerPlay
       }),
       xhrFields: {
         withCredentials: true
       },
       crossDomain: true,
       success: (result) => {
-        this.setState({
-          showAnswer: false,
-          previousQuestions: previousQuestions,
-          currentQuestion: result.question,
-          guess: '',
-          forceEnd: result.question ? false : true
-        })
+        this.setState({ questions: result.questions }, this.getNextQuestion)
         return;
       },
       error: (error) => {
@@ -78,6 +72,21 @@ class QuizView extends Component {
     })
   }
 
+  getNextQuestion = () => {
+    const previousQuestions = [...this.state.previousQuestions]
+    if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
+    const [nextQuestion, ...questions] = this.state.questions
+
+    this.setState({
+      showAnswer: false,
+      previousQuestions: previousQuestions,
+      currentQuestion: nextQuestion || {},
+      questions: questions,
+      guess: '',
+      forceEnd: nextQuestion ? false : true
+    })
+  }
+
   submitGuess = (event) => {
     event.preventDefault();
     const formatGuess = this.state.guess.replace(/[.,\/#!$%\^&\*;:{}=\-_`~()]/g,"").toLowerCase()
@@ -95,6 +104,7 @@ class QuizView extends Component {
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
+      questions: [],
       guess: '',
       forceEnd: false
     })